@@ -1,17 +1,69 @@
+import base64
+import bisect
+import concurrent.futures
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import gzip
+import hashlib
+import heapq
 import json
 import logging
+import multiprocessing
+import mimetypes
+import mmap
 import os
+import posixpath
+import random
+import re
+import select
 import shutil
-from datetime import datetime, timezone
+import sqlite3
+import stat
+import struct
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
+from types import MappingProxyType, ModuleType
+from typing import NamedTuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote, quote_plus, urlencode
+from urllib.request import Request, urlopen
 
 import humanize
-from flask import Flask, render_template, send_from_directory, redirect, request, url_for
-from flask import jsonify
+from flask import Flask, render_template, send_from_directory, redirect, request, url_for, abort, make_response
+from flask import Response, g, jsonify, stream_with_context
 from logging_loki import LokiHandler
 from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 
+try:
+    import orjson
+except ImportError:  # Optional: faster JSON encoding for log lines
+    orjson = None
+
+try:
+    import thumbnails
+except ImportError:  # Optional: image thumbnails need Pillow
+    thumbnails = None
+
+try:
+    import prometheus_client
+    import prometheus_client.multiprocess
+except ImportError:  # Optional: /_api/metrics needs prometheus_client
+    prometheus_client = None
+
 # Read environment variables
 base = os.getenv('BASE', "files")
 port = int(os.getenv('FLASK_PORT', 5000))
@@ -19,8 +71,45 @@ host = os.getenv('FLASK_HOST', '127.0.0.1')
 debug = os.getenv('FLASK_DEBUG', 'False').lower() in ('true', '1', 't')
 enable_upload = os.getenv('ENABLE_UPLOAD', 'False').lower() in ('true', '1', 't')
 enable_new_folder = os.getenv('ENABLE_NEW_FOLDER', 'False').lower() in ('true', '1', 't')
+enable_delete = os.getenv('ENABLE_DELETE', 'True').lower() in ('true', '1', 't')
 notice_text = os.getenv('NOTICE_TEXT', '')
 loki_url = os.getenv('LOKI_URL', '')
+loki_async = os.getenv('LOKI_ASYNC', 'True').lower() in ('true', '1', 't')
+loki_batch_size = int(os.getenv('LOKI_BATCH_SIZE', 500))
+loki_flush_interval = float(os.getenv('LOKI_FLUSH_INTERVAL', 1.0))
+loki_queue_size = int(os.getenv('LOKI_QUEUE_SIZE', 10000))
+loki_compress = os.getenv('LOKI_COMPRESS', 'True').lower() in ('true', '1', 't')
+log_verbose_sample_rate = float(os.getenv('LOG_VERBOSE_SAMPLE_RATE', 1.0))
+log_sampled_endpoints = {e.strip() for e in os.getenv('LOG_SAMPLED_ENDPOINTS', 'root,api_list').split(',') if e.strip()}
+listing_cache_size = int(os.getenv('LISTING_CACHE_SIZE', 256))
+listing_cache_ttl = float(os.getenv('LISTING_CACHE_TTL', 30))
+listing_cache_max_rows = int(os.getenv('LISTING_CACHE_MAX_ROWS', 200000))
+api_max_page_size = int(os.getenv('API_MAX_PAGE_SIZE', 10000))
+download_offload = os.getenv('DOWNLOAD_OFFLOAD', '').lower()
+download_offload_prefix = '/' + os.getenv('DOWNLOAD_OFFLOAD_PREFIX', '/_protected_files/').strip('/') + '/'
+enable_search = os.getenv('ENABLE_SEARCH', 'False').lower() in ('true', '1', 't')
+index_path = os.getenv('INDEX_PATH', os.path.join(tempfile.gettempdir(), 'flask-file-browser-index.sqlite3'))
+search_crawl_interval = float(os.getenv('SEARCH_CRAWL_INTERVAL', 600))
+enable_dir_sizes = os.getenv('ENABLE_DIR_SIZES', 'False').lower() in ('true', '1', 't')
+file_types_path = os.getenv('FILE_TYPES', '')
+client_render_threshold = int(os.getenv('CLIENT_RENDER_THRESHOLD', 0))
+trash_retention = float(os.getenv('TRASH_RETENTION', 3600))
+trash_purge_rate = float(os.getenv('TRASH_PURGE_RATE', 2000))
+enable_thumbnails = os.getenv('ENABLE_THUMBNAILS', 'False').lower() in ('true', '1', 't')
+thumbnail_cache_dir = os.getenv('THUMBNAIL_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'flask-file-browser-thumbnails'))
+thumbnail_cache_size = int(os.getenv('THUMBNAIL_CACHE_SIZE', 1024 ** 3))
+thumbnail_workers = int(os.getenv('THUMBNAIL_WORKERS', 2))
+checksum_db_path = os.getenv('CHECKSUM_DB', os.path.join(tempfile.gettempdir(), 'flask-file-browser-checksums.sqlite3'))
+checksum_workers = int(os.getenv('CHECKSUM_WORKERS', 4))
+enable_watcher = os.getenv('ENABLE_WATCHER', 'False').lower() in ('true', '1', 't')
+watcher_backend = os.getenv('WATCHER_BACKEND', 'auto').lower()
+watcher_coalesce = float(os.getenv('WATCHER_COALESCE', 0.5))
+watcher_max_delay = float(os.getenv('WATCHER_MAX_DELAY', 5.0))
+watcher_poll_interval = float(os.getenv('WATCHER_POLL_INTERVAL', 5.0))
+upload_chunk_size = int(os.getenv('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+upload_session_ttl = float(os.getenv('UPLOAD_SESSION_TTL', 24 * 3600))
+enable_metrics = os.getenv('ENABLE_METRICS', 'False').lower() in ('true', '1', 't')
+metrics_multiproc_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR', '')
 
 print(f"Configuration:")
 print(f"  BASE: {base}")
@@ -29,8 +118,51 @@ print(f"  FLASK_HOST: {host}")
 print(f"  FLASK_DEBUG: {debug}")
 print(f"  ENABLE_UPLOAD: {enable_upload}")
 print(f"  ENABLE_NEW_FOLDER: {enable_new_folder}")
+print(f"  ENABLE_DELETE: {enable_delete}")
 print(f"  NOTICE_TEXT: {notice_text}")
 print(f"  LOKI_URL: {loki_url}")
+print(f"  LOKI_ASYNC: {loki_async}")
+print(f"  LOKI_BATCH_SIZE: {loki_batch_size}")
+print(f"  LOKI_FLUSH_INTERVAL: {loki_flush_interval}")
+print(f"  LOKI_QUEUE_SIZE: {loki_queue_size}")
+print(f"  LOKI_COMPRESS: {loki_compress}")
+print(f"  LOG_VERBOSE_SAMPLE_RATE: {log_verbose_sample_rate}")
+print(f"  LOG_SAMPLED_ENDPOINTS: {','.join(sorted(log_sampled_endpoints))}")
+print(f"  LISTING_CACHE_SIZE: {listing_cache_size}")
+print(f"  LISTING_CACHE_TTL: {listing_cache_ttl}")
+print(f"  LISTING_CACHE_MAX_ROWS: {listing_cache_max_rows}")
+print(f"  API_MAX_PAGE_SIZE: {api_max_page_size}")
+print(f"  DOWNLOAD_OFFLOAD: {download_offload}")
+print(f"  DOWNLOAD_OFFLOAD_PREFIX: {download_offload_prefix}")
+print(f"  ENABLE_SEARCH: {enable_search}")
+print(f"  INDEX_PATH: {index_path}")
+print(f"  SEARCH_CRAWL_INTERVAL: {search_crawl_interval}")
+print(f"  ENABLE_DIR_SIZES: {enable_dir_sizes}")
+print(f"  FILE_TYPES: {file_types_path}")
+print(f"  CLIENT_RENDER_THRESHOLD: {client_render_threshold}")
+print(f"  TRASH_RETENTION: {trash_retention}")
+print(f"  TRASH_PURGE_RATE: {trash_purge_rate}")
+print(f"  ENABLE_THUMBNAILS: {enable_thumbnails}")
+print(f"  THUMBNAIL_CACHE_DIR: {thumbnail_cache_dir}")
+print(f"  THUMBNAIL_CACHE_SIZE: {thumbnail_cache_size}")
+print(f"  THUMBNAIL_WORKERS: {thumbnail_workers}")
+print(f"  CHECKSUM_DB: {checksum_db_path}")
+print(f"  CHECKSUM_WORKERS: {checksum_workers}")
+if enable_thumbnails and thumbnails is None:
+    print("  Thumbnails disabled: Pillow is not installed")
+    enable_thumbnails = False
+print(f"  ENABLE_WATCHER: {enable_watcher}")
+print(f"  WATCHER_BACKEND: {watcher_backend}")
+print(f"  WATCHER_COALESCE: {watcher_coalesce}")
+print(f"  WATCHER_MAX_DELAY: {watcher_max_delay}")
+print(f"  WATCHER_POLL_INTERVAL: {watcher_poll_interval}")
+print(f"  UPLOAD_CHUNK_SIZE: {upload_chunk_size}")
+print(f"  UPLOAD_SESSION_TTL: {upload_session_ttl}")
+print(f"  ENABLE_METRICS: {enable_metrics}")
+print(f"  PROMETHEUS_MULTIPROC_DIR: {metrics_multiproc_dir}")
+if enable_metrics and prometheus_client is None:
+    print("  Metrics disabled: prometheus_client is not installed")
+    enable_metrics = False
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 
@@ -38,6 +170,10 @@ app = Flask(__name__, template_folder='templates', static_folder='static')
 # This will respect X-Forwarded-* headers when present, but works fine without them
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 
+# Let the front-end server stream file bodies (see DOWNLOAD_OFFLOAD in README.md)
+if download_offload == 'sendfile':
+    app.config['USE_X_SENDFILE'] = True
+
 # Map file extensions to categories
 file_extension_to_category = {
     'dockerfile': 'docker',
@@ -148,6 +284,10 @@ file_extension_to_category = {
     '.xz': 'archive',
     '.zst': 'archive',
     '.tgz': 'archive',
+    '.tar.gz': 'archive',
+    '.tar.bz2': 'archive',
+    '.tar.xz': 'archive',
+    '.tar.zst': 'archive',
     '.xml': 'xml',
     '.toml': 'config',
     '.conf': 'config',
@@ -258,26 +398,143 @@ category_to_icon_and_color = {
 }
 
 
+default_icon_and_color = ('ti ti-file', '#212529')
+default_file_type = ('default', *default_icon_and_color)
+folder_icon_and_color = ('ti ti-folder-filled', '#5988da')
+
+
+class FileTypes(NamedTuple):
+    """Immutable name -> (category, icon, colour) lookup tables, resolved once at import.
+
+    `names` holds whole basenames (`dockerfile`, `id_rsa`, `.gitignore`) and
+    `suffixes` holds extensions, including multi-part ones such as `.tar.gz`.
+    Both are keyed in lower case. `compound_tails` holds the last extension of
+    every multi-part suffix, so only names ending in one of them need more
+    than a single lookup.
+    """
+    names: MappingProxyType
+    suffixes: MappingProxyType
+    compound_tails: frozenset
+    max_suffix_dots: int
+
+
+def _load_file_types(path):
+    """Build FileTypes from the built-in maps, extended by the JSON mapping file at `path`.
+
+    The file may contain `categories` (category -> [icon, colour]) and
+    `extensions` (basename or .suffix -> category) objects; its entries
+    override the built-in ones.
+    """
+    extensions = dict(file_extension_to_category)
+    categories = dict(category_to_icon_and_color)
+    if path:
+        with open(path, encoding='utf-8') as f:
+            overrides = json.load(f)
+        categories.update({name: tuple(value) for name, value in overrides.get('categories', {}).items()})
+        extensions.update(overrides.get('extensions', {}))
+
+    names, suffixes = {}, {}
+    for key, category in extensions.items():
+        resolved = (category, *categories.get(category, default_icon_and_color))
+        key = key.lower()
+        names[key] = resolved
+        if key.startswith('.'):
+            suffixes[key] = resolved
+    return FileTypes(
+        names=MappingProxyType(names),
+        suffixes=MappingProxyType(suffixes),
+        compound_tails=frozenset(key[key.rfind('.'):] for key in suffixes if key.count('.') > 1),
+        max_suffix_dots=max((key.count('.') for key in suffixes), default=1),
+    )
+
+
+file_types = _load_file_types(file_types_path)
+
+
+def _file_type(file_name):
+    """Return (category, icon, colour) for a file name, preferring the longest matching suffix."""
+    name = file_name.rpartition('/')[2].lower()
+    found = file_types.names.get(name)
+    if found is not None:
+        return found
+    dot = name.rfind('.')
+    if dot < 0:
+        return default_file_type
+    ext = name[dot:]
+    if ext in file_types.compound_tails:
+        parts = name.rsplit('.', file_types.max_suffix_dots)
+        for i in range(1, len(parts) - 1):
+            found = file_types.suffixes.get('.' + '.'.join(parts[i:]))
+            if found is not None:
+                return found
+    return file_types.suffixes.get(ext, default_file_type)
+
+
+def get_file_category(file_name):
+    return _file_type(file_name)[0]
+
+
 def get_file_icon_and_color(file_name):
-    # Check if the full file name is in the map
-    if file_name.lower() in file_extension_to_category:
-        category = file_extension_to_category[file_name.lower()]
-    else:
-        # Check if the file extension is in the map
-        _, ext = os.path.splitext(file_name)
-        category = file_extension_to_category.get(ext, 'default')
+    return _file_type(file_name)[1:]
+
 
-    # Get the icon and color for the category
-    return category_to_icon_and_color.get(category, ('ti ti-file', '#212529'))  # Default icon and color if not found
+# (directory, filename) -> next "name (N)" suffix to try, so repeated uploads of the
+# same name do not rescan the directory.
+_unique_name_hints = OrderedDict()
+_unique_name_lock = threading.Lock()
+
+
+def _reserve_filename(directory, filename):
+    """Atomically create an empty `filename` in `directory`; False if it already exists."""
+    try:
+        os.close(os.open(os.path.join(directory, filename), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+    except FileExistsError:
+        return False
+    return True
+
+
+def _highest_suffix(directory, base, ext):
+    """Return the largest N among "base (N)ext" entries in `directory` (0 if none), with one scandir."""
+    pattern = re.compile(re.escape(base) + r' \((\d+)\)' + re.escape(ext))
+    highest = 0
+    with os.scandir(directory) as it:
+        for entry in it:
+            match = pattern.fullmatch(entry.name)
+            if match:
+                highest = max(highest, int(match.group(1)))
+    return highest
 
 
 def get_unique_filename(directory, filename):
+    """Reserve and return a name for `filename` in `directory` that no other upload can take.
+
+    The name is claimed by creating an empty placeholder with O_CREAT|O_EXCL,
+    which is atomic across worker processes; the caller then overwrites it.
+    On collision the next "name (N)" suffix comes from a per-directory hint,
+    seeded by a single scandir, instead of probing suffixes one by one.
+    """
+    if _reserve_filename(directory, filename):
+        return filename
+
     base, ext = os.path.splitext(filename)
-    counter = 1
-    new_filename = filename
-    while os.path.exists(os.path.join(directory, new_filename)):
+    key = (os.path.abspath(directory), filename)
+    with _unique_name_lock:
+        counter = _unique_name_hints.get(key)
+    if counter is None:
+        counter = _highest_suffix(directory, base, ext) + 1
+
+    while True:
         new_filename = f"{base} ({counter}){ext}"
-        counter += 1
+        if _reserve_filename(directory, new_filename):
+            break
+        # Someone else created names behind our back: re-seed from disk once.
+        counter = max(counter, _highest_suffix(directory, base, ext)) + 1
+
+    with _unique_name_lock:
+        _unique_name_hints[key] = counter + 1
+        _unique_name_hints.move_to_end(key)
+        if len(_unique_name_hints) > 4096:
+            _unique_name_hints.popitem(last=False)
     return new_filename
 
 
@@ -297,9 +554,81 @@ def _resolve_path_in_base(user_path: str) -> Path:
     return candidate
 
 
+# Folders directly under BASE that the application keeps for itself.
+# They never show up in listings, search results or downloads.
+# `_api` is reserved so that the fixed endpoints under /_api/ never shadow
+# a user folder; /api/<path> is left to file and folder downloads only.
+upload_staging_name = '.uploads'
+trash_name = '.trash'
+api_prefix = '_api'
+_internal_names = {upload_staging_name, trash_name, api_prefix}
+_base_norm = os.path.normpath(base)
+
+
+def _is_internal(rel_path):
+    """True if `rel_path` (relative to BASE) is, or is inside, an internal folder."""
+    return posixpath.normpath('/' + (rel_path or '').strip('/')).split('/')[1] in _internal_names
+
+
+def _is_internal_entry(entry):
+    """True if the os.DirEntry `entry` is an internal folder directly under BASE."""
+    return entry.name in _internal_names and os.path.normpath(os.path.dirname(entry.path)) == _base_norm
+
+
+class RequestEvent:
+    """A request log event, captured on the request thread with as little work as possible.
+
+    Only references to already-parsed request values are stored; timestamps are
+    kept as epoch floats and turned into dicts/ISO strings by JsonLogFormatter,
+    which runs on the Loki shipping thread.
+    """
+
+    __slots__ = ('created', 'endpoint', 'path', 'method', 'status_code', 'remote_addr',
+                 'request_remote_addr', 'x_forwarded_for', 'x_real_ip',
+                 'user_agent', 'referrer', 'access_route', 'extra')
+
+    def __init__(self, endpoint, path, method, status_code, extra):
+        self.created = time.time()
+        self.endpoint = endpoint
+        self.path = path
+        self.method = method
+        self.status_code = status_code
+        self.extra = extra
+        self.user_agent = None
+        self.referrer = None
+        self.access_route = None
+
+    def to_dict(self):
+        data = {
+            'timestamp': datetime.fromtimestamp(self.created, tz=timezone.utc).isoformat(),
+            'endpoint': self.endpoint,
+            'path': self.path,
+            'method': self.method,
+            'remote_addr': self.remote_addr,
+            'x_forwarded_for': self.x_forwarded_for,
+            'x_real_ip': self.x_real_ip,
+            'request_remote_addr': self.request_remote_addr,
+        }
+        if self.access_route is not None:
+            data['user_agent'] = self.user_agent
+            data['referrer'] = self.referrer
+            data['access_route'] = self.access_route
+        if self.status_code:
+            data['status_code'] = self.status_code
+        data.update(self.extra)
+        return data
+
+
+def _json_dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload, default=str).decode()
+    return json.dumps(payload, ensure_ascii=False, default=str)
+
+
 class JsonLogFormatter(logging.Formatter):
     """Emit one-line JSON suitable for Loki/Grafana parsing.
 
+    - If the log message is a RequestEvent, its fields are embedded at the top level.
     - If the log message is a dict, it is embedded as a JSON object (not stringified).
     - If the log message is a string, it is stored under "message".
     - Any attributes passed via logger(..., extra={...}) are merged into the payload.
@@ -329,7 +658,10 @@ class JsonLogFormatter(logging.Formatter):
 
         # Handle record message
         msg = record.msg
-        if isinstance(msg, dict):
+        if isinstance(msg, RequestEvent):
+            payload.update(msg.to_dict())
+            payload.setdefault('message', 'request')
+        elif isinstance(msg, dict):
             # Put dict keys at top-level (keeps table columns simple)
             payload.update(msg)
             payload.setdefault('message', 'request')
@@ -339,7 +671,139 @@ class JsonLogFormatter(logging.Formatter):
         if record.exc_info:
             payload['exc_info'] = self.formatException(record.exc_info)
 
-        return json.dumps(payload, ensure_ascii=False, default=str)
+        return _json_dumps(payload)
+
+
+class BatchingLokiHandler(logging.Handler):
+    """Ship log records to Loki in batches from a background thread.
+
+    emit() only appends the record to a bounded in-memory queue, so request
+    threads never wait for Loki. When the queue is full the oldest record is
+    dropped and counted. The worker thread flushes once `batch_size` records
+    are queued or `flush_interval` seconds have passed, formats the records,
+    groups them into Loki streams, optionally gzips the body and retries
+    failed pushes with exponential backoff.
+
+    Streams carry the same labels as logging_loki.LokiHandler (the given tags
+    plus `severity` and `logger`), so existing Grafana queries keep working.
+    """
+
+    def __init__(self, url, tags=None, batch_size=500, flush_interval=1.0, queue_size=10000,
+                 compress=True, max_retries=5, backoff=0.5, timeout=10):
+        super().__init__()
+        self.url = url
+        self.tags = dict(tags or {})
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.compress = compress
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.retries = 0
+        self._pid = None
+        self._closing = False
+        self._thread = None
+        self._queue = deque()
+        self._cond = threading.Condition()
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start_worker()
+        with self._cond:
+            if len(self._queue) >= self.queue_size:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append(record)
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self):
+        """Wake the worker so queued records are pushed without waiting for the interval."""
+        with self._cond:
+            self._cond.notify()
+
+    def close(self):
+        """Push what is still queued (bounded by the request timeout) and stop the worker."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(self.timeout)
+        super().close()
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._queue)
+        return {'queued': queued, 'sent': self.sent, 'dropped': self.dropped,
+                'failed': self.failed, 'retries': self.retries}
+
+    def _start_worker(self):
+        # Called lazily so forked workers (e.g. gunicorn) each get their own thread and queue.
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._thread = threading.Thread(target=self._run, name='loki-shipper', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._queue) < self.batch_size and not self._closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                closing = self._closing
+            if batch:
+                self._push(batch)
+            if closing and not self._queue:
+                return
+
+    def _build_payload(self, batch):
+        streams = {}
+        for record in batch:
+            try:
+                line = self.format(record)
+            except Exception:
+                self.handleError(record)
+                continue
+            labels = (record.levelname.lower(), record.name)
+            streams.setdefault(labels, []).append([str(int(record.created * 1e9)), line])
+        return {'streams': [
+            {'stream': {**self.tags, 'severity': severity, 'logger': logger}, 'values': values}
+            for (severity, logger), values in streams.items()
+        ]}
+
+    def _push(self, batch):
+        body = json.dumps(self._build_payload(batch)).encode()
+        headers = {'Content-Type': 'application/json'}
+        if self.compress:
+            body = gzip.compress(body, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                with urlopen(Request(self.url, data=body, headers=headers, method='POST'),
+                             timeout=self.timeout):
+                    pass
+                self.sent += len(batch)
+                return
+            except HTTPError as e:
+                # Client errors (other than rate limiting) will not succeed on retry.
+                if e.code < 500 and e.code != 429:
+                    break
+            except (URLError, OSError):
+                pass
+            if attempt < self.max_retries and not self._closing:
+                self.retries += 1
+                time.sleep(self.backoff * 2 ** attempt)
+        self.failed += len(batch)
 
 
 def setup_loki_logger(loki_url: str) -> logging.Logger:
@@ -358,11 +822,21 @@ def setup_loki_logger(loki_url: str) -> logging.Logger:
         loki_url = f"{loki_url.rstrip('/')}/loki/api/v1/push"
 
     # Add Loki handler with JSON formatter
-    loki_handler = LokiHandler(
-        url=loki_url,
-        tags={"application": "files_server"},
-        version="1",
-    )
+    if loki_async:
+        loki_handler = BatchingLokiHandler(
+            url=loki_url,
+            tags={"application": "files_server"},
+            batch_size=loki_batch_size,
+            flush_interval=loki_flush_interval,
+            queue_size=loki_queue_size,
+            compress=loki_compress,
+        )
+    else:
+        loki_handler = LokiHandler(
+            url=loki_url,
+            tags={"application": "files_server"},
+            version="1",
+        )
 
     # Ensure %(message)s is always valid JSON (not Python dict repr)
     loki_handler.setFormatter(JsonLogFormatter())
@@ -375,34 +849,131 @@ loki_logger = setup_loki_logger(loki_url)
 
 
 def log_request_info(endpoint, path, method, status_code=None, **kwargs):
-    """Log request information as JSON."""
+    """Log request information as JSON.
+
+    Verbose fields (user agent, referrer, access route) are only captured for a
+    LOG_VERBOSE_SAMPLE_RATE fraction of requests to LOG_SAMPLED_ENDPOINTS.
+    """
     if not loki_logger.handlers:
         return  # Skip if Loki logging is not configured
 
-    real_ip = (request.access_route[0] if request.access_route else request.remote_addr)
+    event = RequestEvent(endpoint, path, method, status_code, kwargs)
+    access_route = request.access_route
+    headers = request.headers
+    event.remote_addr = access_route[0] if access_route else request.remote_addr
+    event.request_remote_addr = request.remote_addr
+    event.x_forwarded_for = headers.get('X-Forwarded-For', '')
+    event.x_real_ip = headers.get('X-Real-IP', '')
+    if endpoint not in log_sampled_endpoints or random.random() < log_verbose_sample_rate:
+        event.user_agent = headers.get('User-Agent', '')
+        event.referrer = headers.get('Referer', '')
+        event.access_route = access_route
 
-    log_data = {
-        'timestamp': datetime.now(timezone.utc).isoformat(),
-        'endpoint': endpoint,
-        'path': path,
-        'method': method,
-        'remote_addr': real_ip,
-        'user_agent': request.headers.get('User-Agent', ''),
-        'referrer': request.referrer or '',
-        'x_forwarded_for': request.headers.get('X-Forwarded-For', ''),
-        'x_real_ip': request.headers.get('X-Real-IP', ''),
-        'request_remote_addr': request.remote_addr,
-        'access_route': list(request.access_route),
-    }
+    loki_logger.info(event)
+
+
+# Histogram buckets: seconds for latencies, entry counts for listings, bytes/second for uploads
+latency_buckets = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+listing_size_buckets = (0, 10, 100, 1000, 10000, 100000, 1000000)
+upload_rate_buckets = tuple(64 * 1024 * 4 ** i for i in range(8))  # 64 KiB/s .. 1 GiB/s
+
+if enable_metrics:
+    # With PROMETHEUS_MULTIPROC_DIR set, prometheus_client keeps these in per-process
+    # files there, and /_api/metrics sums them across all workers.
+    request_duration = prometheus_client.Histogram(
+        'file_browser_request_duration_seconds', 'Time spent in the view, until the response is returned',
+        ['endpoint', 'method', 'status'], buckets=latency_buckets)
+    response_bytes = prometheus_client.Counter(
+        'file_browser_response_bytes', 'Response body bytes sent', ['endpoint'])
+    request_bytes = prometheus_client.Counter(
+        'file_browser_request_bytes', 'Request body bytes received', ['endpoint'])
+    listing_entries = prometheus_client.Histogram(
+        'file_browser_listing_entries', 'Entries in each folder listing served', ['endpoint'],
+        buckets=listing_size_buckets)
+    listing_duration = prometheus_client.Histogram(
+        'file_browser_listing_duration_seconds',
+        'Time per listing request spent scanning the folder (scandir, stat, sort) or rendering it',
+        ['endpoint', 'phase'], buckets=latency_buckets)
+    upload_bytes = prometheus_client.Counter(
+        'file_browser_upload_bytes', 'File bytes written by uploads', ['endpoint'])
+    upload_rate = prometheus_client.Histogram(
+        'file_browser_upload_bytes_per_second', 'Throughput of each upload request', ['endpoint'],
+        buckets=upload_rate_buckets)
+
+
+@contextmanager
+def _listing_phase(phase):
+    """Add the time spent in the block to this request's total for `phase` ('scan' or 'render')."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if enable_metrics:
+            timings = g.setdefault('listing_seconds', {})
+            timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+
+
+def _counted_body(iterable, counter):
+    """Yield a streamed response body, counting its bytes as they are sent."""
+    try:
+        for chunk in iterable:
+            counter.inc(len(chunk))
+            yield chunk
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+
+def _start_metrics():
+    g.request_start = time.perf_counter()
+
+
+def _record_metrics(response):
+    """Observe the request's latency and byte counts, plus any listing and upload figures its view left in `g`.
+
+    Views report what only they know through `g`: `listing_entries`,
+    `listing_seconds` (see _listing_phase) and `upload_bytes`.
+    """
+    elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+    endpoint = request.endpoint or 'none'
+    request_duration.labels(endpoint, request.method, str(response.status_code)).observe(elapsed)
+    request_bytes.labels(endpoint).inc(request.content_length or 0)
+
+    sent = response_bytes.labels(endpoint)
+    if request.method == 'HEAD':
+        pass
+    elif response.content_length is not None:
+        sent.inc(response.content_length)
+    elif not response.direct_passthrough:
+        response.response = _counted_body(response.response, sent)
+
+    if 'listing_entries' in g:
+        listing_entries.labels(endpoint).observe(g.listing_entries)
+    for phase, seconds in g.get('listing_seconds', {}).items():
+        listing_duration.labels(endpoint, phase).observe(seconds)
+    if 'upload_bytes' in g:
+        upload_bytes.labels(endpoint).inc(g.upload_bytes)
+        upload_rate.labels(endpoint).observe(g.upload_bytes / max(elapsed, 1e-6))
+    return response
 
-    if status_code:
-        log_data['status_code'] = status_code
 
-    # Add any additional kwargs
-    log_data.update(kwargs)
+if enable_metrics:
+    app.before_request(_start_metrics)
+    app.after_request(_record_metrics)
+
+
+@app.route('/_api/metrics', methods=['GET'])
+def metrics():
+    """Serve the metrics in Prometheus text format, summed over all workers in multiprocess mode."""
+    if not enable_metrics:
+        return jsonify({'ok': False, 'error': 'Metrics are disabled'}), 404
+    if metrics_multiproc_dir:
+        registry = prometheus_client.CollectorRegistry()
+        prometheus_client.multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(prometheus_client.generate_latest(registry), content_type=prometheus_client.CONTENT_TYPE_LATEST)
 
-    # LokiHandler formatter expects %(message)s to be text.
-    loki_logger.info(log_data)
 
 
 @app.route('/new_folder', methods=['POST'])
@@ -418,6 +989,7 @@ def new_folder():
 
     try:
         new_folder_path.mkdir(parents=True, exist_ok=True)
+        _fs_changed(current_path)
         log_request_info('new_folder', current_path, 'POST',
                          status_code=200, folder_name=folder_name,
                          full_path=str(new_folder_path))
@@ -449,169 +1021,3112 @@ def handle_file_upload(request, base_location):
         upload_dir = os.path.join(base_location, current_path.lstrip('/'))
         filename = secure_filename(file.filename)
         unique_filename = get_unique_filename(upload_dir, filename)
-        file.save(os.path.join(upload_dir, unique_filename))
+        try:
+            file.save(os.path.join(upload_dir, unique_filename))
+        except Exception as e:
+            # Disk full, client gone, ...: drop the reserved placeholder
+            Path(upload_dir, unique_filename).unlink(missing_ok=True)
+            if not isinstance(e, OSError):
+                raise
+            log_request_info('upload', current_path, 'POST',
+                             status_code=500, error=str(e), filename=unique_filename)
+            return str(e), 500
+        g.upload_bytes = os.path.getsize(os.path.join(upload_dir, unique_filename))
+        _fs_changed(current_path)
         log_request_info('upload', current_path, 'POST',
                          status_code=200, filename=unique_filename,
                          original_filename=filename, upload_dir=upload_dir)
         return redirect(url_for('root', path=current_path))
 
 
-def _get_folder(path, include_dots, sort_by):
-    base_location = Path(base)
-    loc = base_location / path.lstrip('/')
+class UploadConflict(Exception):
+    """The client's idea of an upload's offset does not match the server's, or the upload is busy."""
 
-    if loc.is_dir():
-        list_files = list(loc.iterdir())
-        dir_contents = []
-
-        sort_function = {
-            'name': lambda y: y.name.lower(),
-            'date': lambda y: y.stat().st_mtime,
-            'size': lambda y: y.stat().st_size,
-        }.get(sort_by.removesuffix("_desc"), lambda y: y.name.lower())
-        reverse_sort = sort_by.endswith('_desc')
-
-        list_files.sort(key=lambda x: (not x.is_dir(), x.name[0] != ".", sort_function(x)), reverse=reverse_sort)
-        for file_path in list_files:
-            isdir = file_path.is_dir()
-            if isdir:
-                icon, color = 'ti ti-folder-filled', '#5988da'
-            else:
-                icon, color = get_file_icon_and_color(str(file_path))
-            clean_path = f'{path}/{file_path.name}'.replace('//', '/')
-            dir_contents.append({
-                'name': file_path.name,
-                'is_folder': isdir,
-                'path': clean_path,
-                'url': url_for('root', path=f'{path}/{file_path.name}'),
-                'delete_url': url_for('delete_entry', path=clean_path),
-                'is_deletable': True,
-                'size': humanize.naturalsize(file_path.stat().st_size),
-                'last_modified': humanize.naturaltime(datetime.fromtimestamp(file_path.stat().st_mtime)),
-                'icon': icon,
-                'colour': color
-            })
-        if path != '/' and include_dots:
-            dir_contents.insert(0, {
-                'name': '..',
-                'is_folder': True,
-                'path': '/'.join(path.split('/')[:-1]),
-                'size': '',
-                'last_modified': '',
-                'icon': 'ti ti-corner-up-left-double',
-                'colour': '#0d6efd',
-                'url': url_for('root', path='/'.join(path.split('/')[:-1])),
-                'delete_url': None,
-                'is_deletable': False,
-            })
-        return dir_contents
-    else:
-        return None
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
 
 
-@app.route("/api/", methods=['GET'])
-@app.route("/api/<path:path>", methods=['GET'])
-def api_list(path="/"):
-    dir_contents = _get_folder(path, False, 'date')
-    if dir_contents is not None:
-        log_request_info('api_list', path, 'GET',
-                         status_code=200, is_directory=True,
-                         file_count=len(dir_contents), sort_by='date')
-        return {'path': path, 'contents': dir_contents, 'total': len(dir_contents), 'sort_by': 'date'}
-    else:
-        log_request_info('api_list', path, 'GET',
-                         status_code=200, is_directory=False,
-                         resource_type='file')
-        return send_from_directory(base, path)
+class UploadTooLarge(Exception):
+    """More data was sent than the upload's declared size."""
 
 
-@app.route('/', methods=['GET', 'POST'])
-@app.route('/<path:path>', methods=['GET', 'POST'])
-def root(path="/"):
-    base_location = base
-    loc = os.path.join(base_location, path.lstrip('/'))
+def _upload_session_paths(upload_id):
+    """Return (metadata path, data path) for an upload id. Raises ValueError for malformed ids."""
+    if not re.fullmatch(r'[0-9a-f]{32}', upload_id or ''):
+        raise ValueError('Invalid upload id')
+    staging = os.path.join(base, upload_staging_name)
+    return os.path.join(staging, f'{upload_id}.json'), os.path.join(staging, f'{upload_id}.part')
 
-    if request.method == 'POST':
-        return handle_file_upload(request, base_location)
 
-    clean_path = f"/{path}".replace('//', '/')
+def _create_upload_session(current_path, filename, size=None):
+    """Start a resumable upload into folder `current_path` and return its id.
 
-    if os.path.isdir(loc):
-        sort_by = request.args.get('sort_by', 'name')
-        files = _get_folder(path, include_dots=True, sort_by=sort_by)
-        dir_contents = files
+    Data is staged under BASE/.uploads so that finalizing is an atomic rename
+    on the same filesystem. Sessions idle for longer than UPLOAD_SESSION_TTL
+    are removed whenever a new one is created.
+    """
+    target_dir = _resolve_path_in_base(current_path)
+    if not target_dir.is_dir() or _is_internal(current_path):
+        raise ValueError('Upload folder does not exist')
+    filename = secure_filename(filename or '')
+    if not filename:
+        raise ValueError('No selected file')
 
-        log_request_info('root', clean_path, 'GET',
-                         status_code=200, is_directory=True,
-                         file_count=len(dir_contents), sort_by=sort_by)
+    staging = os.path.join(base, upload_staging_name)
+    os.makedirs(staging, exist_ok=True)
+    _expire_upload_sessions(staging)
 
-        return render_template(
-            'index.jinja2',
-            path=path,
-            list_files=dir_contents,
-            notice_text=notice_text,
-            enable_upload=enable_upload,
-            enable_new_folder=enable_new_folder,
-            sort_by=sort_by
-        )
-    else:
-        file_size = os.path.getsize(loc) if os.path.exists(loc) else 0
-        log_request_info('root', clean_path, 'GET',
-                         status_code=200, is_directory=False,
-                         resource_type='file', file_size=file_size)
-        return send_from_directory(base_location, path)
+    upload_id = uuid.uuid4().hex
+    meta_path, part_path = _upload_session_paths(upload_id)
+    open(part_path, 'xb').close()
+    with open(meta_path, 'x') as f:
+        json.dump({'path': current_path, 'filename': filename, 'size': size, 'created': time.time()}, f)
+    return upload_id
 
 
-@app.route('/api/entry', methods=['DELETE'])
-def delete_entry():
-    """Delete a file or folder under BASE.
+def _expire_upload_sessions(staging):
+    """Remove sessions idle for longer than UPLOAD_SESSION_TTL, metadata and data file together.
 
-    Accepts `path` as query arg containing the file browser path (e.g. /a/b.txt).
+    Appends keep touching the data file, so a long upload stays alive as long
+    as data arrives, however old its metadata file is.
     """
-    user_path = request.args.get('path') or ''
+    cutoff = time.time() - upload_session_ttl
+    sessions = {}
+    with os.scandir(staging) as it:
+        for entry in it:
+            try:
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            paths, last_active = sessions.get(entry.name.partition('.')[0], ((), 0))
+            sessions[entry.name.partition('.')[0]] = ((*paths, entry.path), max(last_active, mtime))
+    for paths, last_active in sessions.values():
+        if last_active < cutoff:
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
 
-    # Forbid deleting root/empty.
-    if not user_path or user_path in ('/', '.'):
-        log_request_info('delete', user_path or '/', 'DELETE', status_code=400, error='Refusing to delete root')
-        return jsonify({'ok': False, 'error': 'Refusing to delete root'}), 400
 
+def _load_upload_session(upload_id):
+    """Return the session metadata with its current `offset`. Raises FileNotFoundError if unknown."""
+    meta_path, part_path = _upload_session_paths(upload_id)
+    with open(meta_path) as f:
+        session = json.load(f)
+    session['offset'] = os.path.getsize(part_path)
+    return session
+
+
+def _append_upload(upload_id, offset, stream, limit=None):
+    """Write `stream` to the upload at byte `offset` in UPLOAD_CHUNK_SIZE chunks; return the new offset.
+
+    The data file is locked while writing so two workers cannot append to the
+    same upload concurrently. If `stream` holds more than `limit` bytes, what
+    it wrote is discarded and UploadTooLarge is raised.
+    """
+    _, part_path = _upload_session_paths(upload_id)
+    with open(part_path, 'r+b') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflict('Upload is busy', os.fstat(f.fileno()).st_size)
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            raise UploadConflict('Offset mismatch', current)
+        f.seek(offset)
+        written = 0
+        while True:
+            chunk = stream.read(upload_chunk_size)
+            if not chunk:
+                break
+            written += len(chunk)
+            if limit is not None and written > limit:
+                f.truncate(offset)
+                raise UploadTooLarge('Upload exceeds declared size')
+            f.write(chunk)
+        return f.tell()
+
+
+def _finalize_upload(upload_id):
+    """Move a completed upload into its folder under a unique name and return (folder, filename).
+
+    The data file is locked like in _append_upload, so an upload cannot be
+    finalized while a PATCH is still writing to it. If the move fails, the
+    placeholder reserved for the name is removed again.
+    """
+    meta_path, part_path = _upload_session_paths(upload_id)
+    with open(part_path, 'rb') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflict('Upload is busy', os.fstat(f.fileno()).st_size)
+        session = _load_upload_session(upload_id)
+        if session['size'] is not None and session['offset'] != session['size']:
+            raise UploadConflict('Upload is incomplete', session['offset'])
+
+        target_dir = _resolve_path_in_base(session['path'])
+        filename = get_unique_filename(target_dir, session['filename'])
+        target = os.path.join(target_dir, filename)
+        try:
+            try:
+                os.replace(part_path, target)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.move(part_path, target)  # Target folder is another mount
+        except BaseException:
+            try:
+                os.remove(target)  # Drop the reserved placeholder
+            except OSError:
+                pass
+            raise
+        os.remove(meta_path)
+    _fs_changed(session['path'])
+    return session['path'], filename
+
+
+def _upload_status(upload_id, session, status=200):
+    response = jsonify({'ok': True, 'upload_id': upload_id, 'offset': session['offset'], 'size': session['size']})
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(session['offset'])
+    if session['size'] is not None:
+        response.headers['Upload-Length'] = str(session['size'])
+    response.cache_control.no_store = True
+    return response
+
+
+def _upload_error(endpoint, path, status_code, error, **kwargs):
+    log_request_info(endpoint, path, request.method, status_code=status_code, error=error)
+    return jsonify({'ok': False, 'error': error, **kwargs}), status_code
+
+
+@app.route('/_api/upload', methods=['POST'])
+def upload_create():
+    """Create a resumable upload session.
+
+    Accepts `current_path` (target folder), `filename` and optionally `size`
+    (total bytes) as form fields or query args. Data is then sent with
+    PATCH /_api/upload/<id> and moved into place by .../finalize.
+    """
+    current_path = request.values.get('current_path', '/')
+    if not enable_upload:
+        return _upload_error('upload_create', current_path, 403, 'File upload is disabled')
     try:
-        target = _resolve_path_in_base(user_path)
+        size = request.values.get('size')
+        size = int(size) if size else None
+        if size is not None and size < 0:
+            raise ValueError('size must not be negative')
+        upload_id = _create_upload_session(current_path, request.values.get('filename'), size)
     except ValueError as e:
-        log_request_info('delete', user_path, 'DELETE', status_code=400, error=str(e))
-        return jsonify({'ok': False, 'error': str(e)}), 400
+        return _upload_error('upload_create', current_path, 400, str(e))
+
+    log_request_info('upload_create', current_path, 'POST', status_code=201, upload_id=upload_id, size=size)
+    response = _upload_status(upload_id, {'offset': 0, 'size': size}, 201)
+    response.headers['Location'] = url_for('upload_append', upload_id=upload_id)
+    return response
+
+
+@app.route('/_api/upload', methods=['PUT'])
+def upload_stream():
+    """Upload one file in a single request by streaming the raw body to disk.
 
+    Accepts `current_path` and `filename` as query args; the body is written in
+    chunks straight to the staging file, without multipart spooling.
+    """
+    current_path = request.args.get('current_path', '/')
+    if not enable_upload:
+        return _upload_error('upload_stream', current_path, 403, 'File upload is disabled')
     try:
-        # Disallow deleting BASE itself.
-        if target == Path(base).resolve():
-            log_request_info('delete', user_path, 'DELETE', status_code=400, error='Refusing to delete base')
-            return jsonify({'ok': False, 'error': 'Refusing to delete base'}), 400
+        upload_id = _create_upload_session(current_path, request.args.get('filename'), request.content_length)
+        offset = _append_upload(upload_id, 0, request.stream)
+        folder, filename = _finalize_upload(upload_id)
+    except ValueError as e:
+        return _upload_error('upload_stream', current_path, 400, str(e))
+    except UploadConflict as e:
+        # The body ended early: keep the session so the client can resume it.
+        return _upload_error('upload_stream', current_path, 409, str(e), upload_id=upload_id, offset=e.offset)
 
-        if not target.exists() and not target.is_symlink():
-            log_request_info('delete', user_path, 'DELETE', status_code=404, error='Not found')
-            return jsonify({'ok': False, 'error': 'Not found'}), 404
+    g.upload_bytes = offset
+    log_request_info('upload_stream', current_path, 'PUT', status_code=201,
+                     filename=filename, size=offset, upload_id=upload_id)
+    return jsonify({'ok': True, 'path': folder, 'filename': filename, 'size': offset}), 201
 
-        # Delete symlinks as links (never follow).
-        if target.is_symlink() or target.is_file():
-            target.unlink(missing_ok=True)
-            log_request_info('delete', user_path, 'DELETE', status_code=200, deleted_type='file')
-            return jsonify({'ok': True}), 200
 
-        if target.is_dir():
-            shutil.rmtree(target)
-            log_request_info('delete', user_path, 'DELETE', status_code=200, deleted_type='dir')
-            return jsonify({'ok': True}), 200
+@app.route('/_api/upload/batch', methods=['POST'])
+def upload_batch():
+    """Upload many files, or a whole folder tree, in one multipart request.
+
+    Every `files` part is saved below `current_path`; a part's filename may be
+    a relative path (e.g. a browser's webkitRelativePath), in which case the
+    folders are created as needed. Each affected folder is refreshed once at
+    the end and a single JSON summary is returned.
+    """
+    current_path = request.form.get('current_path', '/')
+    if not enable_upload:
+        return _upload_error('upload_batch', current_path, 403, 'File upload is disabled')
+    try:
+        target_dir = _resolve_path_in_base(current_path)
+    except ValueError as e:
+        return _upload_error('upload_batch', current_path, 400, str(e))
+    if not target_dir.is_dir() or _is_internal(current_path):
+        return _upload_error('upload_batch', current_path, 400, 'Upload folder does not exist')
 
-        log_request_info('delete', user_path, 'DELETE', status_code=400, error='Unsupported file type')
-        return jsonify({'ok': False, 'error': 'Unsupported file type'}), 400
+    uploaded, errors, changed_dirs = [], [], set()
+    for file in request.files.getlist('files'):
+        parts = [secure_filename(part) for part in (file.filename or '').replace('\\', '/').split('/')]
+        parts = [part for part in parts if part]
+        if not parts:
+            errors.append({'name': file.filename, 'error': 'Invalid file name'})
+            continue
+        folder = posixpath.join(ListingCache.normalize(current_path), *parts[:-1])
+        filename = None
+        try:
+            upload_dir = target_dir.joinpath(*parts[:-1])
+            upload_dir.mkdir(parents=True, exist_ok=True)
+            filename = get_unique_filename(upload_dir, parts[-1])
+            file.save(upload_dir / filename)
+        except BaseException as e:
+            if filename is not None:
+                (upload_dir / filename).unlink(missing_ok=True)  # Drop the reserved placeholder
+            if not isinstance(e, OSError):
+                raise
+            errors.append({'name': file.filename, 'error': str(e)})
+            continue
+        # New folders also change their parents' listings.
+        for depth in range(len(parts)):
+            changed_dirs.add(posixpath.join(ListingCache.normalize(current_path), *parts[:depth]))
+        uploaded.append({'name': file.filename, 'path': posixpath.join(folder, filename),
+                         'size': os.path.getsize(upload_dir / filename)})
 
-    except PermissionError as e:
-        log_request_info('delete', user_path, 'DELETE', status_code=403, error=str(e))
-        return jsonify({'ok': False, 'error': 'Permission denied'}), 403
-    except Exception as e:
-        log_request_info('delete', user_path, 'DELETE', status_code=500, error=str(e))
-        return jsonify({'ok': False, 'error': str(e)}), 500
+    for folder in sorted(changed_dirs):
+        _fs_changed(folder)
+
+    g.upload_bytes = sum(item['size'] for item in uploaded)
+    status_code = 200 if uploaded or not errors else 400
+    log_request_info('upload_batch', current_path, 'POST', status_code=status_code,
+                     file_count=len(uploaded), error_count=len(errors),
+                     bytes=g.upload_bytes)
+    return jsonify({'ok': not errors, 'uploaded': uploaded, 'errors': errors}), status_code
+
+
+@app.route('/_api/upload/<upload_id>', methods=['HEAD'])
+def upload_status(upload_id):
+    """Report how many bytes of an upload the server has (Upload-Offset header)."""
+    if not enable_upload:
+        return _upload_error('upload_status', upload_id, 403, 'File upload is disabled')
+    try:
+        session = _load_upload_session(upload_id)
+    except (ValueError, FileNotFoundError):
+        return '', 404
+    return _upload_status(upload_id, session)
+
+
+@app.route('/_api/upload/<upload_id>', methods=['PATCH'])
+def upload_append(upload_id):
+    """Append the request body to an upload at the offset given in the Upload-Offset header.
+
+    If the offset does not match what the server has, nothing is written and
+    409 is returned with the server's offset, so the client can resume from there.
+    A body that would take the upload past its declared size is rejected with
+    413, also when it is sent without a Content-Length.
+    """
+    if not enable_upload:
+        return _upload_error('upload_append', upload_id, 403, 'File upload is disabled')
+    try:
+        session = _load_upload_session(upload_id)
+    except (ValueError, FileNotFoundError):
+        return _upload_error('upload_append', upload_id, 404, 'Unknown upload')
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        remaining = session['size'] - offset if session['size'] is not None else None
+        if remaining is not None and (request.content_length or 0) > remaining:
+            return _upload_error('upload_append', upload_id, 413, 'Upload exceeds declared size',
+                                 offset=session['offset'])
+        new_offset = _append_upload(upload_id, offset, request.stream, remaining)
+        session = _load_upload_session(upload_id)
+    except ValueError:
+        return _upload_error('upload_append', upload_id, 400, 'Missing or invalid Upload-Offset')
+    except FileNotFoundError:
+        return _upload_error('upload_append', upload_id, 404, 'Unknown upload')
+    except UploadConflict as e:
+        return _upload_error('upload_append', upload_id, 409, str(e), offset=e.offset)
+    except UploadTooLarge as e:
+        return _upload_error('upload_append', upload_id, 413, str(e), offset=offset)
+
+    g.upload_bytes = new_offset - offset
+    log_request_info('upload_append', upload_id, 'PATCH', status_code=200,
+                     offset=offset, bytes_written=new_offset - offset)
+    return _upload_status(upload_id, session)
+
+
+@app.route('/_api/upload/<upload_id>/finalize', methods=['POST'])
+def upload_finalize(upload_id):
+    """Atomically move a completed upload into its target folder."""
+    if not enable_upload:
+        return _upload_error('upload_finalize', upload_id, 403, 'File upload is disabled')
+    try:
+        folder, filename = _finalize_upload(upload_id)
+    except ValueError as e:
+        return _upload_error('upload_finalize', upload_id, 400, str(e))
+    except FileNotFoundError:
+        return _upload_error('upload_finalize', upload_id, 404, 'Unknown upload')
+    except UploadConflict as e:
+        return _upload_error('upload_finalize', upload_id, 409, str(e), offset=e.offset)
+
+    log_request_info('upload_finalize', folder, 'POST', status_code=200, filename=filename, upload_id=upload_id)
+    return jsonify({'ok': True, 'path': folder, 'filename': filename})
+
+
+@app.route('/_api/upload/<upload_id>', methods=['DELETE'])
+def upload_abort(upload_id):
+    """Discard an unfinished upload."""
+    if not enable_upload:
+        return _upload_error('upload_abort', upload_id, 403, 'File upload is disabled')
+    try:
+        for session_path in _upload_session_paths(upload_id):
+            os.remove(session_path)
+    except (ValueError, FileNotFoundError):
+        return _upload_error('upload_abort', upload_id, 404, 'Unknown upload')
+    log_request_info('upload_abort', upload_id, 'DELETE', status_code=200)
+    return jsonify({'ok': True})
+
+
+class ListingCache:
+    """In-process LRU cache of built FolderListings.
+
+    Entries are keyed by (path, sort_by, include_dots, script_root) and are only
+    served while the directory's own mtime is unchanged and the TTL has not
+    expired. The cache is bounded both by number of listings and by the total
+    number of rows held across all listings.
+    """
+
+    def __init__(self, max_entries, ttl, max_rows):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._entries = OrderedDict()  # key -> (dir_mtime_ns, expires_at, listing)
+        self._rows = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def normalize(path):
+        return posixpath.normpath('/' + (path or '').strip('/'))
+
+    def get(self, key, dir_mtime_ns):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            cached_mtime_ns, expires_at, listing = item
+            if cached_mtime_ns != dir_mtime_ns or expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return listing
+
+    def put(self, key, dir_mtime_ns, listing):
+        if self.max_entries <= 0 or len(listing.contents) > self.max_rows:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (dir_mtime_ns, time.monotonic() + self.ttl, listing)
+            self._rows += len(listing.contents)
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, path):
+        """Drop every cached listing of directory `path` (relative to BASE)."""
+        path = self.normalize(path)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == path]:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'rows': self._rows,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def _remove(self, key):
+        _, _, listing = self._entries.pop(key)
+        self._rows -= len(listing.contents)
+
+
+listing_cache = ListingCache(listing_cache_size, listing_cache_ttl, listing_cache_max_rows)
+
+
+def _invalidate_listing(path):
+    """Invalidate cached listings of the directory at `path` (relative to BASE)."""
+    listing_cache.invalidate(path)
+
+
+class DirEntry(NamedTuple):
+    """Compact record for one directory entry, collected in a single scandir pass."""
+    name: str
+    is_dir: bool
+    size: int
+    mtime: float
+    is_symlink: bool
+    size_pending: bool = False
+
+
+def _dir_entry(entry):
+    """Build a DirEntry from an os.DirEntry with a single stat, or None if it vanished.
+
+    Symlinks are followed for size/mtime/type; broken symlinks fall back to the
+    link itself instead of failing the whole listing.
+    """
+    try:
+        st = entry.stat()
+    except OSError:
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            return None  # Entry vanished between readdir and stat
+    return DirEntry(
+        name=entry.name,
+        is_dir=stat.S_ISDIR(st.st_mode),
+        size=st.st_size,
+        mtime=st.st_mtime,
+        is_symlink=entry.is_symlink(),
+    )
+
+
+def _iter_dir(scandir_it):
+    """Yield DirEntry records from an os.scandir iterator in on-disk order, closing it at the end."""
+    with scandir_it:
+        for entry in scandir_it:
+            if _is_internal_entry(entry):
+                continue
+            record = _dir_entry(entry)
+            if record is not None:
+                yield record
+
+
+def _scan_dir(loc):
+    """List `loc` with os.scandir, stat'ing each entry exactly once."""
+    return list(_iter_dir(os.scandir(loc)))
+
+
+def _sizes_pending(rel_dir, busy):
+    """True if a refresh in `busy` (see PathIndex.queued) may still change the recursive size of `rel_dir`."""
+    prefix = rel_dir.rstrip('/') + '/'
+    return any(queued == rel_dir or queued.startswith(prefix) for queued in busy)
+
+
+def _with_dir_sizes(path, entries):
+    """Yield DirEntry records with folder sizes replaced by their recursive size, when enabled.
+
+    Sizes come from the index and are never computed here. A folder that is
+    still being refreshed keeps its last known size and one the index has not
+    reached yet keeps its own (inode) size; both are marked size_pending, and
+    in the second case `path` is queued for a refresh.
+    """
+    if not enable_dir_sizes:
+        yield from entries
+        return
+    rel_dir = ListingCache.normalize(path)
+    sizes = path_index.child_sizes(rel_dir)
+    busy = path_index.queued()
+    queue_refresh = False
+    for entry in entries:
+        if entry.is_dir and not entry.is_symlink:
+            known = sizes.get(entry.name)
+            if known is None:
+                queue_refresh = True
+                entry = entry._replace(size_pending=True)
+            else:
+                entry = entry._replace(size=known[0],
+                                       size_pending=_sizes_pending(posixpath.join(rel_dir, entry.name), busy))
+        yield entry
+    if queue_refresh and rel_dir not in busy:
+        path_index.refresh_dir(rel_dir)
+
+
+def _sort_key(sort_by):
+    """Return (key, reverse) ordering DirEntry records: folders first, dotfiles first, then `sort_by`."""
+    sort_function = {
+        'name': lambda y: y.name.lower(),
+        'date': lambda y: y.mtime,
+        'size': lambda y: y.size,
+    }.get(sort_by.removesuffix("_desc"), lambda y: y.name.lower())
+    reverse_sort = sort_by.endswith('_desc')
+    return (lambda x: (not x.is_dir, x.name[0] != ".", sort_function(x))), reverse_sort
+
+
+def _sort_entries(entries, sort_by):
+    """Sort DirEntry records in place according to `sort_by`."""
+    key, reverse_sort = _sort_key(sort_by)
+    entries.sort(key=key, reverse=reverse_sort)
+    return entries
+
+
+def _encode_cursor(sort_by, key):
+    data = json.dumps({'sort_by': sort_by, 'key': key})
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(sort_by, cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        key = data['key']
+        cursor_sort_by = data['sort_by']
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError('Invalid cursor') from e
+    if cursor_sort_by != sort_by or not isinstance(key, list) or len(key) != 4:
+        raise ValueError('Cursor does not match sort_by')
+    # The key must compare against _page_entries' keys: (bool, bool, value, name).
+    if sort_by.removesuffix('_desc') in ('date', 'size'):
+        value_ok = isinstance(key[2], (int, float)) and not isinstance(key[2], bool)
+    else:
+        value_ok = isinstance(key[2], str)
+    if not (isinstance(key[0], bool) and isinstance(key[1], bool) and value_ok and isinstance(key[3], str)):
+        raise ValueError('Invalid cursor')
+    return tuple(key)
+
+
+def _page_entries(entries, sort_by, limit, offset=0, cursor=None):
+    """Select one page of DirEntry records without sorting the whole directory.
+
+    Uses a bounded heap (top-k) so only `offset + limit` records are ever
+    ordered. With a cursor (the sort key of the last entry of the previous
+    page) pagination is keyset-based and offset is applied after it.
+    Returns (page, next_cursor).
+    """
+    base_key, reverse_sort = _sort_key(sort_by)
+
+    # The name is appended as a tie-breaker so every entry has a unique position.
+    def key(x):
+        return (*base_key(x), x.name)
+
+    candidates = entries
+    if cursor is not None:
+        after = _decode_cursor(sort_by, cursor)
+        if reverse_sort:
+            candidates = (e for e in entries if key(e) < after)
+        else:
+            candidates = (e for e in entries if key(e) > after)
+
+    select = heapq.nlargest if reverse_sort else heapq.nsmallest
+    window = select(offset + limit + 1, candidates, key=key)
+    page = window[offset:offset + limit]
+    has_more = len(window) > offset + limit
+    next_cursor = _encode_cursor(sort_by, key(page[-1])) if has_more and page else None
+    return page, next_cursor
+
+
+class EntryUrls:
+    """Builds `root`, `delete_entry`, `api_thumb` and `api_preview` URLs with plain quoting and concatenation.
+
+    url_for() goes through Werkzeug's URL map on every call, which dominates
+    listing large folders. The route prefixes (including the script root set
+    from X-Forwarded-Prefix by ProxyFix) are resolved once with url_for();
+    each URL is then quoted with the same safe characters Werkzeug uses, so
+    the output is identical to url_for().
+    """
+    path_safe = "!$&'()*+,/:;=@"  # Werkzeug's path converter
+    query_safe = "!$'()*,/:;?@"  # Werkzeug's query string encoding
+
+    def __init__(self):
+        self.root_prefix = url_for('root')
+        self.delete_prefix = url_for('delete_entry') + '?path='
+        # These routes need a non-empty path
+        self.thumb_prefix = url_for('api_thumb', path='-')[:-1]
+        self.preview_prefix = url_for('api_preview', path='-')[:-1]
+
+    def root(self, path, **query):
+        """Same as url_for('root', path=path, **query)."""
+        url = self.root_prefix + quote(path.lstrip('/'), safe=self.path_safe)
+        if query:
+            url += '?' + urlencode(query, safe=self.query_safe)
+        return url
+
+    def delete_entry(self, path):
+        """Same as url_for('delete_entry', path=path)."""
+        return self.delete_prefix + quote_plus(path, safe=self.query_safe)
+
+    def preview(self, path):
+        """Same as url_for('api_preview', path=path)."""
+        return self.preview_prefix + quote(path.lstrip('/'), safe=self.path_safe)
+
+    def thumb(self, path, mtime):
+        """Same as url_for('api_thumb', path=path, size=64, v=int(mtime))."""
+        return f"{self.thumb_prefix}{quote(path.lstrip('/'), safe=self.path_safe)}?size=64&v={int(mtime)}"
+
+
+def _entry_urls():
+    """Return the EntryUrls for the current request, creating it on first use."""
+    if 'entry_urls' not in g:
+        g.entry_urls = EntryUrls()
+    return g.entry_urls
+
+
+def _build_entry(path, loc, entry):
+    """Build the listing dict for one DirEntry (no filesystem access)."""
+    if entry.is_dir:
+        category = None
+        icon, color = folder_icon_and_color
+    else:
+        category, icon, color = _file_type(entry.name)
+    clean_path = f'{path}/{entry.name}'.replace('//', '/')
+    urls = _entry_urls()
+    return {
+        'name': entry.name,
+        'is_folder': entry.is_dir,
+        'path': clean_path,
+        'url': urls.root(f'{path}/{entry.name}'),
+        'delete_url': urls.delete_entry(clean_path),
+        'is_deletable': enable_delete,
+        'size_bytes': entry.size,
+        'size_pending': entry.size_pending,
+        'mtime': entry.mtime,
+        'icon': icon,
+        'colour': color,
+        'thumb_url': urls.thumb(clean_path, entry.mtime) if _has_thumbnail(entry) else None,
+        'preview_url': urls.preview(clean_path) if category in preview_categories else None,
+    }
+
+
+def _has_thumbnail(entry):
+    return (thumbnail_cache is not None and not entry.is_dir
+            and os.path.splitext(entry.name)[1].lower() in thumbnails.suffixes)
+
+
+def _parent_entry(path):
+    """Build the '..' listing entry for `path`."""
+    return {
+        'name': '..',
+        'is_folder': True,
+        'path': '/'.join(path.split('/')[:-1]),
+        'size_bytes': None,
+        'mtime': None,
+        'icon': 'ti ti-corner-up-left-double',
+        'colour': '#0d6efd',
+        'url': _entry_urls().root('/'.join(path.split('/')[:-1])),
+        'delete_url': None,
+        'is_deletable': False,
+        'thumb_url': None,
+        'preview_url': None,
+    }
+
+
+@lru_cache(maxsize=4096)
+def _natural_size(size_bytes):
+    return humanize.naturalsize(size_bytes)
+
+
+@lru_cache(maxsize=4096)
+def _natural_time_ago(seconds):
+    return humanize.naturaltime(timedelta(seconds=seconds))
+
+
+@app.template_filter('naturalsize')
+def naturalsize_filter(size_bytes):
+    """Format a byte count for display; big folders repeat sizes, so results are memoised."""
+    return '' if size_bytes is None else _natural_size(size_bytes)
+
+
+@app.template_filter('naturaltime')
+def naturaltime_filter(mtime):
+    """Format an epoch mtime relative to now; memoised per whole second of age."""
+    return '' if mtime is None else _natural_time_ago(int(time.time() - mtime))
+
+
+def _with_human_fields(entry):
+    """Return a copy of a listing entry with the formatted `size` and `last_modified` strings added."""
+    return {**entry, 'size': naturalsize_filter(entry['size_bytes']),
+            'last_modified': naturaltime_filter(entry['mtime'])}
+
+
+def _human_arg():
+    return request.args.get('human', 'False').lower() in ('true', '1', 't')
+
+
+class FolderListing(NamedTuple):
+    """A built folder listing plus the validators used for conditional GETs."""
+    contents: list
+    etag: str
+    last_modified: float
+
+
+@lru_cache(maxsize=None)
+def _etag_salt():
+    """Digest of everything besides the folder itself that changes the rendered output.
+
+    That is every setting the listing views and index.jinja2 read, and the
+    template itself, so that a restart with new settings or new markup does
+    not answer browsers with 304 for their stale copies.
+    """
+    with app.open_resource(os.path.join(app.template_folder, 'index.jinja2')) as f:
+        template = f.read()
+    settings = (notice_text, enable_upload, enable_new_folder, enable_delete, enable_search, enable_dir_sizes,
+                thumbnail_cache is not None, client_render_threshold, sorted(preview_categories),
+                sorted(file_types.names.items()))
+    return hashlib.blake2b(repr(settings).encode() + template, digest_size=8).hexdigest()
+
+
+def _listing_etag(entries, sort_by, variant):
+    """Strong ETag over the scanned records, the sort order, the variant, the URL prefix and _etag_salt()."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{sort_by}|{variant}|{request.script_root}|{_etag_salt()}|'.encode())
+    digest.update(repr(entries).encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+def _cached_listing(path, sort_by, variant, build):
+    """Return the cached FolderListing of `path` for `variant`, or None if it is not a folder.
+
+    On a miss the folder is scanned and sorted once and `build(loc, entries)`
+    turns the DirEntry records into the listing's contents. The scan is
+    skipped when the 'entries' variant for the same order is cached and current.
+    """
+    base_location = Path(base)
+    loc = base_location / path.lstrip('/')
+
+    if _is_internal(path):
+        return None
+    try:
+        # Stat before scanning so a change during the scan invalidates the result.
+        dir_stat = loc.stat()
+    except OSError:
+        return None
+    if not stat.S_ISDIR(dir_stat.st_mode):
+        return None
+
+    cache_key = (ListingCache.normalize(path), sort_by, variant, request.script_root)
+    listing = listing_cache.get(cache_key, dir_stat.st_mtime_ns)
+    if listing is not None:
+        return listing
+
+    entries = None
+    if variant != 'entries':
+        cached = listing_cache.get((cache_key[0], sort_by, 'entries', request.script_root), dir_stat.st_mtime_ns)
+        entries = cached.contents if cached is not None else None
+    if entries is None:
+        with _listing_phase('scan'):
+            entries = list(_with_dir_sizes(path, _scan_dir(loc)))
+            _sort_entries(entries, sort_by)
+    with _listing_phase('render'):
+        contents = build(loc, entries)
+    listing = FolderListing(
+        contents=contents,
+        etag=_listing_etag(entries, sort_by, variant),
+        last_modified=max([dir_stat.st_mtime, *(entry.mtime for entry in entries)]),
+    )
+    listing_cache.put(cache_key, dir_stat.st_mtime_ns, listing)
+    return listing
+
+
+def _get_folder(path, include_dots, sort_by):
+    """Return the FolderListing for `path`, or None if it is not a folder."""
+    def build(loc, entries):
+        dir_contents = [_build_entry(path, loc, entry) for entry in entries]
+        if path != '/' and include_dots:
+            dir_contents.insert(0, _parent_entry(path))
+        return dir_contents
+
+    return _cached_listing(path, sort_by, include_dots, build)
+
+
+def _get_folder_entries(path, sort_by):
+    """Return a FolderListing whose contents are the sorted DirEntry records of `path`, or None."""
+    return _cached_listing(path, sort_by, 'entries', lambda loc, entries: entries)
+
+
+def _columnar_listing(path, sort_by, entries):
+    """Compact, column-oriented form of a folder listing for rendering in the browser.
+
+    Every field is one array indexed by row, and `types` indexes `type_table`
+    ([icon, colour] pairs), so no URLs or formatted strings are sent per row.
+    `previews` flags the files that /_api/preview can show.
+    """
+    type_ids = {}
+    types = []
+    previews = []
+    for entry in entries:
+        if entry.is_dir:
+            category, icon_and_color = None, folder_icon_and_color
+        else:
+            file_type = _file_type(entry.name)
+            category, icon_and_color = file_type[0], file_type[1:]
+        types.append(type_ids.setdefault(icon_and_color, len(type_ids)))
+        previews.append(int(category in preview_categories))
+    return {
+        'path': path,
+        'sort_by': sort_by,
+        'total': len(entries),
+        'names': [entry.name for entry in entries],
+        'folders': [int(entry.is_dir) for entry in entries],
+        'sizes': [entry.size for entry in entries],
+        'pending': [int(entry.size_pending) for entry in entries],
+        'mtimes': [int(entry.mtime) for entry in entries],
+        'types': types,
+        'previews': previews,
+        'type_table': [list(icon_and_color) for icon_and_color in type_ids],
+    }
+
+
+def _is_not_modified(etag, last_modified):
+    """Check the request's If-None-Match / If-Modified-Since against a resource's validators."""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+
+def _conditional_listing(listing, variant, render):
+    """Answer with 304 if the client's copy is current, otherwise call render().
+
+    `variant` distinguishes representations of the same listing (HTML vs JSON).
+    """
+    etag = f'{listing.etag}-{variant}'
+    g.listing_entries = len(listing.contents)
+    if _is_not_modified(etag, listing.last_modified):
+        response = make_response('', 304)
+    else:
+        with _listing_phase('render'):
+            response = make_response(render())
+    response.set_etag(etag)
+    response.last_modified = listing.last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def _file_etag(st):
+    """ETag for a file that only depends on its metadata, so every worker agrees.
+
+    Uses nginx's static-file format (hex mtime seconds - hex size) so validators
+    stay the same whether a download is served by Flask or offloaded to nginx.
+    """
+    return f'{int(st.st_mtime):x}-{st.st_size:x}'
+
+
+file_chunk_size = 256 * 1024
+max_byte_ranges = 64
+
+
+def _requested_ranges(st, etag):
+    """Return the [start, stop) ranges of a multi-range request that should get a 206, else None.
+
+    Single ranges, stale If-Range validators and unsatisfiable requests are
+    left to Werkzeug, which already answers those with 206, 200 or 416.
+    Adjacent ranges are merged; Werkzeug already refuses overlapping or
+    out-of-order ones, so a request cannot make the response larger than the
+    file plus part headers.
+    """
+    requested = request.range
+    if requested is None or requested.units != 'bytes' or len(requested.ranges) < 2:
+        return None
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and if_range.date != datetime.fromtimestamp(int(st.st_mtime), timezone.utc):
+        return None
+
+    ranges = []
+    for start, stop in requested.ranges:
+        if start < 0:
+            start, stop = max(st.st_size + start, 0), st.st_size
+        else:
+            stop = st.st_size if stop is None else min(stop, st.st_size)
+        if start < stop:
+            ranges.append((start, stop))
+    if not ranges:
+        return None
+
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged if len(merged) <= max_byte_ranges else None
+
+
+def _byteranges_response(file_path, st, etag, ranges):
+    """Build a 206 multipart/byteranges response that reads each range straight from the file.
+
+    The file is opened before the response is returned, so a rename or delete
+    while the body is being sent does not affect it. If the file is truncated
+    in place, the body is cut short with an error instead of ending cleanly,
+    so the server drops the connection rather than sending fewer bytes than
+    the Content-Length it announced.
+    """
+    f = open(file_path, 'rb')
+    boundary = uuid.uuid4().hex
+    mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+    headers = [(f'\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                f'Content-Range: bytes {start}-{stop - 1}/{st.st_size}\r\n\r\n').encode()
+               for start, stop in ranges]
+    trailer = f'\r\n--{boundary}--\r\n'.encode()
+
+    def generate():
+        for header, (start, stop) in zip(headers, ranges):
+            yield header
+            f.seek(start)
+            remaining = stop - start
+            while remaining:
+                chunk = f.read(min(file_chunk_size, remaining))
+                if not chunk:
+                    raise OSError(f'{file_path} shrank while it was being sent')
+                remaining -= len(chunk)
+                yield chunk
+        yield trailer
+
+    response = Response(generate(), status=206, mimetype=f'multipart/byteranges; boundary={boundary}')
+    response.call_on_close(f.close)
+    response.content_length = sum(len(h) for h in headers) + sum(b - a for a, b in ranges) + len(trailer)
+    response.accept_ranges = 'bytes'
+    response.set_etag(etag)
+    response.last_modified = st.st_mtime
+    response.cache_control.no_cache = True
+    return response
+
+
+def _send_file(path):
+    """Send a file under BASE with Range support and stable ETag/Last-Modified validators.
+
+    Single ranges and If-Range are handled by send_from_directory; requests for
+    several ranges get a multipart/byteranges response. With DOWNLOAD_OFFLOAD=nginx
+    the body (and range handling) is left to nginx via X-Accel-Redirect to an
+    internal location; with DOWNLOAD_OFFLOAD=sendfile Flask emits X-Sendfile.
+    """
+    rel_path = path.lstrip('/')
+    file_path = safe_join(base, rel_path)
+    if file_path is None or _is_internal(rel_path):
+        abort(404)
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        abort(404)
+    if not stat.S_ISREG(st.st_mode):
+        abort(404)
+
+    if download_offload == 'nginx':
+        etag = _file_etag(st)
+        if _is_not_modified(etag, st.st_mtime):
+            response = make_response('', 304)
+        else:
+            response = make_response('')
+            response.headers['X-Accel-Redirect'] = download_offload_prefix + quote(rel_path)
+            response.mimetype = mimetypes.guess_type(rel_path)[0] or 'application/octet-stream'
+        response.accept_ranges = 'bytes'
+        response.set_etag(etag)
+        response.last_modified = st.st_mtime
+        response.cache_control.no_cache = True
+        return response
+
+    etag = _file_etag(st)
+    ranges = _requested_ranges(st, etag)
+    if ranges is not None:
+        if _is_not_modified(etag, st.st_mtime):
+            response = make_response('', 304)
+            response.set_etag(etag)
+            response.last_modified = st.st_mtime
+            return response
+        if download_offload == 'sendfile':
+            # The front-end server applies the ranges to the X-Sendfile body itself
+            response = send_from_directory(base, rel_path, etag=etag, last_modified=st.st_mtime, conditional=False)
+            response.accept_ranges = 'bytes'
+            return response
+        try:
+            return _byteranges_response(file_path, st, etag, ranges)
+        except OSError:
+            abort(404)
+
+    return send_from_directory(base, rel_path, etag=etag, last_modified=st.st_mtime)
+
+
+def _get_folder_page(path, sort_by, limit, offset=0, cursor=None):
+    """Return (contents, total, next_cursor) for one page of a folder, or None if not a folder."""
+    loc = Path(base) / path.lstrip('/')
+    if _is_internal(path):
+        return None
+    try:
+        with _listing_phase('scan'):
+            entries = list(_with_dir_sizes(path, _scan_dir(loc)))
+            page, next_cursor = _page_entries(entries, sort_by, limit, offset, cursor)
+    except (NotADirectoryError, FileNotFoundError):
+        return None
+
+    g.listing_entries = len(entries)
+    with _listing_phase('render'):
+        contents = [_build_entry(path, loc, entry) for entry in page]
+    return contents, len(entries), next_cursor
+
+
+def _int_arg(name, default, minimum, maximum):
+    """Read an integer query argument, raising ValueError if it is malformed or out of range."""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError as e:
+        raise ValueError(f'{name} must be an integer') from e
+    if not minimum <= value <= maximum:
+        raise ValueError(f'{name} must be between {minimum} and {maximum}')
+    return value
+
+
+def _stream_folder(path, sort_by, fmt, human=False):
+    """Stream a folder listing as NDJSON or as a chunked JSON document, or None if not a folder.
+
+    With sort_by=none entries are emitted in on-disk order straight from scandir,
+    so the first bytes go out before the directory has been fully read.
+    """
+    loc = Path(base) / path.lstrip('/')
+    if _is_internal(path):
+        return None
+    try:
+        scandir_it = os.scandir(loc)
+    except (NotADirectoryError, FileNotFoundError):
+        return None
+
+    entries = _with_dir_sizes(path, _iter_dir(scandir_it))
+    if sort_by != 'none':
+        # Unsorted listings are scanned while streaming; only sorted ones are measured here
+        with _listing_phase('scan'):
+            entries = _sort_entries(list(entries), sort_by)
+        g.listing_entries = len(entries)
+
+    def build(entry):
+        built = _build_entry(path, loc, entry)
+        return _with_human_fields(built) if human else built
+
+    def generate_ndjson():
+        for entry in entries:
+            yield json.dumps(build(entry)) + '\n'
+
+    def generate_json():
+        yield json.dumps({'path': path, 'sort_by': sort_by})[:-1] + ', "contents": ['
+        total = 0
+        for entry in entries:
+            yield (',' if total else '') + json.dumps(build(entry))
+            total += 1
+        yield f'], "total": {total}}}'
+
+    if fmt == 'ndjson':
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    return Response(stream_with_context(generate_json()), mimetype='application/json')
+
+
+archive_formats = {
+    'zip': ('application/zip', '.zip'),
+    'tar': ('application/x-tar', '.tar'),
+    'tar.gz': ('application/gzip', '.tar.gz'),
+}
+
+
+class _ArchiveSink:
+    """Write-only file object that holds archive output until the response generator drains it."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _walk_archive(path):
+    """Yield (arcname, file_path, stat) for every member of the folder `path`, depth first.
+
+    Folders are yielded with a trailing slash and no file path. Every member
+    goes through `_resolve_path_in_base`, so symlinks pointing outside BASE
+    are skipped; symlinked folders are not descended into.
+    """
+    root_name = posixpath.basename(path.rstrip('/')) or 'files'
+    stack = [(path.strip('/'), root_name, os.stat(_resolve_path_in_base(path)))]
+    while stack:
+        rel_dir, arc_dir, dir_st = stack.pop()
+        try:
+            scandir_it = os.scandir(os.path.join(base, rel_dir))
+        except OSError:
+            continue
+        yield arc_dir + '/', None, dir_st
+        with scandir_it:
+            for entry in scandir_it:
+                if _is_internal_entry(entry):
+                    continue
+                rel_path = posixpath.join(rel_dir, entry.name)
+                try:
+                    file_path = _resolve_path_in_base(rel_path)
+                    st = os.stat(file_path)
+                except (ValueError, OSError):
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    if not entry.is_symlink():
+                        stack.append((rel_path, f'{arc_dir}/{entry.name}', st))
+                elif stat.S_ISREG(st.st_mode):
+                    yield f'{arc_dir}/{entry.name}', file_path, st
+
+
+def _read_member(file_path, size):
+    """Yield exactly `size` bytes of a file in chunks, zero-padding it if it shrank meanwhile."""
+    with open(file_path, 'rb') as f:
+        remaining = size
+        while remaining:
+            chunk = f.read(min(file_chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    while remaining:
+        pad = min(file_chunk_size, remaining)
+        remaining -= pad
+        yield bytes(pad)
+
+
+def _generate_zip(path, compress):
+    """Stream a ZIP of the folder `path`; files in the `archive` category are always stored."""
+    sink = _ArchiveSink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as zf:
+        for arcname, file_path, st in _walk_archive(path):
+            zinfo = zipfile.ZipInfo(arcname, max(time.localtime(st.st_mtime)[:6], (1980, 1, 1, 0, 0, 0)))
+            zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+            if file_path is None:
+                zinfo.external_attr |= 0x10  # MS-DOS directory flag
+                zf.writestr(zinfo, b'')
+                yield sink.drain()
+                continue
+            zinfo.file_size = st.st_size  # Lets zipfile pick zip64 up front
+            if compress and get_file_category(arcname) != 'archive':
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+            try:
+                chunks = _read_member(file_path, st.st_size)
+                first = next(chunks, b'')
+            except OSError:
+                continue
+            with zf.open(zinfo, 'w') as dest:
+                dest.write(first)
+                for chunk in chunks:
+                    dest.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _generate_tar(path, compress):
+    """Stream a tar (optionally gzipped) of the folder `path`, writing headers and data by hand.
+
+    tarfile.addfile() would copy a whole member before returning, so headers
+    come from TarInfo.tobuf() and the data is passed through chunk by chunk.
+    """
+    sink = _ArchiveSink()
+    out = gzip.GzipFile(filename='', mode='wb', fileobj=sink, mtime=0) if compress else sink
+    for arcname, file_path, st in _walk_archive(path):
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.mode = stat.S_IMODE(st.st_mode)
+        tarinfo.mtime = int(st.st_mtime)
+        if file_path is None:
+            tarinfo.type = tarfile.DIRTYPE
+            out.write(tarinfo.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'))
+            continue
+        tarinfo.size = st.st_size
+        try:
+            chunks = _read_member(file_path, st.st_size)
+            first = next(chunks, b'')
+        except OSError:
+            continue
+        out.write(tarinfo.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'))
+        out.write(first)
+        for chunk in chunks:
+            out.write(chunk)
+            yield sink.drain()
+        if st.st_size % tarfile.BLOCKSIZE:
+            out.write(bytes(tarfile.BLOCKSIZE - st.st_size % tarfile.BLOCKSIZE))
+        yield sink.drain()
+    out.write(bytes(tarfile.BLOCKSIZE * 2))
+    if compress:
+        out.close()
+    yield sink.drain()
+
+
+class PathIndex:
+    """Persistent SQLite index of every path under BASE, searchable by file name.
+
+    Names are indexed with an FTS5 trigram tokenizer (substring matches in
+    milliseconds, even with millions of rows); on SQLite builds without it,
+    search falls back to LIKE on the plain table. Each directory row records
+    the mtime its children were indexed at, so a crawl only re-reads
+    directories whose contents changed.
+
+    A background crawler keeps the index complete. Only one process per index
+    file runs it (the holder of an flock on `<db>.lock`), so gunicorn workers do
+    not crawl the tree four times. Write handlers call refresh_dir() to have
+    their own changes applied soon: it only queues the directory for a refresh
+    thread in the calling process, so a request never waits for the crawl of,
+    say, a freshly extracted tree. `on_refresh(rel_dir)` is called once a
+    queued directory has been applied.
+
+    The `dir_sizes` table holds the recursive byte and file count of every
+    indexed directory. It is maintained incrementally: whenever a directory's
+    files change, the difference is added to that directory and its ancestors.
+    """
+
+    def __init__(self, db_path, root, crawl_interval, on_refresh=None):
+        self.db_path = db_path
+        self.root = root
+        self.crawl_interval = crawl_interval
+        self.on_refresh = on_refresh
+        self.fts = True
+        self.owner = False
+        self.last_crawl = None
+        self.last_crawl_seconds = None
+        self.refreshed = 0
+        self._local = threading.local()
+        self._queue = OrderedDict()  # Directories waiting for the refresh thread, oldest first
+        self._active = None
+        self._cond = threading.Condition()
+
+    def start(self):
+        """Create the schema and start the crawler and refresh threads for this process."""
+        self._create_schema()
+        threading.Thread(target=self._run, name='path-index-crawler', daemon=True).start()
+        threading.Thread(target=self._run_refreshes, name='path-index-refresh', daemon=True).start()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _create_schema(self):
+        conn = self._conn()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT NOT NULL UNIQUE,
+                    parent TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    is_dir INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    is_symlink INTEGER NOT NULL,
+                    dir_mtime_ns INTEGER
+                )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_parent ON entries(parent)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS dir_sizes (
+                    path TEXT PRIMARY KEY,
+                    bytes INTEGER NOT NULL,
+                    files INTEGER NOT NULL
+                ) WITHOUT ROWID''')
+            if (conn.execute('SELECT 1 FROM entries LIMIT 1').fetchone()
+                    and not conn.execute('SELECT 1 FROM dir_sizes LIMIT 1').fetchone()):
+                self._rebuild_sizes(conn)  # Index created before dir_sizes existed
+        try:
+            with conn:
+                conn.execute('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+                        name, content='entries', content_rowid='id', tokenize='trigram')''')
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+                        INSERT INTO entries_fts(rowid, name) VALUES (new.id, new.name);
+                    END''')
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+                        INSERT INTO entries_fts(entries_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                    END''')
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS entries_au AFTER UPDATE OF name ON entries BEGIN
+                        INSERT INTO entries_fts(entries_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                        INSERT INTO entries_fts(rowid, name) VALUES (new.id, new.name);
+                    END''')
+        except sqlite3.OperationalError:
+            self.fts = False  # SQLite built without FTS5 or the trigram tokenizer
+
+    @staticmethod
+    def _subtree_bounds(path):
+        # Every descendant of `path` sorts between path + '/' and path + '0' ('0' follows '/').
+        prefix = path.rstrip('/') + '/'
+        return prefix, prefix[:-1] + '0'
+
+    @staticmethod
+    def _ancestors(path):
+        """Return `path` followed by each of its parent directories up to '/'."""
+        paths = [path]
+        while path != '/':
+            path = posixpath.dirname(path)
+            paths.append(path)
+        return paths
+
+    @staticmethod
+    def _begin(conn):
+        # Take the write lock before reading, so two workers syncing the same
+        # directory cannot both apply the same size difference.
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+
+    def _add_size(self, conn, rel_dir, bytes_delta, files_delta):
+        if bytes_delta or files_delta:
+            paths = self._ancestors(rel_dir)
+            conn.execute(f"UPDATE dir_sizes SET bytes = bytes + ?, files = files + ? "
+                         f"WHERE path IN ({','.join('?' * len(paths))})", (bytes_delta, files_delta, *paths))
+
+    def _rebuild_sizes(self, conn):
+        totals = {path: [0, 0] for path, in conn.execute(
+            'SELECT path FROM entries WHERE is_dir = 1 AND is_symlink = 0 AND dir_mtime_ns IS NOT NULL')}
+        for parent, size in conn.execute('SELECT parent, size FROM entries WHERE is_dir = 0 AND is_symlink = 0'):
+            for path in self._ancestors(parent):
+                if path in totals:
+                    totals[path][0] += size
+                    totals[path][1] += 1
+        conn.executemany('INSERT OR REPLACE INTO dir_sizes (path, bytes, files) VALUES (?, ?, ?)',
+                         ((path, size, files) for path, (size, files) in totals.items()))
+
+    def _remove_subtree(self, conn, path):
+        row = conn.execute('SELECT is_dir, size, is_symlink FROM entries WHERE path = ?', (path,)).fetchone()
+        removed = None
+        if row is not None and not row[2]:
+            if row[0]:
+                removed = conn.execute('SELECT bytes, files FROM dir_sizes WHERE path = ?', (path,)).fetchone()
+            else:
+                removed = (row[1], 1)
+        low, high = self._subtree_bounds(path)
+        conn.execute('DELETE FROM entries WHERE path = ? OR (path >= ? AND path < ?)', (path, low, high))
+        conn.execute('DELETE FROM dir_sizes WHERE path = ? OR (path >= ? AND path < ?)', (path, low, high))
+        if removed is not None and path != '/':
+            self._add_size(conn, posixpath.dirname(path), -removed[0], -removed[1])
+
+    def refresh_dir(self, rel_dir):
+        """Queue directory `rel_dir` to be synced with the index by the refresh thread, and return."""
+        with self._cond:
+            self._queue[ListingCache.normalize(rel_dir)] = None
+            self._cond.notify()
+
+    def queued(self):
+        """Return the directories queued or being refreshed in this process."""
+        with self._cond:
+            return [*self._queue, *([self._active] if self._active else [])]
+
+    def _refresh(self, rel_dir):
+        """Sync the direct children of `rel_dir`, crawling subdirectories that are new to the index."""
+        pending = [rel_dir]
+        conn = self._conn()
+        while pending:
+            with conn:
+                pending.extend(self._sync_dir(conn, pending.pop()))
+
+    def _run_refreshes(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                rel_dir, _ = self._queue.popitem(last=False)
+                self._active = rel_dir
+            try:
+                self._refresh(rel_dir)
+                self.refreshed += 1
+            except Exception as e:
+                print(f"Path index refresh of {rel_dir} failed: {e}")
+            finally:
+                with self._cond:
+                    self._active = None
+            if self.on_refresh is not None:
+                self.on_refresh(rel_dir)
+
+    def _sync_dir(self, conn, rel_dir):
+        """Re-read one directory; return the child directories that need to be crawled."""
+        self._begin(conn)
+        loc = os.path.join(self.root, rel_dir.lstrip('/'))
+        try:
+            dir_stat = os.stat(loc)
+            entries = _scan_dir(loc) if stat.S_ISDIR(dir_stat.st_mode) else None
+        except OSError:
+            entries = None
+        if entries is None:
+            if rel_dir != '/':
+                self._remove_subtree(conn, rel_dir)
+            return []
+
+        known = {row[0]: row[1:] for row in conn.execute(
+            'SELECT name, is_dir, size, mtime, dir_mtime_ns, is_symlink FROM entries WHERE parent = ?', (rel_dir,))}
+        conn.execute('INSERT OR IGNORE INTO dir_sizes (path, bytes, files) VALUES (?, 0, 0)', (rel_dir,))
+        bytes_delta = files_delta = 0
+        to_crawl = []
+        for entry in entries:
+            child = posixpath.join(rel_dir, entry.name)
+            old = known.pop(entry.name, None)
+            if old is not None and (bool(old[0]), bool(old[4])) != (entry.is_dir, entry.is_symlink):
+                self._remove_subtree(conn, child)
+                old = None
+            counted = not entry.is_dir and not entry.is_symlink
+            if old is None:
+                conn.execute(
+                    'INSERT INTO entries (path, parent, name, is_dir, size, mtime, is_symlink) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (child, rel_dir, entry.name, entry.is_dir, entry.size, entry.mtime, entry.is_symlink))
+                if counted:
+                    bytes_delta += entry.size
+                    files_delta += 1
+            elif old[1:3] != (entry.size, entry.mtime):
+                conn.execute('UPDATE entries SET size = ?, mtime = ? WHERE path = ?',
+                             (entry.size, entry.mtime, child))
+                if counted:
+                    bytes_delta += entry.size - old[1]
+            if entry.is_dir and not entry.is_symlink and (old is None or old[3] is None):
+                to_crawl.append(child)
+        for name in known:
+            self._remove_subtree(conn, posixpath.join(rel_dir, name))
+        self._add_size(conn, rel_dir, bytes_delta, files_delta)
+
+        conn.execute(
+            'INSERT INTO entries (path, parent, name, is_dir, size, mtime, is_symlink, dir_mtime_ns) '
+            'VALUES (?, ?, ?, 1, ?, ?, 0, ?) '
+            'ON CONFLICT(path) DO UPDATE SET dir_mtime_ns = excluded.dir_mtime_ns',
+            (rel_dir, posixpath.dirname(rel_dir) if rel_dir != '/' else '', posixpath.basename(rel_dir),
+             dir_stat.st_size, dir_stat.st_mtime, dir_stat.st_mtime_ns))
+        return to_crawl
+
+    def remove(self, rel_path):
+        """Drop `rel_path` and everything below it from the index."""
+        conn = self._conn()
+        with conn:
+            self._begin(conn)
+            self._remove_subtree(conn, ListingCache.normalize(rel_path))
+
+    def crawl(self):
+        """Walk the whole tree, re-reading only directories whose mtime changed since they were indexed."""
+        started = time.monotonic()
+        conn = self._conn()
+        pending = ['/']
+        while pending:
+            rel_dir = pending.pop()
+            loc = os.path.join(self.root, rel_dir.lstrip('/'))
+            try:
+                mtime_ns = os.stat(loc).st_mtime_ns
+            except OSError:
+                mtime_ns = None
+            row = conn.execute('SELECT dir_mtime_ns FROM entries WHERE path = ?', (rel_dir,)).fetchone()
+            if mtime_ns is None or row is None or row[0] != mtime_ns:
+                with conn:
+                    self._sync_dir(conn, rel_dir)
+            pending.extend(path for path, in conn.execute(
+                'SELECT path FROM entries WHERE parent = ? AND is_dir = 1 AND is_symlink = 0', (rel_dir,)))
+        self.last_crawl = time.time()
+        self.last_crawl_seconds = time.monotonic() - started
+
+    def _run(self):
+        lock_file = open(f'{self.db_path}.lock', 'a')
+        while True:
+            if not self.owner:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self.owner = True
+                except OSError:
+                    pass  # Another worker is crawling; try again later in case it exits
+            if self.owner:
+                try:
+                    self.crawl()
+                except Exception as e:
+                    print(f"Path index crawl failed: {e}")
+            time.sleep(self.crawl_interval if self.owner else min(self.crawl_interval, 60))
+
+    def search(self, query, limit, offset=0, under='/'):
+        """Return up to `limit` matching (path, name, is_dir, size, mtime) rows and a has-more flag.
+
+        Exact name matches rank first, then prefix matches, then FTS rank and
+        shorter names. Results can be restricted to the subtree `under`.
+        """
+        under = ListingCache.normalize(under)
+        escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        where, args = [], []
+        if self.fts and len(query) >= 3:
+            # The trigram tokenizer needs at least three characters to use the index.
+            source = 'entries_fts f JOIN entries e ON e.id = f.rowid'
+            where.append('entries_fts MATCH ?')
+            args.append('"' + query.replace('"', '""') + '"')
+            rank = 'f.rank, '
+        else:
+            source = 'entries e'
+            where.append("e.name LIKE ? ESCAPE '\\' AND e.parent != ''")
+            args.append(f'%{escaped}%')
+            rank = ''
+        if under != '/':
+            low, high = self._subtree_bounds(under)
+            where.append('e.path >= ? AND e.path < ?')
+            args.extend((low, high))
+
+        sql = (f"SELECT e.path, e.name, e.is_dir, e.size, e.mtime FROM {source} "
+               f"WHERE {' AND '.join(where)} "
+               f"ORDER BY lower(e.name) = lower(?) DESC, e.name LIKE ? ESCAPE '\\' DESC, "
+               f"{rank}length(e.name), e.path LIMIT ? OFFSET ?")
+        rows = self._conn().execute(sql, (*args, query, f'{escaped}%', limit + 1, offset)).fetchall()
+        return rows[:limit], len(rows) > limit
+
+    def dir_size(self, rel_dir):
+        """Return (bytes, files) below directory `rel_dir`, or None if it has not been indexed yet."""
+        return self._conn().execute('SELECT bytes, files FROM dir_sizes WHERE path = ?',
+                                    (ListingCache.normalize(rel_dir),)).fetchone()
+
+    def child_sizes(self, rel_dir):
+        """Return {name: (bytes, files)} for the indexed subdirectories of `rel_dir`."""
+        return {name: (size, files) for name, size, files in self._conn().execute(
+            'SELECT e.name, d.bytes, d.files FROM entries e JOIN dir_sizes d ON d.path = e.path '
+            'WHERE e.parent = ? AND e.is_dir = 1', (ListingCache.normalize(rel_dir),))}
+
+    def stats(self):
+        count, = self._conn().execute('SELECT count(*) FROM entries').fetchone()
+        return {'entries': count, 'owner': self.owner, 'fts': self.fts,
+                'last_crawl': self.last_crawl, 'last_crawl_seconds': self.last_crawl_seconds,
+                'refresh_queue': len(self.queued()), 'refreshed': self.refreshed}
+
+
+def _sizes_changed(rel_dir):
+    """Drop cached listings showing recursive sizes that changed with `rel_dir`, when folder sizes are on.
+
+    That is `rel_dir` itself (its subfolders' sizes) and every parent (its own).
+    """
+    if enable_dir_sizes:
+        for ancestor in PathIndex._ancestors(ListingCache.normalize(rel_dir)):
+            _invalidate_listing(ancestor)
+
+
+path_index = PathIndex(index_path, base, search_crawl_interval, on_refresh=_sizes_changed)
+if enable_search or enable_dir_sizes:
+    path_index.start()
+
+
+def _fs_changed(path, update_indexes=True):
+    """Apply a change to directory `path` (relative to BASE) to every in-process cache and index.
+
+    Shared on-disk indexes are only updated when `update_indexes` is set, so the
+    watcher in each gunicorn worker does not repeat the same index writes.
+    """
+    _invalidate_listing(path)
+    if enable_search or enable_dir_sizes:
+        if update_indexes:
+            path_index.refresh_dir(path)  # Applied in the background; _sizes_changed runs again then
+        _sizes_changed(path)
+
+
+class FsWatcher:
+    """Turn filesystem changes under BASE into _fs_changed() calls.
+
+    Uses Linux inotify through ctypes (one watch per directory) and falls back
+    to polling directory mtimes where inotify is unavailable. Events are
+    coalesced per directory: a directory is dispatched once no new event has
+    arrived for `coalesce` seconds, or at the latest after `max_delay`. An
+    event storm such as unpacking a 100k-file archive therefore turns into a
+    handful of directory refreshes rather than 100k of them.
+
+    Lag (time from the first event of a batch to its dispatch) is recorded so
+    /_api/stats can show how far behind the watcher is.
+
+    start() returns at once: the directory walk that sets up the watches (or
+    the first polling snapshot) runs on the watcher thread, so a big tree does
+    not hold up every gunicorn worker's import.
+    """
+
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                  | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+    def __init__(self, root, backend='auto', coalesce=0.5, max_delay=5.0, poll_interval=5.0):
+        self.root = root
+        self.backend = backend
+        self.coalesce = coalesce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.events = 0
+        self.batches = 0
+        self.dispatched = 0
+        self.overflows = 0
+        self.watch_errors = 0
+        self.last_lag = None
+        self.max_lag = 0.0
+        self._pending = {}  # rel_dir -> monotonic time of its first undispatched event
+        self._last_event = 0.0
+        self._wds = {}  # inotify watch descriptor -> rel_dir
+        self._libc = None
+        self._fd = None
+
+    def start(self):
+        if self.backend in ('auto', 'inotify'):
+            try:
+                self._init_inotify()
+                self.backend = 'inotify'
+            except OSError as e:
+                if self.backend == 'inotify':
+                    raise
+                print(f"inotify unavailable ({e}), falling back to polling")
+                self.backend = 'poll'
+        target = self._run_inotify if self.backend == 'inotify' else self._run_poll
+        threading.Thread(target=target, name=f'fs-watcher-{self.backend}', daemon=True).start()
+
+    def stats(self):
+        return {'backend': self.backend, 'watches': len(self._wds), 'events': self.events,
+                'batches': self.batches, 'dispatched': self.dispatched, 'pending': len(self._pending),
+                'overflows': self.overflows, 'watch_errors': self.watch_errors,
+                'last_lag_seconds': self.last_lag, 'max_lag_seconds': self.max_lag}
+
+    def _abs(self, rel_dir):
+        return os.path.join(self.root, rel_dir.lstrip('/'))
+
+    def _walk_dirs(self, rel_dir):
+        """Yield `rel_dir` and every directory below it, without following symlinks."""
+        pending = [rel_dir]
+        while pending:
+            current = pending.pop()
+            yield current
+            try:
+                with os.scandir(self._abs(current)) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False) and not _is_internal_entry(entry):
+                            pending.append(posixpath.join(current, entry.name))
+            except OSError:
+                continue
+
+    def _mark(self, rel_dir, now):
+        self.events += 1
+        self._pending.setdefault(rel_dir, now)
+        self._last_event = now
+
+    def _flush(self, now, force=False):
+        if not self._pending:
+            return
+        oldest = min(self._pending.values())
+        if not force and now - self._last_event < self.coalesce and now - oldest < self.max_delay:
+            return
+        batch, self._pending = self._pending, {}
+        for rel_dir in sorted(batch):
+            try:
+                _fs_changed(rel_dir, update_indexes=path_index.owner)
+            except Exception as e:
+                print(f"Watcher failed to refresh {rel_dir}: {e}")
+        self.batches += 1
+        self.dispatched += len(batch)
+        self.last_lag = time.monotonic() - oldest
+        self.max_lag = max(self.max_lag, self.last_lag)
+
+    # inotify backend
+
+    def _init_inotify(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self._fd = fd
+
+    def _add_watch(self, rel_dir):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(self._abs(rel_dir)), self.WATCH_MASK)
+        if wd < 0:
+            # Most likely ENOSPC (fs.inotify.max_user_watches); the crawler and cache TTL still cover it.
+            self.watch_errors += 1
+            return
+        self._wds[wd] = rel_dir
+
+    def _watch_subtree(self, rel_dir):
+        for current in self._walk_dirs(rel_dir):
+            self._add_watch(current)
+
+    def _unwatch_subtree(self, rel_dir):
+        prefix = rel_dir.rstrip('/') + '/'
+        for wd, path in list(self._wds.items()):
+            if path == rel_dir or path.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                self._wds.pop(wd, None)
+
+    def _run_inotify(self):
+        header = struct.Struct('iIII')
+        self._watch_subtree('/')
+        while True:
+            readable, _, _ = select.select([self._fd], [], [], self.coalesce)
+            now = time.monotonic()
+            if readable:
+                try:
+                    buf = os.read(self._fd, 1 << 16)
+                except BlockingIOError:
+                    buf = b''
+                offset = 0
+                while offset < len(buf):
+                    wd, mask, _cookie, length = header.unpack_from(buf, offset)
+                    name = os.fsdecode(buf[offset + header.size:offset + header.size + length].rstrip(b'\0'))
+                    offset += header.size + length
+                    self._handle_event(wd, mask, name, now)
+            self._flush(now)
+
+    def _handle_event(self, wd, mask, name, now):
+        if mask & self.IN_Q_OVERFLOW:
+            # Events were lost: drop every cached listing and let the index crawler catch up.
+            self.overflows += 1
+            listing_cache.clear()
+            self._mark('/', now)
+            return
+        rel_dir = self._wds.get(wd)
+        if rel_dir is None:
+            return
+        if rel_dir == '/' and name in _internal_names:
+            return
+        if mask & self.IN_IGNORED:
+            self._wds.pop(wd, None)
+            return
+        if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+            return  # Reported to the parent directory as IN_DELETE / IN_MOVED_FROM
+        if mask & self.IN_ISDIR and name:
+            child = posixpath.join(rel_dir, name)
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self._watch_subtree(child)
+            elif mask & self.IN_MOVED_FROM:
+                self._unwatch_subtree(child)
+        self._mark(rel_dir, now)
+
+    # polling backend
+
+    def _snapshot(self):
+        snapshot = {}
+        for rel_dir in self._walk_dirs('/'):
+            try:
+                snapshot[rel_dir] = os.stat(self._abs(rel_dir)).st_mtime_ns
+            except OSError:
+                continue
+        return snapshot
+
+    def _run_poll(self):
+        """Compare directory mtimes every poll_interval seconds.
+
+        Only catches changes that touch a directory's mtime (create, delete,
+        rename); in-place file rewrites are left to the cache TTL.
+        """
+        previous = self._snapshot()
+        while True:
+            time.sleep(self.poll_interval)
+            current = self._snapshot()
+            now = time.monotonic()
+            for rel_dir, mtime_ns in current.items():
+                if previous.get(rel_dir) != mtime_ns:
+                    self._mark(rel_dir, now)
+            for rel_dir in previous.keys() - current.keys():
+                self._mark(posixpath.dirname(rel_dir), now)
+            previous = current
+            self._flush(now, force=True)
+
+
+fs_watcher = FsWatcher(base, watcher_backend, watcher_coalesce, watcher_max_delay, watcher_poll_interval)
+if enable_watcher:
+    fs_watcher.start()
+
+
+@app.route("/api/", methods=['GET'])
+@app.route("/api/<path:path>", methods=['GET'])
+def api_list(path="/"):
+    """List a folder as JSON, or download a file.
+
+    Folders accept optional pagination: `limit` with either `offset` or the
+    opaque `cursor` returned as `next_cursor` by the previous page. With
+    `format=ndjson` or `format=stream` the listing is streamed instead, and
+    `format=columns` returns the compact form used for client-side rendering.
+
+    Entries carry raw `size_bytes` and `mtime` (epoch seconds); with `human=1`
+    the formatted `size` and `last_modified` strings are added as well.
+    """
+    sort_by = request.args.get('sort_by', 'date')
+    fmt = request.args.get('format')
+    human = _human_arg()
+    if fmt in ('ndjson', 'stream'):
+        response = _stream_folder(path, sort_by, fmt, human)
+        if response is not None:
+            log_request_info('api_list', path, 'GET',
+                             status_code=200, is_directory=True,
+                             sort_by=sort_by, stream_format=fmt)
+            return response
+
+    if fmt == 'columns':
+        listing = _get_folder_entries(path, sort_by)
+        if listing is not None:
+            response = _conditional_listing(listing, 'columns', lambda: jsonify(
+                _columnar_listing(path, sort_by, listing.contents)))
+            log_request_info('api_list', path, 'GET',
+                             status_code=response.status_code, is_directory=True,
+                             file_count=len(listing.contents), sort_by=sort_by, stream_format=fmt)
+            return response
+
+    if any(arg in request.args for arg in ('limit', 'offset', 'cursor')):
+        try:
+            limit = _int_arg('limit', api_max_page_size, 1, api_max_page_size)
+            offset = _int_arg('offset', 0, 0, 2 ** 31)
+            page = _get_folder_page(path, sort_by, limit, offset, request.args.get('cursor'))
+        except ValueError as e:
+            log_request_info('api_list', path, 'GET', status_code=400, error=str(e))
+            return jsonify({'ok': False, 'error': str(e)}), 400
+        if page is not None:
+            dir_contents, total, next_cursor = page
+            if human:
+                dir_contents = [_with_human_fields(entry) for entry in dir_contents]
+            log_request_info('api_list', path, 'GET',
+                             status_code=200, is_directory=True,
+                             file_count=len(dir_contents), sort_by=sort_by,
+                             limit=limit, offset=offset)
+            return {'path': path, 'contents': dir_contents, 'total': total, 'sort_by': sort_by,
+                    'limit': limit, 'offset': offset, 'next_cursor': next_cursor}
+
+    listing = _get_folder(path, False, sort_by)
+    if listing is not None:
+        dir_contents = listing.contents
+        if human:
+            response = _conditional_listing(listing, 'json-human', lambda: jsonify(
+                {'path': path, 'contents': [_with_human_fields(entry) for entry in dir_contents],
+                 'total': len(dir_contents), 'sort_by': sort_by}))
+        else:
+            response = _conditional_listing(listing, 'json', lambda: jsonify(
+                {'path': path, 'contents': dir_contents, 'total': len(dir_contents), 'sort_by': sort_by}))
+        log_request_info('api_list', path, 'GET',
+                         status_code=response.status_code, is_directory=True,
+                         file_count=len(dir_contents), sort_by=sort_by)
+        return response
+    else:
+        log_request_info('api_list', path, 'GET',
+                         status_code=200, is_directory=False,
+                         resource_type='file', offload=download_offload or 'none')
+        return _send_file(path)
+
+
+@app.route("/_api/archive/", methods=['GET'])
+@app.route("/_api/archive/<path:path>", methods=['GET'])
+def api_archive(path="/"):
+    """Stream a folder and everything below it as a ZIP or tar archive.
+
+    Accepts `format` (zip, tar or tar.gz; default zip) and, for ZIP,
+    `compression` (deflate or store; default deflate). Nothing is buffered
+    on disk: the archive is generated while it is being sent.
+    """
+    fmt = request.args.get('format', 'zip')
+    compression = request.args.get('compression', 'deflate')
+    if fmt not in archive_formats or compression not in ('deflate', 'store'):
+        log_request_info('archive', path, 'GET', status_code=400, error='Unsupported format')
+        return jsonify({'ok': False, 'error': 'Unsupported format'}), 400
+
+    try:
+        target = _resolve_path_in_base(path)
+    except ValueError as e:
+        log_request_info('archive', path, 'GET', status_code=400, error=str(e))
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    if _is_internal(path) or not target.is_dir():
+        log_request_info('archive', path, 'GET', status_code=404, error='Not found')
+        return jsonify({'ok': False, 'error': 'Not found'}), 404
+
+    if fmt == 'zip':
+        chunks = _generate_zip(path, compression == 'deflate')
+    else:
+        chunks = _generate_tar(path, fmt == 'tar.gz')
+    mimetype, suffix = archive_formats[fmt]
+    response = Response(stream_with_context(chunk for chunk in chunks if chunk), mimetype=mimetype)
+    response.headers.set('Content-Disposition', 'attachment',
+                         filename=(posixpath.basename(path.rstrip('/')) or 'files') + suffix)
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.cache_control.no_store = True
+
+    log_request_info('archive', path, 'GET', status_code=200, archive_format=fmt, compression=compression)
+    return response
+
+
+@app.route('/', methods=['GET', 'POST'])
+@app.route('/<path:path>', methods=['GET', 'POST'])
+def root(path="/"):
+    base_location = base
+    loc = os.path.join(base_location, path.lstrip('/'))
+
+    if request.method == 'POST':
+        return handle_file_upload(request, base_location)
+
+    clean_path = f"/{path}".replace('//', '/')
+
+    if os.path.isdir(loc) and not _is_internal(path):
+        sort_by = request.args.get('sort_by', 'name')
+        render_mode = request.args.get('render')
+        entries = None
+        if render_mode not in ('client', 'server'):
+            if client_render_threshold > 0:
+                # Counted from the cached DirEntry listing, which the columnar API (client
+                # mode) or _get_folder below (server mode) then reuses without a scan.
+                entries = _get_folder_entries(path, sort_by)
+            use_client = entries is not None and len(entries.contents) >= client_render_threshold
+            render_mode = 'client' if use_client else 'server'
+        if render_mode == 'client':
+            # Only the page shell is rendered here; rows come from the columnar API.
+            response = make_response(render_template(
+                'index.jinja2',
+                path=path,
+                list_files=[],
+                client_render=True,
+                thumbnail_suffixes=sorted(thumbnails.suffixes) if thumbnail_cache is not None else [],
+                notice_text=notice_text,
+                enable_upload=enable_upload,
+                enable_new_folder=enable_new_folder,
+                enable_delete=enable_delete,
+                enable_search=enable_search,
+                sort_by=sort_by
+            ))
+            log_request_info('root', clean_path, 'GET',
+                             status_code=200, is_directory=True,
+                             sort_by=sort_by, render='client')
+            return response
+
+        listing = _get_folder(path, include_dots=True, sort_by=sort_by)
+        if listing is None:
+            return _send_file(path)  # Removed since the isdir check: 404
+        dir_contents = listing.contents
+
+        response = _conditional_listing(listing, 'html', lambda: render_template(
+            'index.jinja2',
+            path=path,
+            list_files=dir_contents,
+            sort_query='?' + urlencode({'sort_by': sort_by}, safe=EntryUrls.query_safe),
+            notice_text=notice_text,
+            enable_upload=enable_upload,
+            enable_new_folder=enable_new_folder,
+            enable_delete=enable_delete,
+            enable_search=enable_search,
+            sort_by=sort_by
+        ))
+
+        log_request_info('root', clean_path, 'GET',
+                         status_code=response.status_code, is_directory=True,
+                         file_count=len(dir_contents), sort_by=sort_by)
+        return response
+    else:
+        file_size = os.path.getsize(loc) if os.path.exists(loc) else 0
+        log_request_info('root', clean_path, 'GET',
+                         status_code=200, is_directory=False,
+                         resource_type='file', file_size=file_size,
+                         offload=download_offload or 'none')
+        return _send_file(path)
+
+
+@app.route('/_api/stats', methods=['GET'])
+def api_stats():
+    """Return in-process cache counters for this worker."""
+    stats = {'pid': os.getpid(), 'listing_cache': listing_cache.stats()}
+    if enable_search or enable_dir_sizes:
+        stats['path_index'] = path_index.stats()
+    if enable_watcher:
+        stats['watcher'] = fs_watcher.stats()
+    stats['trash'] = trash.stats()
+    stats['checksums'] = checksum_cache.stats()
+    if thumbnail_cache is not None:
+        stats['thumbnails'] = thumbnail_cache.stats()
+    for handler in loki_logger.handlers:
+        if isinstance(handler, BatchingLokiHandler):
+            stats['loki'] = handler.stats()
+    return jsonify(stats)
+
+
+@app.route('/_api/search', methods=['GET'])
+def api_search():
+    """Search file and folder names under BASE.
+
+    Accepts `q` (required), `path` to restrict results to a subtree, and
+    `limit`/`offset` for paging through ranked results.
+    """
+    query = (request.args.get('q') or '').strip()
+    if not enable_search:
+        log_request_info('search', query, 'GET', status_code=403, error='Search is disabled')
+        return jsonify({'ok': False, 'error': 'Search is disabled'}), 403
+    if not query:
+        log_request_info('search', query, 'GET', status_code=400, error='Missing q')
+        return jsonify({'ok': False, 'error': 'Missing q'}), 400
+    try:
+        limit = _int_arg('limit', 50, 1, api_max_page_size)
+        offset = _int_arg('offset', 0, 0, 2 ** 31)
+    except ValueError as e:
+        log_request_info('search', query, 'GET', status_code=400, error=str(e))
+        return jsonify({'ok': False, 'error': str(e)}), 400
+
+    rows, has_more = path_index.search(query, limit, offset, request.args.get('path', '/'))
+    results = []
+    for rel_path, name, is_dir, size, mtime in rows:
+        parent = posixpath.dirname(rel_path)
+        entry = DirEntry(name=name, is_dir=bool(is_dir), size=size, mtime=mtime, is_symlink=False)
+        results.append(_build_entry(parent, os.path.join(base, parent.lstrip('/')), entry))
+    if _human_arg():
+        results = [_with_human_fields(result) for result in results]
+
+    log_request_info('search', query, 'GET', status_code=200, result_count=len(results), offset=offset)
+    return jsonify({'query': query, 'results': results, 'limit': limit, 'offset': offset,
+                    'next_offset': offset + limit if has_more else None})
+
+
+@app.route("/_api/du/", methods=['GET'])
+@app.route("/_api/du/<path:path>", methods=['GET'])
+def api_du(path="/"):
+    """Return the recursive size and file count of a folder and of each of its subfolders.
+
+    Figures come from the size index, so nothing is walked per request. While a
+    refresh that can change a figure is queued or running, the last known
+    value is returned with `pending: true`. A folder the index has not reached
+    yet is queued for a refresh and answered with 202.
+    """
+    if not enable_dir_sizes:
+        log_request_info('du', path, 'GET', status_code=403, error='Folder sizes are disabled')
+        return jsonify({'ok': False, 'error': 'Folder sizes are disabled'}), 403
+    rel_dir = ListingCache.normalize(path)
+    loc = safe_join(base, rel_dir.lstrip('/'))
+    if _is_internal(rel_dir) or loc is None or not os.path.isdir(loc):
+        log_request_info('du', rel_dir, 'GET', status_code=404, error='Not found')
+        return jsonify({'ok': False, 'error': 'Not found'}), 404
+    busy = path_index.queued()
+    totals = path_index.dir_size(rel_dir)
+    if totals is None:
+        if rel_dir not in busy:
+            path_index.refresh_dir(rel_dir)
+        log_request_info('du', rel_dir, 'GET', status_code=202)
+        return jsonify({'path': rel_dir, 'bytes': None, 'files': None, 'size': None, 'pending': True,
+                        'children': []}), 202
+
+    children = []
+    for name, (size, files) in path_index.child_sizes(rel_dir).items():
+        child = posixpath.join(rel_dir, name)
+        children.append({'name': name, 'path': child, 'bytes': size, 'files': files,
+                         'size': _natural_size(size), 'pending': _sizes_pending(child, busy)})
+    children.sort(key=lambda child: child['bytes'], reverse=True)
+    log_request_info('du', rel_dir, 'GET', status_code=200, folder_count=len(children))
+    return jsonify({'path': rel_dir, 'bytes': totals[0], 'files': totals[1], 'size': _natural_size(totals[0]),
+                    'pending': _sizes_pending(rel_dir, busy), 'children': children})
+
+
+class ThumbnailCache:
+    """Image thumbnails rendered by a process pool into a content-addressed cache directory.
+
+    A thumbnail is stored as `<key[:2]>/<key>.<ext>`, where the key hashes the
+    image's path, mtime, size and the thumbnail size, so a changed image simply
+    gets a new entry and stale ones age out. Hits refresh the file's mtime
+    (at most hourly), and when the cache grows past `max_bytes` the least
+    recently used files are removed until it is back under 90%.
+
+    Concurrent requests for the same thumbnail render it once: within a
+    process they share one Future, and across workers they serialise on an
+    flock of the key's fan-out directory and then find the finished file.
+    The pool uses spawn, which re-runs the __main__ script in each new process;
+    under `python app.py` the main block swaps in an empty __main__ first, so
+    pool processes only ever import thumbnails.py.
+    """
+
+    touch_interval = 3600
+
+    def __init__(self, cache_dir, max_bytes, workers):
+        self.dir = cache_dir
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.pool = None
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.total = None
+        self.hits = 0
+        self.rendered = 0
+        self.shared = 0
+        self.evicted = 0
+
+    def key(self, rel_path, st, size):
+        return hashlib.sha256(f'{rel_path}\0{st.st_mtime_ns}\0{st.st_size}\0{size}'.encode()).hexdigest()
+
+    def relative_path(self, key):
+        return f'{key[:2]}/{key}.{thumbnails.output_format.lower()}'
+
+    def get(self, key, file_path, size):
+        """Return the cache-relative path of the thumbnail for `key`, rendering it from `file_path` if needed."""
+        rel_thumb = self.relative_path(key)
+        thumb_path = os.path.join(self.dir, rel_thumb)
+        try:
+            st = os.stat(thumb_path)
+        except FileNotFoundError:
+            pass
+        else:
+            self.hits += 1
+            if time.time() - st.st_mtime > self.touch_interval:
+                os.utime(thumb_path)
+            return rel_thumb
+
+        with self.lock:
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = concurrent.futures.Future()
+            else:
+                self.shared += 1
+        if not owner:
+            return future.result()
+        try:
+            self._render(file_path, thumb_path, size)
+            future.set_result(rel_thumb)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+        return rel_thumb
+
+    def _render(self, file_path, thumb_path, size):
+        fan_out = os.path.dirname(thumb_path)
+        os.makedirs(fan_out, exist_ok=True)
+        with open(os.path.join(fan_out, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if os.path.exists(thumb_path):
+                return  # Another worker rendered it while we waited
+            with self.lock:
+                if self.pool is None:
+                    self.pool = concurrent.futures.ProcessPoolExecutor(
+                        self.workers, mp_context=multiprocessing.get_context('spawn'))
+            tmp_path = f'{thumb_path}.{uuid.uuid4().hex}.tmp'
+            try:
+                nbytes = self.pool.submit(thumbnails.render, file_path, tmp_path, size).result()
+                os.replace(tmp_path, thumb_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        self.rendered += 1
+        with self.lock:
+            if self.total is not None:
+                self.total += nbytes
+            over_budget = self.total is None or self.total > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Recount the cache and, if it is over budget, remove least recently used thumbnails."""
+        try:
+            lock_file = open(os.path.join(self.dir, '.evict.lock'), 'a')
+        except OSError:
+            return
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return  # Another worker is evicting
+            files = []
+            for fan_out in os.scandir(self.dir):
+                if not fan_out.is_dir(follow_symlinks=False):
+                    continue
+                for entry in os.scandir(fan_out.path):
+                    if entry.name.startswith('.') or entry.name.endswith('.tmp'):
+                        continue
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, entry.path))
+            total = sum(nbytes for _, nbytes, _ in files)
+            if total > self.max_bytes:
+                files.sort()
+                for _, nbytes, thumb_path in files:
+                    if total <= self.max_bytes * 0.9:
+                        break
+                    try:
+                        os.unlink(thumb_path)
+                    except FileNotFoundError:
+                        pass
+                    total -= nbytes
+                    self.evicted += 1
+            with self.lock:
+                self.total = total
+
+    def stats(self):
+        return {'hits': self.hits, 'rendered': self.rendered, 'shared': self.shared,
+                'evicted': self.evicted, 'bytes': self.total, 'max_bytes': self.max_bytes}
+
+
+thumbnail_sizes = (64, 128, 256, 512)
+thumbnail_cache = ThumbnailCache(thumbnail_cache_dir, thumbnail_cache_size, thumbnail_workers) if enable_thumbnails else None
+
+
+@app.route('/_api/thumb/<path:path>', methods=['GET'])
+def api_thumb(path):
+    """Return a thumbnail of an image under BASE, fitting in `size` x `size` pixels (64, 128, 256 or 512).
+
+    The original is only stat'ed once its thumbnail is cached. Listings add
+    `v=<mtime>` to thumbnail URLs; such responses may be cached indefinitely.
+    """
+    if thumbnail_cache is None:
+        log_request_info('thumb', path, 'GET', status_code=404, error='Thumbnails are disabled')
+        return jsonify({'ok': False, 'error': 'Thumbnails are disabled'}), 404
+    size = request.args.get('size', '128')
+    if not size.isdigit() or int(size) not in thumbnail_sizes:
+        log_request_info('thumb', path, 'GET', status_code=400, error='Invalid size')
+        return jsonify({'ok': False, 'error': f'size must be one of {", ".join(map(str, thumbnail_sizes))}'}), 400
+    size = int(size)
+
+    rel_path = '/' + path.strip('/')
+    file_path = safe_join(base, rel_path.lstrip('/'))
+    try:
+        st = None if file_path is None or _is_internal(rel_path) else os.stat(file_path)
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        log_request_info('thumb', rel_path, 'GET', status_code=404, error='Not found')
+        return jsonify({'ok': False, 'error': 'Not found'}), 404
+    if os.path.splitext(file_path)[1].lower() not in thumbnails.suffixes:
+        log_request_info('thumb', rel_path, 'GET', status_code=415, error='Not an image')
+        return jsonify({'ok': False, 'error': 'Not an image'}), 415
+
+    key = thumbnail_cache.key(rel_path, st, size)
+    if _is_not_modified(key, st.st_mtime):
+        response = make_response('', 304)
+    else:
+        try:
+            rel_thumb = thumbnail_cache.get(key, file_path, size)
+        except Exception as e:
+            # Pillow raises many error types for truncated or unreadable images
+            log_request_info('thumb', rel_path, 'GET', status_code=415, error=str(e))
+            return jsonify({'ok': False, 'error': 'Unable to read image'}), 415
+        response = send_from_directory(thumbnail_cache.dir, rel_thumb, mimetype=thumbnails.output_mimetype,
+                                       etag=key, conditional=False)
+    response.set_etag(key)
+    if request.args.get('v'):
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    log_request_info('thumb', rel_path, 'GET', status_code=response.status_code, size=size)
+    return response
+
+
+# Categories offered a preview in listings; the API accepts any file that is not binary
+preview_categories = frozenset({'log', 'text', 'json', 'csv'})
+preview_max_lines = 10000
+preview_max_bytes = 1024 * 1024
+line_index_block = 1024 * 1024
+line_index_cache_size = 64
+follow_poll_interval = 1.0
+follow_keepalive = 15
+follow_max_duration = 300
+
+
+class LineIndex(NamedTuple):
+    """Sparse line index of a file: `counts[i]` newlines come before byte i * line_index_block.
+
+    Only whole blocks are indexed. `tail` holds the last indexed bytes, so a
+    file that has only been appended to can be recognised and extended.
+    """
+    size: int
+    counts: tuple
+    tail: bytes
+
+
+# (st_dev, st_ino) -> LineIndex, least recently used first
+_line_indexes = OrderedDict()
+_line_indexes_lock = threading.Lock()
+
+
+def _line_index(mm, st):
+    """Return the LineIndex of the mapped file, reusing (and extending) the cached one while the file only grows."""
+    key = (st.st_dev, st.st_ino)
+    with _line_indexes_lock:
+        index = _line_indexes.get(key)
+        if index is not None:
+            _line_indexes.move_to_end(key)
+    if index is not None and (index.size > len(mm) or mm[index.size - len(index.tail):index.size] != index.tail):
+        index = None  # Rewritten or truncated
+    counts = list(index.counts) if index is not None else [0]
+    size = (len(counts) - 1) * line_index_block
+    whole_blocks = len(mm) // line_index_block
+    if index is not None and len(counts) - 1 == whole_blocks:
+        return index
+    for start in range(size, whole_blocks * line_index_block, line_index_block):
+        counts.append(counts[-1] + mm[start:start + line_index_block].count(b'\n'))
+    size = whole_blocks * line_index_block
+    index = LineIndex(size, tuple(counts), mm[max(size - 64, 0):size])
+    with _line_indexes_lock:
+        _line_indexes[key] = index
+        while len(_line_indexes) > line_index_cache_size:
+            _line_indexes.popitem(last=False)
+    return index
+
+
+def _skip_lines(mm, offset, count, limit):
+    """Return the offset just past the `count`-th newline at or after `offset`, but not beyond `limit`."""
+    while count > 0 and offset < limit:
+        end = min(offset + line_index_block, limit)
+        newlines = mm[offset:end].count(b'\n')
+        if newlines < count:
+            count -= newlines
+            offset = end
+            continue
+        for _ in range(count):
+            offset = mm.find(b'\n', offset) + 1
+        return offset
+    return min(offset, limit)
+
+
+def _split_lines(data):
+    lines = data.decode('utf-8', 'replace').split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+def _preview_lines(mm, offset, count):
+    """Read up to `count` lines (and at most preview_max_bytes) starting at `offset`; return (lines, end offset)."""
+    end = _skip_lines(mm, offset, count, min(offset + preview_max_bytes, len(mm)))
+    return _split_lines(mm[offset:end]), end
+
+
+def _preview_tail(mm, count):
+    """Return (offset, lines) for the last `count` lines (at most preview_max_bytes) of the mapped file."""
+    end = len(mm)
+    floor = max(end - preview_max_bytes, 0)
+    # A trailing newline ends the last line rather than starting an empty one
+    pos = end - 1 if mm[end - 1:end] == b'\n' else end
+    start = floor
+    for _ in range(count):
+        newline = mm.rfind(b'\n', floor, pos)
+        if newline < 0:
+            start = floor
+            break
+        start = newline + 1
+        pos = newline
+    return start, _split_lines(mm[start:end])
+
+
+def _follow_events(file_path, offset):
+    """Server-sent events carrying lines appended to `file_path` after byte `offset`.
+
+    Only the new bytes are read. Each `lines` event's id is the offset after its
+    last complete line, so an EventSource that reconnects (streams end after
+    follow_max_duration) resumes exactly there via Last-Event-ID.
+    """
+    deadline = time.monotonic() + follow_max_duration
+    last_sent = time.monotonic()
+    partial = b''
+    f = open(file_path, 'rb')
+    try:
+        ino = os.fstat(f.fileno()).st_ino
+        yield f'retry: {int(follow_poll_interval * 1000)}\n\n'
+        while time.monotonic() < deadline:
+            try:
+                st = os.stat(file_path)
+            except FileNotFoundError:
+                yield 'event: gone\ndata: {}\n\n'
+                return
+            if st.st_ino != ino or st.st_size < offset:
+                # Rotated or truncated: start over at the beginning of the current file
+                if st.st_ino != ino:
+                    f.close()
+                    f = open(file_path, 'rb')
+                    ino = os.fstat(f.fileno()).st_ino
+                offset = 0
+                partial = b''
+                yield 'event: truncated\ndata: {}\n\n'
+            if st.st_size > offset:
+                chunk = os.pread(f.fileno(), min(st.st_size - offset, preview_max_bytes), offset)
+                offset += len(chunk)
+                data = partial + chunk
+                cut = data.rfind(b'\n') + 1
+                if cut == 0 and len(data) >= preview_max_bytes:
+                    cut = len(data)  # An overlong line is sent in pieces
+                partial = data[cut:]
+                if cut:
+                    yield f'id: {offset - len(partial)}\nevent: lines\ndata: {json.dumps(_split_lines(data[:cut]))}\n\n'
+                    last_sent = time.monotonic()
+                continue
+            if time.monotonic() - last_sent >= follow_keepalive:
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(follow_poll_interval)
+    finally:
+        f.close()
+
+
+@app.route('/_api/preview/<path:path>', methods=['GET'])
+def api_preview(path):
+    """Return part of a text file as JSON lines, without reading the rest of it.
+
+    `mode` is `tail` (default, the last `lines` lines), `head` (the first ones),
+    `lines` (`lines` lines from line number `start`, found through a cached
+    sparse line index) or `follow` (server-sent events with lines appended
+    after byte `offset`, by default the current end of the file). Responses
+    are capped at preview_max_bytes.
+
+    A follow stream holds its thread for up to follow_max_duration, far past
+    Gunicorn's worker timeout, so it is only served when requests run on
+    threads (the ASGI bridge or the development server); sync workers get 501.
+    """
+    rel_path = '/' + path.strip('/')
+    file_path = safe_join(base, rel_path.lstrip('/'))
+    mode = request.args.get('mode', 'tail')
+    try:
+        if mode not in ('head', 'tail', 'lines', 'follow'):
+            raise ValueError('mode must be head, tail, lines or follow')
+        count = _int_arg('lines', 100, 1, preview_max_lines)
+        start_line = _int_arg('start', 1, 1, 2 ** 63)
+        offset = _int_arg('offset', -1, 0, 2 ** 63)
+        if request.headers.get('Last-Event-ID', '').isdigit():
+            offset = int(request.headers['Last-Event-ID'])
+    except ValueError as e:
+        log_request_info('preview', rel_path, 'GET', status_code=400, error=str(e))
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    if mode == 'follow' and not request.environ.get('wsgi.multithread'):
+        log_request_info('preview', rel_path, 'GET', status_code=501, error='Follow needs SERVER_MODE=asgi')
+        return jsonify({'ok': False, 'error': 'Following a file needs SERVER_MODE=asgi'}), 501
+
+    try:
+        if file_path is None or _is_internal(rel_path):
+            raise FileNotFoundError(rel_path)
+        f = open(file_path, 'rb')
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        log_request_info('preview', rel_path, 'GET', status_code=404, error='Not found')
+        return jsonify({'ok': False, 'error': 'Not found'}), 404
+
+    with f:
+        st = os.fstat(f.fileno())
+        if not stat.S_ISREG(st.st_mode):
+            log_request_info('preview', rel_path, 'GET', status_code=404, error='Not found')
+            return jsonify({'ok': False, 'error': 'Not found'}), 404
+        # Pages are only read as they are touched, so a tail of a huge log reads just its end.
+        # bytes has the same find/rfind/count/slicing API for the empty file mmap() rejects.
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size else b''
+        try:
+            if b'\0' in mm[:8192]:
+                log_request_info('preview', rel_path, 'GET', status_code=415, error='Binary file')
+                return jsonify({'ok': False, 'error': 'Not a text file'}), 415
+
+            if mode == 'follow':
+                response = Response(stream_with_context(_follow_events(file_path, offset if offset >= 0 else st.st_size)),
+                                    mimetype='text/event-stream')
+                response.cache_control.no_cache = True
+                response.headers['X-Accel-Buffering'] = 'no'
+                log_request_info('preview', rel_path, 'GET', status_code=200, mode=mode)
+                return response
+
+            result = {'path': rel_path, 'mode': mode, 'size': st.st_size}
+            if mode == 'tail':
+                start, lines = _preview_tail(mm, count)
+                result.update(offset=start, end_offset=st.st_size, lines=lines)
+            elif mode == 'head':
+                lines, end = _preview_lines(mm, 0, count)
+                result.update(offset=0, end_offset=end, first_line=1, lines=lines)
+            else:
+                index = _line_index(mm, st)
+                block = bisect.bisect_right(index.counts, start_line - 1) - 1
+                start = _skip_lines(mm, block * line_index_block, start_line - 1 - index.counts[block], len(mm))
+                lines, end = _preview_lines(mm, start, count)
+                total = index.counts[-1] + mm[index.size:].count(b'\n')
+                if mm[-1:] not in (b'', b'\n'):
+                    total += 1  # Last line without a newline
+                result.update(offset=start, end_offset=end, first_line=start_line, total_lines=total, lines=lines)
+        finally:
+            if isinstance(mm, mmap.mmap):
+                mm.close()
+
+    result['truncated'] = result['end_offset'] - result['offset'] >= preview_max_bytes
+    log_request_info('preview', rel_path, 'GET', status_code=200, mode=mode, line_count=len(result['lines']))
+    return jsonify(result)
+
+
+checksum_algorithms = ('sha256', 'blake2b')
+hash_chunk_size = 1024 * 1024
+duplicate_probe_size = 64 * 1024
+
+
+def _hash_file(f, algorithm, limit=None):
+    """Hash an unbuffered file from its current position, reusing one buffer (hashlib drops the GIL meanwhile)."""
+    digest = hashlib.new(algorithm)
+    buffer = bytearray(hash_chunk_size if limit is None else min(limit, hash_chunk_size))
+    view = memoryview(buffer)
+    remaining = limit
+    while remaining is None or remaining > 0:
+        n = f.readinto(buffer if remaining is None or remaining >= len(buffer) else view[:remaining])
+        if not n:
+            break
+        digest.update(view[:n])
+        if remaining is not None:
+            remaining -= n
+    return digest.hexdigest()
+
+
+class ChecksumCache:
+    """Persistent SQLite cache of file digests, keyed by (dev, ino, algorithm).
+
+    Each row also records the size and mtime_ns the file had when it was
+    hashed, and lookup() only returns the digest if both still match the
+    file's current stat, so writing to a file invalidates its row. Rehashing
+    replaces the row in place, so there is one row per file and algorithm.
+    A digest is not stored if the file changed while it was being read. The
+    database lives outside BASE and is shared by all workers.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.hits = 0
+        self.computed = 0
+        self.bytes_hashed = 0
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS checksums (
+                        dev INTEGER NOT NULL,
+                        ino INTEGER NOT NULL,
+                        algorithm TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        mtime_ns INTEGER NOT NULL,
+                        digest TEXT NOT NULL,
+                        PRIMARY KEY (dev, ino, algorithm)
+                    ) WITHOUT ROWID''')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def lookup(self, st, algorithm):
+        """Return the cached digest for a file with stat result `st`, or None."""
+        row = self._conn().execute(
+            'SELECT digest FROM checksums WHERE dev = ? AND ino = ? AND algorithm = ? AND size = ? AND mtime_ns = ?',
+            (st.st_dev, st.st_ino, algorithm, st.st_size, st.st_mtime_ns)).fetchone()
+        return row[0] if row else None
+
+    def digest(self, file_path, algorithm):
+        """Return (hex digest, stat, cached) for the file at `file_path`, hashing it only if it is not cached."""
+        with open(file_path, 'rb', buffering=0) as f:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                raise IsADirectoryError(file_path)
+            digest = self.lookup(st, algorithm)
+            if digest is not None:
+                self.hits += 1
+                return digest, st, True
+            digest = _hash_file(f, algorithm)
+            after = os.fstat(f.fileno())
+        self.computed += 1
+        self.bytes_hashed += st.st_size
+        if (after.st_size, after.st_mtime_ns) == (st.st_size, st.st_mtime_ns):  # Not cached if written meanwhile
+            conn = self._conn()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?)',
+                             (st.st_dev, st.st_ino, algorithm, st.st_size, st.st_mtime_ns, digest))
+        return digest, st, False
+
+    def stats(self):
+        return {'hits': self.hits, 'computed': self.computed, 'bytes_hashed': self.bytes_hashed}
+
+
+checksum_cache = ChecksumCache(checksum_db_path)
+checksum_pool = concurrent.futures.ThreadPoolExecutor(checksum_workers, thread_name_prefix='checksum')
+
+
+def _walk_files(path):
+    """Yield (browser path, file path, stat) for every regular file below the folder `path`."""
+    prefix = '/' + path.strip('/')
+    for arcname, file_path, st in _walk_archive(path):
+        if file_path is not None:
+            yield posixpath.join(prefix, arcname.split('/', 1)[1]), file_path, st
+
+
+def _map_bounded(fn, items):
+    """Yield (item, result or exception) for `fn` applied to `items` on checksum_pool, as results complete.
+
+    At most a few tasks per worker are queued, so huge trees are walked lazily.
+    """
+    pending = {}
+    items = iter(items)
+    window = checksum_workers * 4
+    while True:
+        for item in items:
+            pending[checksum_pool.submit(fn, item)] = item
+            if len(pending) >= window:
+                break
+        if not pending:
+            return
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            item = pending.pop(future)
+            try:
+                yield item, future.result()
+            except OSError as e:
+                yield item, e
+
+
+def _algorithm_arg():
+    algorithm = request.args.get('algo', 'sha256')
+    if algorithm not in checksum_algorithms:
+        raise ValueError(f'algo must be one of {", ".join(checksum_algorithms)}')
+    return algorithm
+
+
+@app.route("/_api/checksum/", methods=['GET'])
+@app.route("/_api/checksum/<path:path>", methods=['GET'])
+def api_checksum(path="/"):
+    """Return the digest (`algo`: sha256 or blake2b) of a file, or of every file below a folder.
+
+    Digests are cached persistently per file version, so checking an unchanged
+    file again only costs a stat. For a folder, files are hashed on a pool of
+    CHECKSUM_WORKERS threads and streamed back as NDJSON as they complete,
+    followed by a summary line.
+    """
+    rel_path = '/' + path.strip('/')
+    try:
+        algorithm = _algorithm_arg()
+    except ValueError as e:
+        log_request_info('checksum', rel_path, 'GET', status_code=400, error=str(e))
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    try:
+        if _is_internal(rel_path):
+            raise FileNotFoundError(rel_path)
+        target = _resolve_path_in_base(rel_path)
+        is_dir = target.is_dir()
+        if not is_dir:
+            digest, st, cached = checksum_cache.digest(target, algorithm)
+    except (ValueError, OSError):
+        log_request_info('checksum', rel_path, 'GET', status_code=404, error='Not found')
+        return jsonify({'ok': False, 'error': 'Not found'}), 404
+
+    if not is_dir:
+        log_request_info('checksum', rel_path, 'GET', status_code=200, algorithm=algorithm, cached=cached)
+        return jsonify({'path': rel_path, 'algo': algorithm, 'digest': digest, 'size': st.st_size,
+                        'mtime': st.st_mtime, 'cached': cached})
+
+    def generate():
+        totals = {'files': 0, 'cached': 0, 'errors': 0}
+        started = time.monotonic()
+        for (file_rel, file_path, _), result in _map_bounded(
+                lambda item: checksum_cache.digest(item[1], algorithm), _walk_files(rel_path)):
+            if isinstance(result, Exception):
+                totals['errors'] += 1
+                yield json.dumps({'path': file_rel, 'error': str(result)}) + '\n'
+                continue
+            digest, st, cached = result
+            totals['files'] += 1
+            totals['cached'] += cached
+            yield json.dumps({'path': file_rel, 'digest': digest, 'size': st.st_size, 'cached': cached}) + '\n'
+        yield json.dumps({'done': True, 'path': rel_path, 'algo': algorithm, **totals,
+                          'seconds': round(time.monotonic() - started, 3)}) + '\n'
+
+    log_request_info('checksum', rel_path, 'GET', status_code=200, algorithm=algorithm, bulk=True)
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def _probe_digest(file_path):
+    """Hash of a file's first duplicate_probe_size bytes, to split same-size files cheaply."""
+    with open(file_path, 'rb', buffering=0) as f:
+        return _hash_file(f, 'blake2b', duplicate_probe_size)
+
+
+@app.route("/_api/duplicates/", methods=['GET'])
+@app.route("/_api/duplicates/<path:path>", methods=['GET'])
+def api_duplicates(path="/"):
+    """Report groups of identical files below a folder, largest reclaimable space first.
+
+    Files are grouped by size, then by a hash of their first 64 KB, and only
+    the files still sharing both are hashed in full (with `algo`, through the
+    checksum cache). Hard links to one file are counted once. Files smaller
+    than `min_size` (default 1) are ignored.
+    """
+    rel_path = '/' + path.strip('/')
+    try:
+        algorithm = _algorithm_arg()
+        min_size = _int_arg('min_size', 1, 0, 2 ** 63)
+        limit = _int_arg('limit', 1000, 1, api_max_page_size)
+        if _is_internal(rel_path) or not _resolve_path_in_base(rel_path).is_dir():
+            log_request_info('duplicates', rel_path, 'GET', status_code=404, error='Not found')
+            return jsonify({'ok': False, 'error': 'Not found'}), 404
+    except ValueError as e:
+        log_request_info('duplicates', rel_path, 'GET', status_code=400, error=str(e))
+        return jsonify({'ok': False, 'error': str(e)}), 400
+
+    started = time.monotonic()
+    by_size = {}
+    seen = set()
+    scanned = 0
+    for file_rel, file_path, st in _walk_files(rel_path):
+        scanned += 1
+        if st.st_size < min_size or (st.st_dev, st.st_ino) in seen:
+            continue
+        seen.add((st.st_dev, st.st_ino))
+        by_size.setdefault(st.st_size, []).append((file_rel, file_path, st))
+    candidates = [item for group in by_size.values() if len(group) > 1 for item in group]
+
+    # Files whose full digest is already cached skip the probe. The others are grouped by it,
+    # and only those that can still match another file are hashed in full.
+    by_digest = {}
+    uncached = []
+    for item in candidates:
+        digest = checksum_cache.lookup(item[2], algorithm)
+        if digest is not None:
+            by_digest.setdefault((item[2].st_size, digest), []).append(item)
+        else:
+            uncached.append(item)
+    cached_sizes = {size for size, _ in by_digest}
+    by_probe = {}
+    for item, probe in _map_bounded(lambda item: _probe_digest(item[1]), uncached):
+        if not isinstance(probe, Exception):
+            by_probe.setdefault((item[2].st_size, probe), []).append(item)
+    to_hash = [item for (size, _), group in by_probe.items() if len(group) > 1 or size in cached_sizes
+               for item in group]
+    for item, result in _map_bounded(lambda item: checksum_cache.digest(item[1], algorithm), to_hash):
+        if not isinstance(result, Exception):
+            by_digest.setdefault((item[2].st_size, result[0]), []).append(item)
+
+    groups = [{'size': size, 'digest': digest, 'paths': sorted(item[0] for item in group),
+               'wasted': size * (len(group) - 1)}
+              for (size, digest), group in by_digest.items() if len(group) > 1]
+    groups.sort(key=lambda group: group['wasted'], reverse=True)
+    log_request_info('duplicates', rel_path, 'GET', status_code=200, files=scanned, groups=len(groups))
+    return jsonify({'path': rel_path, 'algo': algorithm, 'files': scanned, 'candidates': len(candidates),
+                    'hashed': len(to_hash),
+                    'wasted_bytes': sum(group['wasted'] for group in groups), 'groups': groups[:limit],
+                    'seconds': round(time.monotonic() - started, 3)})
+
+
+class TrashBusy(Exception):
+    """The trash job is being purged or is no longer pending."""
+
+
+class Trash:
+    """Deleted entries parked in BASE/.trash until a background reaper purges them.
+
+    delete() renames an entry to `.trash/<job id>/data`, which takes the same
+    time for a file as for a tree of millions of files, and records the job
+    in `.trash/<job id>/job.json`. Until `retention` seconds have passed,
+    restore() can move it back. After that the reaper removes the data at no
+    more than `purge_rate` entries per second, so a huge delete does not
+    starve other disk I/O.
+
+    Only one process purges at a time (the holder of an flock on
+    `.trash/.lock`), and each job is flocked while it is purged or restored,
+    so the two never race. Finished jobs are kept for a day for status queries.
+    """
+
+    job_ttl = 24 * 3600
+
+    def __init__(self, root, retention, purge_rate):
+        self.dir = os.path.join(root, trash_name)
+        self.retention = retention
+        self.purge_rate = purge_rate
+        self.owner = False
+        self.purged = 0
+
+    def start(self):
+        threading.Thread(target=self._run, name='trash-reaper', daemon=True).start()
+
+    def _job_dir(self, job_id):
+        if not re.fullmatch(r'[0-9a-f]{32}', job_id or ''):
+            raise ValueError('Invalid job id')
+        return os.path.join(self.dir, job_id)
+
+    def _write_job(self, job_dir, job):
+        tmp_path = os.path.join(job_dir, 'job.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, os.path.join(job_dir, 'job.json'))
+
+    def job(self, job_id):
+        """Return the job record for `job_id`, or None if there is no such job."""
+        try:
+            with open(os.path.join(self._job_dir(job_id), 'job.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def jobs(self):
+        """Return every known job, newest first."""
+        try:
+            names = os.listdir(self.dir)
+        except FileNotFoundError:
+            return []
+        jobs = [job for job in map(self.job, names) if job is not None]
+        return sorted(jobs, key=lambda job: job['deleted_at'], reverse=True)
+
+    def delete(self, rel_path, entry_path):
+        """Move the entry at `entry_path` (shown to users as `rel_path`) into the trash; return its job."""
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.dir, job_id)
+        os.makedirs(job_dir)
+        now = time.time()
+        job = {'job_id': job_id, 'path': rel_path, 'state': 'pending', 'deleted_at': now,
+               'purge_after': now + self.retention, 'removed': 0, 'finished_at': None, 'error': None}
+        self._write_job(job_dir, job)
+        try:
+            os.rename(entry_path, os.path.join(job_dir, 'data'))
+        except OSError:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+        return job
+
+    def restore(self, job_id):
+        """Move a pending job's entry back to where it was deleted from; return the updated job.
+
+        Raises ValueError for unknown jobs, TrashBusy if the job is no longer
+        pending, FileExistsError if something new now occupies the path and
+        FileNotFoundError if the folder it was deleted from no longer exists.
+        """
+        job_dir = self._job_dir(job_id)
+        if self.job(job_id) is None:
+            raise ValueError('Unknown job')
+        with open(os.path.join(job_dir, 'lock'), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise TrashBusy('Job is being purged') from None
+            job = self.job(job_id)
+            if job['state'] != 'pending':
+                raise TrashBusy(f"Job is {job['state']}")
+            target = _resolve_path_in_base(posixpath.dirname(job['path'])) / posixpath.basename(job['path'])
+            if not os.path.isdir(target.parent):
+                raise FileNotFoundError(f"Folder {posixpath.dirname(job['path'])} no longer exists; "
+                                        f"recreate it to restore {posixpath.basename(job['path'])}")
+            if os.path.lexists(target):
+                raise FileExistsError(f"{job['path']} already exists")
+            os.rename(os.path.join(job_dir, 'data'), target)
+            job.update(state='restored', finished_at=time.time())
+            self._write_job(job_dir, job)
+        return job
+
+    def _purge(self, job_dir, job):
+        """Delete a job's data bottom-up, throttled to `purge_rate` entries per second."""
+        data = os.path.join(job_dir, 'data')
+        started = time.monotonic()
+        removed = resumed_at = job['removed']
+
+        def throttle():
+            nonlocal removed
+            removed += 1
+            self.purged += 1
+            if removed % 1000 == 0:
+                job['removed'] = removed
+                self._write_job(job_dir, job)
+            if self.purge_rate > 0:
+                ahead = (removed - resumed_at) / self.purge_rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+        if os.path.isdir(data) and not os.path.islink(data):
+            for dirpath, dirnames, filenames in os.walk(data, topdown=False):
+                for name in filenames:
+                    os.unlink(os.path.join(dirpath, name))
+                    throttle()
+                for name in dirnames:
+                    child = os.path.join(dirpath, name)
+                    os.unlink(child) if os.path.islink(child) else os.rmdir(child)
+                    throttle()
+            os.rmdir(data)
+        elif os.path.lexists(data):
+            os.unlink(data)
+        self.purged += 1
+        job.update(state='done', removed=removed + 1, finished_at=time.time())
+
+    def reap(self):
+        """Purge every job past its retention and forget finished jobs older than a day."""
+        for job in self.jobs():
+            job_dir = os.path.join(self.dir, job['job_id'])
+            if job['state'] in ('pending', 'purging') and job['purge_after'] <= time.time():
+                with open(os.path.join(job_dir, 'lock'), 'a') as lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # Being restored right now
+                    job = self.job(job['job_id'])
+                    if job['state'] not in ('pending', 'purging'):
+                        continue
+                    job['state'] = 'purging'
+                    self._write_job(job_dir, job)
+                    try:
+                        self._purge(job_dir, job)
+                    except OSError as e:
+                        job.update(state='failed', error=str(e), finished_at=time.time())
+                    self._write_job(job_dir, job)
+            elif job['finished_at'] is not None and job['finished_at'] + self.job_ttl <= time.time():
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+    def _run(self):
+        lock_file = None
+        while True:
+            if not self.owner and os.path.isdir(self.dir):
+                try:
+                    lock_file = lock_file or open(os.path.join(self.dir, '.lock'), 'a')
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self.owner = True
+                except OSError:
+                    pass  # Another worker is reaping; try again later in case it exits
+            if self.owner:
+                try:
+                    self.reap()
+                except Exception as e:
+                    print(f"Trash reaper failed: {e}")
+            time.sleep(min(max(self.retention, 1), 30))
+
+    def stats(self):
+        jobs = self.jobs()
+        return {'owner': self.owner, 'purged_entries': self.purged,
+                'pending': sum(job['state'] == 'pending' for job in jobs),
+                'purging': sum(job['state'] == 'purging' for job in jobs)}
+
+
+trash = Trash(base, trash_retention, trash_purge_rate)
+if enable_delete:
+    trash.start()
+
+
+def _trash_job_response(job, status=200):
+    response = jsonify({'ok': True, **job, 'status_url': url_for('trash_job', job_id=job['job_id']),
+                        'restore_url': url_for('trash_restore', job_id=job['job_id'])})
+    response.status_code = status
+    return response
+
+
+@app.route('/api/entry', methods=['DELETE'])
+def delete_entry():
+    """Delete a file or folder under BASE.
+
+    Accepts `path` as query arg containing the file browser path (e.g. /a/b.txt).
+    The entry is moved to the trash at once and purged in the background after
+    TRASH_RETENTION seconds; the response (202) describes the trash job.
+    """
+    user_path = request.args.get('path') or ''
+
+    if not enable_delete:
+        log_request_info('delete', user_path, 'DELETE', status_code=403, error='Delete is disabled')
+        return jsonify({'ok': False, 'error': 'Delete is disabled'}), 403
+
+    # Forbid deleting root/empty.
+    if not user_path or user_path in ('/', '.'):
+        log_request_info('delete', user_path or '/', 'DELETE', status_code=400, error='Refusing to delete root')
+        return jsonify({'ok': False, 'error': 'Refusing to delete root'}), 400
+
+    try:
+        target = _resolve_path_in_base(user_path)
+    except ValueError as e:
+        log_request_info('delete', user_path, 'DELETE', status_code=400, error=str(e))
+        return jsonify({'ok': False, 'error': str(e)}), 400
+
+    if _is_internal(user_path):
+        log_request_info('delete', user_path, 'DELETE', status_code=404, error='Not found')
+        return jsonify({'ok': False, 'error': 'Not found'}), 404
+
+    try:
+        # Disallow deleting BASE itself.
+        if target == Path(base).resolve():
+            log_request_info('delete', user_path, 'DELETE', status_code=400, error='Refusing to delete base')
+            return jsonify({'ok': False, 'error': 'Refusing to delete base'}), 400
+
+        # Move the entry itself, never what a symlink points to.
+        rel_path = posixpath.normpath('/' + user_path.strip('/'))
+        entry_path = _resolve_path_in_base(posixpath.dirname(rel_path)) / posixpath.basename(rel_path)
+        if not os.path.lexists(entry_path):
+            log_request_info('delete', user_path, 'DELETE', status_code=404, error='Not found')
+            return jsonify({'ok': False, 'error': 'Not found'}), 404
+
+        try:
+            job = trash.delete(rel_path, entry_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # The entry is on another filesystem mounted below BASE: delete it in place.
+            if entry_path.is_dir() and not entry_path.is_symlink():
+                shutil.rmtree(entry_path)
+            else:
+                entry_path.unlink()
+            _fs_changed(posixpath.dirname(rel_path))
+            log_request_info('delete', user_path, 'DELETE', status_code=200, deleted_type='inline')
+            return jsonify({'ok': True}), 200
+
+        _fs_changed(posixpath.dirname(rel_path))
+        log_request_info('delete', user_path, 'DELETE', status_code=202, job_id=job['job_id'])
+        return _trash_job_response(job, 202)
+
+    except PermissionError as e:
+        log_request_info('delete', user_path, 'DELETE', status_code=403, error=str(e))
+        return jsonify({'ok': False, 'error': 'Permission denied'}), 403
+    except Exception as e:
+        log_request_info('delete', user_path, 'DELETE', status_code=500, error=str(e))
+        return jsonify({'ok': False, 'error': str(e)}), 500
+
+
+@app.route('/_api/trash', methods=['GET'])
+def trash_jobs():
+    """List delete jobs, newest first."""
+    jobs = trash.jobs()
+    log_request_info('trash', '/', 'GET', status_code=200, job_count=len(jobs))
+    return jsonify({'jobs': jobs})
+
+
+@app.route('/_api/trash/<job_id>', methods=['GET'])
+def trash_job(job_id):
+    """Return the state of one delete job: pending, purging, done, failed or restored."""
+    job = trash.job(job_id)
+    if job is None:
+        log_request_info('trash', job_id, 'GET', status_code=404, error='Unknown job')
+        return jsonify({'ok': False, 'error': 'Unknown job'}), 404
+    log_request_info('trash', job_id, 'GET', status_code=200, state=job['state'])
+    return _trash_job_response(job)
+
+
+@app.route('/_api/trash/<job_id>/restore', methods=['POST'])
+def trash_restore(job_id):
+    """Undo a delete whose entry has not been purged yet."""
+    if not enable_delete:
+        log_request_info('trash_restore', job_id, 'POST', status_code=403, error='Delete is disabled')
+        return jsonify({'ok': False, 'error': 'Delete is disabled'}), 403
+    try:
+        job = trash.restore(job_id)
+    except ValueError as e:
+        log_request_info('trash_restore', job_id, 'POST', status_code=404, error=str(e))
+        return jsonify({'ok': False, 'error': str(e)}), 404
+    except (TrashBusy, FileExistsError, FileNotFoundError) as e:
+        log_request_info('trash_restore', job_id, 'POST', status_code=409, error=str(e))
+        return jsonify({'ok': False, 'error': str(e)}), 409
+
+    _fs_changed(posixpath.dirname(job['path']))
+    log_request_info('trash_restore', job['path'], 'POST', status_code=200, job_id=job_id)
+    return _trash_job_response(job)
 
 
 if __name__ == '__main__':
+    # Keep spawned thumbnail workers from running this file again (see ThumbnailCache)
+    sys.modules['__main__'] = ModuleType('__main__')
     app.run(host=host, port=port, debug=debug)
@@ -0,0 +1,245 @@
+"""ASGI entry point: serves the file browser from an asyncio event loop.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+
+The Flask views themselves (directory scans, uploads, archive generation, ...)
+run unchanged in a thread pool. What changes is how responses are delivered:
+bodies are sent from the event loop, so a client that reads slowly costs a
+socket and a little memory, not a worker. Downloads are handed to the server's
+zero-copy sendfile when it offers the `http.response.zerocopysend` extension,
+and are otherwise read from disk by the pool one block at a time, in between
+sends. Request bodies are pulled from the event loop as the view reads them.
+"""
+import asyncio
+import contextvars
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.wsgi import _RangeWrapper
+
+from app import app as flask_app
+
+# Threads running Flask views; each request holds one only while its view runs
+# (and while it reads the request body), not while its response is being sent.
+asgi_threads = int(os.getenv('ASGI_THREADS', 64))
+print(f"  ASGI_THREADS: {asgi_threads}")
+
+# Bytes read per step when sending a file without zero-copy. Each slow client can
+# have about this much queued in its socket buffer, so it bounds memory per client.
+send_chunk_size = 64 * 1024
+
+executor = ThreadPoolExecutor(max_workers=asgi_threads, thread_name_prefix='asgi')
+
+
+class FileWrapper:
+    """`wsgi.file_wrapper` that lets the event loop send the file instead of iterating it in a thread."""
+
+    def __init__(self, file, buffer_size=8192):
+        self.file = file
+        self.buffer_size = buffer_size
+
+    def seekable(self):
+        return hasattr(self.file, 'seekable') and self.file.seekable()
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def tell(self):
+        return self.file.tell()
+
+    def fileno(self):
+        try:
+            return self.file.fileno()
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.file.read(self.buffer_size)
+        if data:
+            return data
+        raise StopIteration()
+
+    def close(self):
+        if hasattr(self.file, 'close'):
+            self.file.close()
+
+
+class RequestBody(io.RawIOBase):
+    """`wsgi.input` for a view running in the pool: pulls body messages from the event loop on demand."""
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.buffer = bytearray()
+        self.more_body = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.more_body and not self.buffer:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message['type'] == 'http.disconnect':
+                self.more_body = False
+                raise ClientDisconnected()
+            self.buffer += message.get('body', b'')
+            self.more_body = message.get('more_body', False)
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        del self.buffer[:size]
+        return size
+
+
+def _environ(scope, body):
+    """Build a WSGI environ for an ASGI HTTP scope."""
+    script_name = scope.get('root_path', '')
+    path = scope['path']
+    if script_name and path.startswith(script_name):
+        path = path[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # WSGI strings are latin-1 decoded bytes; ASGI paths are already UTF-8 decoded
+        'SCRIPT_NAME': script_name.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BufferedReader(body),
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': FileWrapper,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        if name in environ:
+            # Repeated headers are joined with commas, except cookies (RFC 6265 section 5.4)
+            value = f"{environ[name]}{'; ' if name == 'HTTP_COOKIE' else ','}{value}"
+        environ[name] = value
+    return environ
+
+
+def _file_body(body):
+    """Return (file wrapper, offset, length or None for "to the end") if `body` is a file, else None."""
+    if isinstance(body, FileWrapper) and body.fileno() is not None:
+        return body, body.tell(), None
+    if isinstance(body, _RangeWrapper) and isinstance(body.iterable, FileWrapper) and body.iterable.fileno() is not None:
+        return body.iterable, body.start_byte, body.byte_range
+    return None
+
+
+async def _send_file(scope, send, disconnected, file_wrapper, offset, length):
+    loop = asyncio.get_running_loop()
+    if 'http.response.zerocopysend' in scope.get('extensions', {}):
+        message = {'type': 'http.response.zerocopysend', 'file': file_wrapper.file, 'offset': offset,
+                   'more_body': False}
+        if length is not None:
+            message['count'] = length
+        await send(message)
+        return
+
+    fd = file_wrapper.fileno()
+    while (length is None or length > 0) and not disconnected.is_set():
+        size = send_chunk_size if length is None else min(send_chunk_size, length)
+        chunk = await loop.run_in_executor(executor, os.pread, fd, size, offset)
+        if not chunk:
+            break
+        offset += len(chunk)
+        if length is not None:
+            length -= len(chunk)
+        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def _watch_disconnect(receive, disconnected):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    disconnected.set()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    loop = asyncio.get_running_loop()
+    # Every call for this request (the view, then each step of a streamed body) runs in
+    # the same context, so stream_with_context generators keep their request context.
+    context = contextvars.copy_context()
+    request_body = RequestBody(receive, loop)
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and started:
+            raise exc_info[1].with_traceback(exc_info[2])
+        started[:] = [status, headers]
+
+    def call(fn, *args):
+        return loop.run_in_executor(executor, context.run, fn, *args)
+
+    body = await call(flask_app, _environ(scope, request_body), start_response)
+    watcher = None
+    try:
+        iterator = None
+        first_chunk = b''
+        if not started:
+            # The application may call start_response on its first iteration
+            iterator = iter(body)
+            first_chunk = await call(next, iterator, b'')
+        status, headers = started
+        await send({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+
+        # Stop reading or generating the body (e.g. an archive) once the client has gone away.
+        # The view has returned, so whatever it left of the request body is discarded.
+        disconnected = asyncio.Event()
+        request_body.more_body = False
+        watcher = loop.create_task(_watch_disconnect(receive, disconnected))
+
+        file_body = _file_body(body) if iterator is None else None
+        if file_body is not None:
+            await _send_file(scope, send, disconnected, *file_body)
+            return
+
+        iterator = iterator or iter(body)
+        chunk = first_chunk
+        while chunk is not None and not disconnected.is_set():
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await call(next, iterator, None)
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if hasattr(body, 'close'):
+            await call(body.close)
@@ -0,0 +1,62 @@
+"""Building the row URLs of a large folder listing.
+
+    python benchmarks/entry_urls.py [entries]
+
+"Before" calls url_for() for each row's link, delete URL and preview URL, as
+listings did; "after" uses app.EntryUrls, which resolves the route prefixes
+once and then only quotes and concatenates. Both run inside one request
+context with a script root, as behind a proxy with X-Forwarded-Prefix.
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('BASE', tempfile.mkdtemp(prefix='bench-base-'))
+
+import app  # noqa: E402
+from flask import url_for  # noqa: E402
+
+ROUNDS = 3
+FOLDER = '/builds/nightly'
+
+
+def legacy_urls(path, name):
+    clean_path = f'{path}/{name}'.replace('//', '/')
+    return (url_for('root', path=f'{path}/{name}'.lstrip('/')),
+            url_for('delete_entry', path=clean_path),
+            url_for('api_preview', path=clean_path.lstrip('/')))
+
+
+def entry_urls(path, name):
+    clean_path = f'{path}/{name}'.replace('//', '/')
+    urls = app._entry_urls()
+    return urls.root(f'{path}/{name}'), urls.delete_entry(clean_path), urls.preview(clean_path)
+
+
+def best(fn, names):
+    times = []
+    for _ in range(ROUNDS):
+        with app.app.test_request_context('/', environ_overrides={'SCRIPT_NAME': '/files'}):
+            start = time.perf_counter()
+            for name in names:
+                fn(FOLDER, name)
+            times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    names = [f'build #{i} (final).log' for i in range(count)]
+    with app.app.test_request_context('/', environ_overrides={'SCRIPT_NAME': '/files'}):
+        assert all(legacy_urls(FOLDER, name) == entry_urls(FOLDER, name) for name in names[:1000])
+    before = best(legacy_urls, names)
+    after = best(entry_urls, names)
+    print(f'{count} entries, 3 URLs each, best of {ROUNDS}')
+    print(f'before: {before * 1000:8.1f} ms ({before / count * 1e6:6.2f} us/entry)')
+    print(f'after:  {after * 1000:8.1f} ms ({after / count * 1e6:6.2f} us/entry)')
+
+
+if __name__ == '__main__':
+    main()
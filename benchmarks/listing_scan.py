@@ -0,0 +1,104 @@
+"""Folder listing scan: stat calls and latency, per-entry Path.stat() vs one os.scandir pass.
+
+    python benchmarks/listing_scan.py [entries ...]
+
+Builds folders of 1k, 10k and 100k files (and a few subfolders) in a temporary
+directory and times gathering the sorted listing records, the part of a page
+view that touches the filesystem. "Before" is the original iterdir()/stat()
+code sorted by date; "after" is app._scan_dir + app._sort_entries.
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('BASE', tempfile.mkdtemp(prefix='bench-base-'))
+
+import app  # noqa: E402
+
+stat_calls = 0
+
+
+def _counting(fn):
+    def wrapper(*args, **kwargs):
+        global stat_calls
+        stat_calls += 1
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+class _CountingEntry:
+    """os.DirEntry proxy counting stat() calls (DirEntry is a C type and cannot be patched)."""
+
+    def __init__(self, entry):
+        self._entry = entry
+
+    def stat(self, **kwargs):
+        global stat_calls
+        stat_calls += 1
+        return self._entry.stat(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._entry, name)
+
+
+class _CountingScandir:
+    def __init__(self, it):
+        self._it = it
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._it.close()
+
+    def __iter__(self):
+        return (_CountingEntry(entry) for entry in self._it)
+
+
+def legacy_listing(loc):
+    files = list(loc.iterdir())
+    files.sort(key=lambda x: (not x.is_dir(), x.name[0] != '.', x.stat().st_mtime))
+    return [(f.name, f.is_dir(), f.stat().st_size, f.stat().st_mtime) for f in files]
+
+
+def scandir_listing(loc):
+    return app._sort_entries(app._scan_dir(loc), 'date')
+
+
+def measure(fn, loc, repeat=3):
+    global stat_calls
+    best = float('inf')
+    for _ in range(repeat):
+        stat_calls = 0
+        start = time.perf_counter()
+        fn(loc)
+        best = min(best, time.perf_counter() - start)
+    return best, stat_calls
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    os.stat, os.lstat = _counting(os.stat), _counting(os.lstat)
+    real_scandir = os.scandir
+    os.scandir = lambda path: _CountingScandir(real_scandir(path))
+
+    print(f'{"entries":>8} {"before stats":>13} {"before ms":>10} {"after stats":>12} {"after ms":>9}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            loc = Path(tmp) / str(size)
+            loc.mkdir()
+            for i in range(size):
+                if i % 100 == 0:
+                    (loc / f'dir{i}').mkdir()
+                else:
+                    (loc / f'file{i}.txt').touch()
+            before, before_stats = measure(legacy_listing, loc)
+            after, after_stats = measure(scandir_listing, loc)
+            print(f'{size:>8} {before_stats:>13} {before * 1000:>10.1f} {after_stats:>12} {after * 1000:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Per-request cost of log_request_info on the request thread.
+
+    python benchmarks/log_event.py
+
+"Before" is the original log_request_info (a dict with an ISO timestamp and
+copied headers) with the record formatted to JSON on the request thread, as
+logging_loki.LokiHandler does before its push. "After" is the RequestEvent
+path: the request thread only captures the event and queues it for the
+BatchingLokiHandler, whose shipping thread formats it (timed separately).
+Nothing is sent over the network in either case.
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('BASE', tempfile.mkdtemp(prefix='bench-base-'))
+
+import app  # noqa: E402
+from flask import request  # noqa: E402
+
+ITERATIONS = 20000
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36',
+    'Referer': 'https://files.example.com/some/folder?sort_by=name',
+    'X-Forwarded-For': '203.0.113.7, 10.0.0.2',
+    'X-Real-IP': '203.0.113.7',
+}
+
+
+def legacy_log_request_info(endpoint, path, method, status_code=None, **kwargs):
+    real_ip = (request.access_route[0] if request.access_route else request.remote_addr)
+    log_data = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'endpoint': endpoint,
+        'path': path,
+        'method': method,
+        'remote_addr': real_ip,
+        'user_agent': request.headers.get('User-Agent', ''),
+        'referrer': request.referrer or '',
+        'x_forwarded_for': request.headers.get('X-Forwarded-For', ''),
+        'x_real_ip': request.headers.get('X-Real-IP', ''),
+        'request_remote_addr': request.remote_addr,
+        'access_route': list(request.access_route),
+    }
+    if status_code:
+        log_data['status_code'] = status_code
+    log_data.update(kwargs)
+    app.loki_logger.info(log_data)
+
+
+class FormatOnThreadHandler(logging.Handler):
+    """Formats each record with stdlib json on the calling thread, like the synchronous LokiHandler."""
+
+    def emit(self, record):
+        payload = {'timestamp': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+                   'level': record.levelname, 'logger': record.name}
+        payload.update(record.msg)
+        json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def per_call(fn):
+    with app.app.test_request_context('/some/folder', headers=HEADERS):
+        for _ in range(1000):
+            fn('root', '/some/folder', 'GET', status_code=200, is_directory=True, file_count=120, sort_by='name')
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            fn('root', '/some/folder', 'GET', status_code=200, is_directory=True, file_count=120, sort_by='name')
+        return (time.perf_counter() - start) / ITERATIONS * 1e6
+
+
+def main():
+    logger = app.loki_logger
+    logger.handlers[:] = [FormatOnThreadHandler()]
+    before = per_call(legacy_log_request_info)
+
+    handler = app.BatchingLokiHandler('http://127.0.0.1:9/', batch_size=10 ** 9, flush_interval=3600,
+                                      queue_size=10 ** 9)
+    handler.setFormatter(app.JsonLogFormatter())
+    logger.handlers[:] = [handler]
+    results = []
+    for rate in (1.0, 0.1):
+        app.log_verbose_sample_rate = rate
+        handler._queue.clear()
+        results.append((rate, per_call(app.log_request_info)))
+
+    records = list(handler._queue)[:ITERATIONS]
+    start = time.perf_counter()
+    for record in records:
+        handler.format(record)
+    formatting = (time.perf_counter() - start) / len(records) * 1e6
+
+    print(f'JSON encoder: {"orjson" if app.orjson is not None else "json"}')
+    print(f'before (format on request thread):         {before:6.1f} us/request')
+    for rate, cost in results:
+        print(f'after, LOG_VERBOSE_SAMPLE_RATE={rate:<4}:       {cost:6.1f} us/request')
+    print(f'after, formatting on the shipping thread:  {formatting:6.1f} us/record')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Many slow downloads against one server process, and listing latency meanwhile.
+
+    python benchmarks/slow_clients.py [asgi|gunicorn] [clients] [seconds]
+
+Starts the server on a free port over a temporary BASE holding a 50 MB file,
+then opens `clients` connections that each request the file and read it at
+about 40 KB/s with a small receive buffer. Another thread fetches /api/ every
+200 ms (5 s timeout). At the end it prints how many clients were receiving
+data at the same time, the listing latencies, and the server's threads and
+RSS (all of its processes). "asgi" is one uvicorn process running asgi.py;
+"gunicorn" is `gunicorn -w 4` with sync workers, as in the Docker image.
+"""
+import asyncio
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+FILE_SIZE = 50 * 1024 * 1024
+READ_SIZE = 4096
+READ_RATE = 40 * 1024  # bytes per second per client
+RECV_BUFFER = 16 * 1024
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, port, base):
+    env = dict(os.environ, BASE=base, LOKI_URL='', ASGI_THREADS='16')
+    if mode == 'asgi':
+        cmd = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port), '--log-level', 'warning',
+               '--backlog', '4096']
+    else:
+        cmd = [sys.executable, '-m', 'gunicorn', '-w', '4', '-b', f'127.0.0.1:{port}', '--backlog', '4096',
+               '--log-level', 'warning', 'app:app']
+    server = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/api/', timeout=1).read()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    stop_server(server)
+    raise RuntimeError('server did not start')
+
+
+def stop_server(server):
+    os.killpg(server.pid, signal.SIGTERM)
+    try:
+        server.wait(10)
+    except subprocess.TimeoutExpired:
+        os.killpg(server.pid, signal.SIGKILL)
+
+
+def process_tree(pid):
+    pids = [pid]
+    for p in pids:
+        try:
+            with open(f'/proc/{p}/task/{p}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def server_usage(pid):
+    """Return (threads, RSS in MB) summed over the server's processes."""
+    threads = rss_kb = 0
+    for p in process_tree(pid):
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith('Threads:'):
+                        threads += int(line.split()[1])
+                    elif line.startswith('VmRSS:'):
+                        rss_kb += int(line.split()[1])
+        except OSError:
+            pass
+    return threads, rss_kb / 1024
+
+
+async def slow_client(port, stop, receiving):
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+    sock.setblocking(False)
+    try:
+        await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+        reader, writer = await asyncio.open_connection(sock=sock)
+        writer.write(f'GET /api/big.bin HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        counted = False
+        while not stop.is_set():
+            chunk = await reader.read(READ_SIZE)
+            if not chunk:
+                break
+            if not counted:
+                receiving.add(id(sock))
+                counted = True
+            await asyncio.sleep(READ_SIZE / READ_RATE)
+        writer.close()
+    except OSError:
+        sock.close()
+
+
+def probe_listings(port, stop, latencies):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/api/', timeout=5).read()
+            latencies.append(time.perf_counter() - start)
+        except OSError:
+            latencies.append(None)
+        stop.wait(0.2)
+
+
+async def load(port, clients, seconds, pid):
+    stop = asyncio.Event()
+    receiving = set()
+    tasks = [asyncio.create_task(slow_client(port, stop, receiving)) for _ in range(clients)]
+    await asyncio.sleep(seconds)
+    usage = server_usage(pid)
+    peak = len(receiving)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return peak, usage
+
+
+def main():
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'asgi'
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+    with tempfile.TemporaryDirectory(prefix='bench-base-') as base:
+        with open(os.path.join(base, 'big.bin'), 'wb') as f:
+            f.truncate(FILE_SIZE)
+        port = free_port()
+        server = start_server(mode, port, base)
+        try:
+            stop = threading.Event()
+            latencies = []
+            prober = threading.Thread(target=probe_listings, args=(port, stop, latencies))
+            prober.start()
+            peak, (threads, rss) = asyncio.run(load(port, clients, seconds, server.pid))
+            stop.set()
+            prober.join()
+        finally:
+            stop_server(server)
+
+    served = [latency * 1000 for latency in latencies if latency is not None]
+    print(f'{mode}: {clients} clients reading at {READ_RATE // 1024} KB/s for {seconds:g} s')
+    print(f'clients receiving data: {peak}')
+    print(f'server threads: {threads}, RSS: {rss:.0f} MB')
+    if served:
+        print(f'listings: {len(served)} served, {len(latencies) - len(served)} timed out, '
+              f'median {statistics.median(served):.1f} ms, max {max(served):.1f} ms')
+    else:
+        print(f'listings: all {len(latencies)} timed out')
+
+
+if __name__ == '__main__':
+    main()
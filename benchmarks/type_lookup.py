@@ -0,0 +1,72 @@
+"""Resolving the icon of every file in a 100k-name listing.
+
+    python benchmarks/type_lookup.py [names]
+
+"Before" is the original get_file_icon_and_color, called with the absolute
+path as listings did (lower-case the whole path for a basename lookup, then
+splitext and two dict lookups). "After" is app.get_file_icon_and_color with
+the basename, backed by the precomputed FileTypes tables. The names mix
+common extensions, upper-case ones, compound suffixes (.tar.gz), known
+basenames (Dockerfile) and names without an extension.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('BASE', tempfile.mkdtemp(prefix='bench-base-'))
+
+import app  # noqa: E402
+
+ROUNDS = 5
+LOC = '/srv/files/projects/build-artifacts/nightly/2024-06-01'
+SUFFIXES = ['.py', '.log', '.txt', '.json', '.jpg', '.PNG', '.tar.gz', '.zip', '.csv', '.md', '.yml', '.iso',
+            '.so.1', '.c', '.H', '']
+BASENAMES = ['Dockerfile', 'Makefile', '.gitignore', 'LICENSE', 'README']
+
+
+def legacy_icon_and_color(file_name):
+    if file_name.lower() in app.file_extension_to_category:
+        category = app.file_extension_to_category[file_name.lower()]
+    else:
+        _, ext = os.path.splitext(file_name)
+        category = app.file_extension_to_category.get(ext, 'default')
+    return app.category_to_icon_and_color.get(category, ('ti ti-file', '#212529'))
+
+
+def make_names(count):
+    rng = random.Random(0)
+    names = []
+    for i in range(count):
+        if i % 50 == 0:
+            names.append(rng.choice(BASENAMES))
+        else:
+            names.append(f'artifact-{i:06d}{rng.choice(SUFFIXES)}')
+    return names
+
+
+def best(fn, args):
+    times = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for arg in args:
+            fn(arg)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    names = make_names(count)
+    paths = [os.path.join(LOC, name) for name in names]
+    before = best(legacy_icon_and_color, paths)
+    after = best(app.get_file_icon_and_color, names)
+    print(f'{count} names, best of {ROUNDS}')
+    print(f'before: {before * 1000:8.2f} ms ({before / count * 1e9:6.0f} ns/name)')
+    print(f'after:  {after * 1000:8.2f} ms ({after / count * 1e9:6.0f} ns/name)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Picking a unique upload name in a folder that already holds many "name (N)" duplicates.
+
+    python benchmarks/unique_names.py [duplicates]
+
+"Before" is the original linear probe (os.path.exists on "build (1).log",
+"build (2).log", ...); "after" is app.get_unique_filename, which seeds its
+counter from one scandir and then reserves names with O_EXCL. Each round
+adds 100 more duplicates of build.log to a folder with 10k of them.
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('BASE', tempfile.mkdtemp(prefix='bench-base-'))
+
+import app  # noqa: E402
+
+ROUNDS = 100
+
+
+def legacy_unique_filename(directory, filename):
+    base, ext = os.path.splitext(filename)
+    counter = 1
+    new_filename = filename
+    while os.path.exists(os.path.join(directory, new_filename)):
+        new_filename = f"{base} ({counter}){ext}"
+        counter += 1
+    return new_filename
+
+
+def fill(directory, duplicates):
+    open(os.path.join(directory, 'build.log'), 'w').close()
+    for i in range(1, duplicates + 1):
+        open(os.path.join(directory, f'build ({i}).log'), 'w').close()
+
+
+def run(fn, directory):
+    start = time.perf_counter()
+    first = None
+    for _ in range(ROUNDS):
+        name = fn(directory, 'build.log')
+        open(os.path.join(directory, name), 'a').close()
+        first = first if first is not None else time.perf_counter() - start
+    return first, (time.perf_counter() - start) / ROUNDS
+
+
+def main():
+    duplicates = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    with tempfile.TemporaryDirectory() as before_dir, tempfile.TemporaryDirectory() as after_dir:
+        fill(before_dir, duplicates)
+        fill(after_dir, duplicates)
+        before = run(legacy_unique_filename, before_dir)
+        after = run(app.get_unique_filename, after_dir)
+    print(f'{duplicates} existing duplicates, {ROUNDS} more uploads')
+    print(f'before: first {before[0] * 1000:8.2f} ms, mean {before[1] * 1000:8.2f} ms/upload')
+    print(f'after:  first {after[0] * 1000:8.2f} ms, mean {after[1] * 1000:8.2f} ms/upload')
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,7 @@ Fetch root CA certificates from localhost/files/api/certs and install them into:
 Must be run with: sudo -E python3 install_ca.py
 """
 
+import hashlib
 import json
 import os
 import pathlib
@@ -16,11 +17,23 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 import urllib.error
+import urllib.parse
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 BASE_URL = "http://localhost"
 CERTS_API = f"{BASE_URL}/files/api/certificate"
+CHECKSUM_API = f"{BASE_URL}/files/_api/checksum"
+SYSTEM_CA_DIR = pathlib.Path("/usr/local/share/ca-certificates")
+
+SEGMENT_SIZE = 8 * 1024 * 1024
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_RETRIES = 3
+CHUNK_SIZE = 256 * 1024
 
 
 def get_real_user():
@@ -54,9 +67,9 @@ def fetch_cert_list() -> list[dict]:
     """Fetch the list of certificates from the API."""
     print(f"[*] Fetching cert list from {CERTS_API}...")
     try:
-        with urllib.request.urlopen(CERTS_API, timeout=10) as response:
-            data = json.loads(response.read().decode())
-            contents = data.get("contents", [])
+        # Stream the listing as NDJSON so entries are processed as they arrive
+        with urllib.request.urlopen(f"{CERTS_API}?format=ndjson&sort_by=none", timeout=10) as response:
+            contents = (json.loads(line) for line in response if line.strip())
             # Filter to only files with .crt or .pem extension
             certs = [
                 item for item in contents
@@ -73,22 +86,155 @@ def fetch_cert_list() -> list[dict]:
         sys.exit(1)
 
 
+class RemoteFileChanged(Exception):
+    """The file on the server changed while it was being downloaded."""
+
+
+def _probe(url: str, timeout: float):
+    """Return (size, validator, accepts_ranges) for url using a HEAD request."""
+    with urllib.request.urlopen(urllib.request.Request(url, method="HEAD"), timeout=timeout) as response:
+        size = response.headers.get("Content-Length")
+        validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+        accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        return (int(size) if size is not None else None), validator, accepts_ranges
+
+
+def _fetch_segment(url: str, part: pathlib.Path, start: int, stop: int, validator: str, timeout: float):
+    """Download bytes [start, stop) of url into the same offsets of part."""
+    headers = {"Range": f"bytes={start}-{stop - 1}"}
+    if validator:
+        headers["If-Range"] = validator
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as response:
+        # A 200 means If-Range failed (or ranges were ignored): the file is not the one we started with
+        if response.status != 206 or not response.headers.get("Content-Range", "").startswith(f"bytes {start}-"):
+            raise RemoteFileChanged(url)
+        fd = os.open(part, os.O_WRONLY)
+        try:
+            offset = start
+            while offset < stop:
+                chunk = response.read(min(CHUNK_SIZE, stop - offset))
+                if not chunk:
+                    raise urllib.error.URLError(f"connection closed at byte {offset}")
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+        finally:
+            os.close(fd)
+
+
+def _fetch_whole(url: str, part: pathlib.Path, timeout: float):
+    """Download url into part with a single plain GET."""
+    with urllib.request.urlopen(url, timeout=timeout) as response, open(part, "wb") as f:
+        shutil.copyfileobj(response, f, CHUNK_SIZE)
+
+
+def download_file(url: str, dest: pathlib.Path, segment_size: int = SEGMENT_SIZE,
+                  workers: int = DOWNLOAD_WORKERS, retries: int = DOWNLOAD_RETRIES, timeout: float = 10):
+    """Download url to dest, fetching large files as concurrent byte ranges.
+
+    Data goes to `<dest>.part` and finished segments are recorded in
+    `<dest>.part.json`, so running the download again resumes where it
+    stopped as long as the server still reports the same ETag/Last-Modified.
+    dest only appears, atomically, once the download is complete.
+    """
+    part = dest.with_name(dest.name + ".part")
+    state_path = dest.with_name(dest.name + ".part.json")
+    size, validator, accepts_ranges = _probe(url, timeout)
+
+    if not accepts_ranges or size is None or size <= segment_size:
+        _fetch_whole(url, part, timeout)
+        os.replace(part, dest)
+        state_path.unlink(missing_ok=True)
+        return
+
+    done = set()
+    try:
+        state = json.loads(state_path.read_text())
+        if state["size"] == size and state["validator"] == validator and state["segment_size"] == segment_size:
+            done = set(state["done"])
+    except (OSError, ValueError, KeyError):
+        pass
+    if not done or not part.exists():
+        done = set()
+        with open(part, "wb") as f:
+            f.truncate(size)
+
+    lock = threading.Lock()
+
+    def save_state():
+        tmp = state_path.with_name(state_path.name + ".tmp")
+        tmp.write_text(json.dumps({"size": size, "validator": validator,
+                                   "segment_size": segment_size, "done": sorted(done)}))
+        os.replace(tmp, state_path)
+
+    def fetch(index: int):
+        start = index * segment_size
+        stop = min(start + segment_size, size)
+        for attempt in range(retries + 1):
+            try:
+                _fetch_segment(url, part, start, stop, validator, timeout)
+                break
+            except (urllib.error.URLError, OSError):
+                if attempt == retries:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+        with lock:
+            done.add(index)
+            save_state()
+
+    pending = [i for i in range((size + segment_size - 1) // segment_size) if i not in done]
+    if done:
+        print(f"    [*] Resuming: {len(done)} of {len(done) + len(pending)} segment(s) already downloaded.")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() re-raises the first segment failure once the pool has shut down
+        list(pool.map(fetch, pending))
+
+    os.replace(part, dest)
+    state_path.unlink(missing_ok=True)
+
+
 def fetch_cert_file(url: str, dest: pathlib.Path):
     """Download a single cert file to dest."""
     full_url = f"{BASE_URL}{url}" if url.startswith("/") else url
     print(f"    [*] Downloading {full_url}...")
     try:
-        with urllib.request.urlopen(full_url, timeout=10) as response:
-            dest.write_bytes(response.read())
+        download_file(full_url, dest)
+    except RemoteFileChanged:
+        print(f"    [!] {full_url} changed during download, starting over...")
+        dest.with_name(dest.name + ".part.json").unlink(missing_ok=True)
+        download_file(full_url, dest)
     except urllib.error.URLError as e:
         print(f"    [!] Failed to download {full_url}: {e}")
         raise
 
 
+def remote_sha256(path: str) -> Optional[str]:
+    """Ask the server for a file's SHA-256 (cached there), or None if it can't tell us."""
+    url = f"{CHECKSUM_API}/{urllib.parse.quote(path.lstrip('/'))}?algo=sha256"
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            return json.load(response)["digest"]
+    except (urllib.error.URLError, json.JSONDecodeError, KeyError):
+        return None
+
+
+def local_sha256(path: pathlib.Path) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+            return digest.hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def system_ca_path(name: str) -> pathlib.Path:
+    dest = SYSTEM_CA_DIR / name
+    return dest if dest.suffix == ".crt" else dest.with_suffix(".crt")
+
+
 def install_system_ca(cert_path: pathlib.Path):
-    dest = pathlib.Path("/usr/local/share/ca-certificates") / cert_path.name
-    if dest.suffix != ".crt":
-        dest = dest.with_suffix(".crt")
+    dest = system_ca_path(cert_path.name)
 
     print(f"    [*] Copying {cert_path} -> {dest}")
     shutil.copy2(cert_path, dest)
@@ -188,15 +334,23 @@ def install_cert(cert_info: dict, username: str, tmp_dir: pathlib.Path):
 
     print(f"\n[*] Processing: {name}")
 
-    # Download to temp dir
-    local_path = tmp_dir / name
-    try:
-        fetch_cert_file(url, local_path)
-    except urllib.error.URLError:
-        print(f"    [!] Skipping {name} due to download failure.")
-        return
-
-    install_system_ca(local_path)
+    # Skip the download if the copy already in the system store matches the server's checksum.
+    # The NSS databases are still updated from it, e.g. for Firefox profiles created since.
+    installed = system_ca_path(name)
+    remote_digest = remote_sha256(cert_info["path"])
+    if remote_digest is not None and remote_digest == local_sha256(installed):
+        print(f"    [=] {installed} is up to date, not downloading")
+        local_path = installed
+    else:
+        # Download to temp dir
+        local_path = tmp_dir / name
+        try:
+            fetch_cert_file(url, local_path)
+        except urllib.error.URLError:
+            print(f"    [!] Skipping {name} due to download failure.")
+            return
+
+        install_system_ca(local_path)
     install_chrome_nss(local_path, nickname, username)
     install_firefox_nss(local_path, nickname, username)
 
@@ -1,5 +1,22 @@
 #!/bin/bash
 
-# Run Gunicorn with the specified arguments
+# With ENABLE_METRICS, workers keep their metrics in files under PROMETHEUS_MULTIPROC_DIR so that
+# /_api/metrics can add them up; files left over from a previous run would be counted again.
+case "${ENABLE_METRICS,,}" in
+    true|1|t)
+        export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/flask-file-browser-metrics}"
+        mkdir -p "${PROMETHEUS_MULTIPROC_DIR}"
+        rm -f "${PROMETHEUS_MULTIPROC_DIR}"/*.db
+        ;;
+esac
+
+# SERVER_MODE=asgi serves the app from an event loop with Uvicorn (see asgi.py);
+# the default is Gunicorn with sync workers.
+if [ "${SERVER_MODE}" = "asgi" ]; then
+    # Forwarded headers are handled by the app's ProxyFix
+    exec uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers "${WORKERS:-4}" --no-proxy-headers --log-level info
+fi
+
+# Run Gunicorn with the specified arguments (server hooks are in gunicorn.conf.py)
 # --access-logfile - logs to stdout, --log-file - logs to stdout
-exec gunicorn -w 4 -b 0.0.0.0:5000 --access-logfile - --error-logfile - --log-level info app:app
+exec gunicorn -c gunicorn.conf.py -w "${WORKERS:-4}" -b 0.0.0.0:5000 --access-logfile - --error-logfile - --log-level info app:app
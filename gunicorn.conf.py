@@ -0,0 +1,12 @@
+"""Gunicorn server hooks (loaded with `gunicorn -c gunicorn.conf.py`, see entrypoint.sh)."""
+import os
+
+
+def child_exit(server, worker):
+    """Drop a dead worker's live metrics from the multiprocess /_api/metrics aggregation."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        try:
+            from prometheus_client import multiprocess
+        except ImportError:
+            return
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,40 @@
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+import pytest
+
+# app.py reads its configuration from the environment when it is imported.
+_tmp = tempfile.mkdtemp(prefix='flask-file-browser-tests-')
+os.environ['BASE'] = os.path.join(_tmp, 'files')
+os.environ['INDEX_PATH'] = os.path.join(_tmp, 'index.sqlite3')
+os.environ['CHECKSUM_DB'] = os.path.join(_tmp, 'checksums.sqlite3')
+os.environ['THUMBNAIL_CACHE_DIR'] = os.path.join(_tmp, 'thumbnails')
+os.environ['LOKI_URL'] = ''
+os.makedirs(os.environ['BASE'])
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    return app_module
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def folder():
+    """A fresh folder under BASE, as (absolute Path, path relative to BASE)."""
+    name = uuid.uuid4().hex
+    path = Path(app_module.base) / name
+    path.mkdir()
+    yield path, name
+    shutil.rmtree(path, ignore_errors=True)
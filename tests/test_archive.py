@@ -0,0 +1,96 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def tree(folder, tmp_path):
+    """A folder with nested files, an already-compressed file and symlinks inside and outside BASE."""
+    path, name = folder
+    (path / 'docs' / 'deep').mkdir(parents=True)
+    (path / 'notes.txt').write_bytes(b'hello ' * 100)
+    (path / 'docs' / 'a.log').write_bytes(b'log line\n' * 50)
+    (path / 'docs' / 'deep' / 'b.csv').write_bytes(b'1,2,3\n')
+    (path / 'bundle.tar.gz').write_bytes(b'\x1f\x8b' + b'z' * 200)
+    (path / 'empty').mkdir()
+    (tmp_path / 'secret.txt').write_bytes(b'outside')
+    os.symlink(tmp_path / 'secret.txt', path / 'escape.txt')
+    os.symlink(tmp_path, path / 'escape-dir')
+    os.symlink(path / 'notes.txt', path / 'link.txt')
+    os.symlink(path / 'docs', path / 'docs-link')
+    return name
+
+
+def _expected(name):
+    return {
+        f'{name}/notes.txt': b'hello ' * 100,
+        f'{name}/link.txt': b'hello ' * 100,
+        f'{name}/docs/a.log': b'log line\n' * 50,
+        f'{name}/docs/deep/b.csv': b'1,2,3\n',
+        f'{name}/bundle.tar.gz': b'\x1f\x8b' + b'z' * 200,
+    }
+
+
+def _dirs(name):
+    return {f'{name}/', f'{name}/docs/', f'{name}/docs/deep/', f'{name}/empty/'}
+
+
+@pytest.mark.parametrize('compression', ['deflate', 'store'])
+def test_zip_round_trip(client, tree, compression):
+    response = client.get(f'/_api/archive/{tree}', query_string={'compression': compression})
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == f'attachment; filename={tree}.zip'
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+        assert zf.testzip() is None
+        infos = {info.filename: info for info in zf.infolist()}
+        assert set(infos) == set(_expected(tree)) | _dirs(tree)
+        for arcname, data in _expected(tree).items():
+            assert zf.read(arcname) == data
+        expected_type = zipfile.ZIP_DEFLATED if compression == 'deflate' else zipfile.ZIP_STORED
+        assert infos[f'{tree}/notes.txt'].compress_type == expected_type
+        assert infos[f'{tree}/docs/a.log'].compress_type == expected_type
+        assert infos[f'{tree}/bundle.tar.gz'].compress_type == zipfile.ZIP_STORED
+        assert infos[f'{tree}/empty/'].is_dir()
+
+
+@pytest.mark.parametrize('fmt, mode', [('tar', 'r:'), ('tar.gz', 'r:gz')])
+def test_tar_round_trip(client, tree, fmt, mode):
+    response = client.get(f'/_api/archive/{tree}', query_string={'format': fmt})
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == f'attachment; filename={tree}.{fmt}'
+    with tarfile.open(fileobj=io.BytesIO(response.data), mode=mode) as tf:
+        members = {member.name: member for member in tf.getmembers()}
+        assert set(members) == set(_expected(tree)) | {d.rstrip('/') for d in _dirs(tree)}
+        for arcname, data in _expected(tree).items():
+            assert members[arcname].isfile()
+            assert tf.extractfile(arcname).read() == data
+        assert members[f'{tree}/empty'].isdir()
+
+
+def test_archive_of_base_is_named_files(client, tree):
+    response = client.get('/_api/archive/', query_string={'format': 'tar'})
+    assert response.headers['Content-Disposition'] == 'attachment; filename=files.tar'
+    with tarfile.open(fileobj=io.BytesIO(response.data)) as tf:
+        assert f'files/{tree}/notes.txt' in tf.getnames()
+        assert not any(name.startswith('files/.') for name in tf.getnames())
+
+
+@pytest.mark.parametrize('path', ['..%2F..', '%2E%2E', 'x/..%2F..%2F..'])
+def test_paths_outside_base_are_rejected(client, path):
+    response = client.get(f'/_api/archive/{path}')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Path escapes base directory'
+
+
+def test_symlinked_folder_outside_base_is_rejected(client, tree):
+    assert client.get(f'/_api/archive/{tree}/escape-dir').status_code == 400
+
+
+def test_unsupported_format_and_missing_folder(client, tree):
+    assert client.get(f'/_api/archive/{tree}', query_string={'format': 'rar'}).status_code == 400
+    assert client.get(f'/_api/archive/{tree}', query_string={'compression': 'lzma'}).status_code == 400
+    assert client.get(f'/_api/archive/{tree}/notes.txt').status_code == 404
+    assert client.get(f'/_api/archive/{tree}/missing').status_code == 404
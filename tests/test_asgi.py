@@ -0,0 +1,23 @@
+import io
+
+import pytest
+from werkzeug.wrappers import Request
+
+asgi = pytest.importorskip('asgi')
+
+
+def _environ(headers):
+    scope = {'type': 'http', 'method': 'GET', 'path': '/', 'query_string': b'', 'root_path': '',
+             'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]}
+    return asgi._environ(scope, io.BytesIO())
+
+
+def test_repeated_headers_are_joined_with_commas():
+    environ = _environ([('X-Forwarded-For', '203.0.113.7'), ('X-Forwarded-For', '10.0.0.2')])
+    assert environ['HTTP_X_FORWARDED_FOR'] == '203.0.113.7,10.0.0.2'
+
+
+def test_repeated_cookie_headers_are_joined_with_semicolons():
+    environ = _environ([('Cookie', 'a=1'), ('Cookie', 'b=2; c=3')])
+    assert environ['HTTP_COOKIE'] == 'a=1; b=2; c=3'
+    assert Request(environ).cookies.to_dict() == {'a': '1', 'b': '2', 'c': '3'}
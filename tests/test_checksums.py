@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_digest_is_cached_until_the_file_changes(client, folder):
+    path, name = folder
+    (path / 'a.bin').write_bytes(b'one')
+    url = f'/_api/checksum/{name}/a.bin'
+    first = client.get(url).get_json()
+    assert (first['digest'], first['cached']) == (_sha256(b'one'), False)
+    assert client.get(url).get_json()['cached'] is True
+
+    # Same size, new content and mtime
+    (path / 'a.bin').write_bytes(b'two')
+    st = (path / 'a.bin').stat()
+    os.utime(path / 'a.bin', ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    changed = client.get(url).get_json()
+    assert (changed['digest'], changed['cached']) == (_sha256(b'two'), False)
+
+    # Same mtime, new size
+    os.truncate(path / 'a.bin', 2)
+    os.utime(path / 'a.bin', ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert client.get(url).get_json() | {'mtime': None} == {
+        'path': f'/{name}/a.bin', 'algo': 'sha256', 'digest': _sha256(b'tw'), 'size': 2, 'mtime': None,
+        'cached': False}
+    assert client.get(url + '?algo=blake2b').get_json()['digest'] == hashlib.blake2b(b'tw').hexdigest()
+
+
+def test_checksum_errors(client, folder):
+    path, name = folder
+    (path / 'a.bin').write_bytes(b'one')
+    assert client.get(f'/_api/checksum/{name}/a.bin?algo=md5').status_code == 400
+    assert client.get(f'/_api/checksum/{name}/missing').status_code == 404
+
+
+def test_folder_checksums_stream_ndjson_with_a_summary(client, folder):
+    path, name = folder
+    files = {'a.txt': b'a', 'b.txt': b'bb', 'sub/c.txt': b'ccc'}
+    (path / 'sub').mkdir()
+    for child, data in files.items():
+        (path / child).write_bytes(data)
+
+    for run in range(2):
+        response = client.get(f'/_api/checksum/{name}')
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        *results, summary = lines
+        assert {item['path']: (item['digest'], item['size'], item['cached']) for item in results} == {
+            f'/{name}/{child}': (_sha256(data), len(data), run == 1) for child, data in files.items()}
+        assert summary | {'seconds': None} == {'done': True, 'path': f'/{name}', 'algo': 'sha256', 'files': 3,
+                                               'cached': 3 * run, 'errors': 0, 'seconds': None}
+
+
+def test_duplicates_report(client, folder):
+    path, name = folder
+    (path / 'sub').mkdir()
+    (path / 'a.iso').write_bytes(b'x' * 100)
+    (path / 'sub' / 'b.iso').write_bytes(b'x' * 100)
+    (path / 'c.iso').write_bytes(b'y' * 100)  # Same size, different content
+    os.link(path / 'c.iso', path / 'c-link.iso')  # A hard link is not a duplicate
+    (path / 'd.txt').write_bytes(b'x')
+    (path / 'e.txt').write_bytes(b'x')
+
+    for run in range(2):
+        report = client.get(f'/_api/duplicates/{name}', query_string={'min_size': 2}).get_json()
+        assert (report['files'], report['candidates']) == (6, 3)
+        assert report['groups'] == [{'size': 100, 'digest': _sha256(b'x' * 100),
+                                     'paths': [f'/{name}/a.iso', f'/{name}/sub/b.iso'], 'wasted': 100}]
+        assert report['wasted_bytes'] == 100
+    # The second run reuses the cached digests of a.iso and b.iso and only hashes c.iso, whose size matches them
+    assert report['hashed'] == 1
+
+    report = client.get(f'/_api/duplicates/{name}').get_json()
+    assert [group['paths'] for group in report['groups']] == [
+        [f'/{name}/a.iso', f'/{name}/sub/b.iso'], [f'/{name}/d.txt', f'/{name}/e.txt']]
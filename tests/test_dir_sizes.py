@@ -0,0 +1,72 @@
+import pytest
+
+
+@pytest.fixture
+def sizes(app, tmp_path, monkeypatch):
+    """A size index over BASE whose refreshes only run when the test calls run()."""
+    idx = app.PathIndex(str(tmp_path / 'index.sqlite3'), app.base, 3600, on_refresh=app._sizes_changed)
+    idx._create_schema()
+
+    def run():
+        for rel_dir in idx.queued():
+            idx._refresh(rel_dir)
+        idx._queue.clear()
+        app.listing_cache.clear()
+
+    idx.run = run
+    monkeypatch.setattr(app, 'path_index', idx)
+    monkeypatch.setattr(app, 'enable_dir_sizes', True)
+    app.listing_cache.clear()
+    yield idx
+    app.listing_cache.clear()
+
+
+def _sub(client, name):
+    listing = client.get(f'/api/{name}').get_json()
+    return next(entry for entry in listing['contents'] if entry['name'] == 'sub')
+
+
+def test_unknown_folder_sizes_are_pending_and_queued(client, folder, sizes):
+    path, name = folder
+    (path / 'sub').mkdir()
+    for i in range(3):
+        (path / 'sub' / f'{i}.bin').write_bytes(b'x' * 10)
+
+    assert _sub(client, name)['size_pending'] is True
+    assert sizes.queued() == [f'/{name}']
+    response = client.get(f'/_api/du/{name}/sub')
+    assert response.status_code == 202
+    assert response.get_json()['pending'] is True
+    assert sizes.queued() == [f'/{name}', f'/{name}/sub']
+
+    sizes.run()
+    sub = _sub(client, name)
+    assert (sub['size_bytes'], sub['size_pending']) == (30, False)
+    du = client.get(f'/_api/du/{name}').get_json()
+    assert (du['bytes'], du['pending']) == (30, False)
+    assert [(child['name'], child['bytes'], child['pending']) for child in du['children']] == [('sub', 30, False)]
+    assert sizes.queued() == []
+
+
+def test_last_known_size_is_served_while_a_refresh_is_queued(client, folder, sizes):
+    path, name = folder
+    (path / 'sub').mkdir()
+    (path / 'sub' / 'a.bin').write_bytes(b'x' * 10)
+    sizes.refresh_dir(f'/{name}')
+    sizes.run()
+
+    (path / 'sub' / 'b.bin').write_bytes(b'x' * 10)
+    sizes.refresh_dir(f'/{name}/sub')
+    sub = _sub(client, name)
+    assert (sub['size_bytes'], sub['size_pending']) == (10, True)
+    du = client.get(f'/_api/du/{name}').get_json()
+    assert (du['bytes'], du['pending']) == (10, True)
+
+    sizes.run()
+    assert _sub(client, name)['size_bytes'] == 20
+    assert client.get(f'/_api/du/{name}').get_json()['pending'] is False
+
+
+def test_du_of_missing_folder_is_404(client, sizes):
+    assert client.get('/_api/du/does-not-exist').status_code == 404
+    assert sizes.queued() == []
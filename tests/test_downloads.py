@@ -0,0 +1,127 @@
+import os
+import re
+
+import pytest
+
+DATA = bytes(range(256)) * 4  # 1024 bytes
+
+
+@pytest.fixture
+def download(folder):
+    path, name = folder
+    (path / 'data.bin').write_bytes(DATA)
+    return path / 'data.bin', f'/api/{name}/data.bin'
+
+
+def _parts(response):
+    """Split a multipart/byteranges body into [(Content-Range, body)]."""
+    boundary = response.mimetype_params['boundary'].encode()
+    parts = []
+    for part in response.data.split(b'--' + boundary)[1:-1]:
+        head, _, body = part.partition(b'\r\n\r\n')
+        content_range = re.search(rb'Content-Range: (.*)', head).group(1).decode().strip()
+        parts.append((content_range, body[:-2]))
+    return parts
+
+
+def test_full_download_advertises_ranges(client, download):
+    _, url = download
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+
+def test_single_range(client, download):
+    _, url = download
+    response = client.get(url, headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 10-19/1024'
+    assert response.data == DATA[10:20]
+
+
+def test_suffix_range(client, download):
+    _, url = download
+    response = client.get(url, headers={'Range': 'bytes=-16'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 1008-1023/1024'
+    assert response.data == DATA[-16:]
+
+
+def test_multiple_ranges(client, download):
+    _, url = download
+    response = client.get(url, headers={'Range': 'bytes=0-3,100-109,-4'})
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    assert int(response.headers['Content-Length']) == len(response.data)
+    assert _parts(response) == [('bytes 0-3/1024', DATA[0:4]), ('bytes 100-109/1024', DATA[100:110]),
+                                ('bytes 1020-1023/1024', DATA[1020:])]
+
+
+def test_adjacent_ranges_are_merged(client, download):
+    _, url = download
+    response = client.get(url, headers={'Range': 'bytes=0-9,10-19,20-29,500-509'})
+    assert _parts(response) == [('bytes 0-29/1024', DATA[0:30]), ('bytes 500-509/1024', DATA[500:510])]
+
+
+def test_unsatisfiable_range(client, download):
+    _, url = download
+    response = client.get(url, headers={'Range': 'bytes=2000-3000'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */1024'
+
+
+@pytest.mark.parametrize('ranges', ['bytes=0-9', 'bytes=0-9,20-29'])
+def test_if_range_etag(client, download, ranges):
+    _, url = download
+    etag = client.get(url).headers['ETag']
+    assert client.get(url, headers={'Range': ranges, 'If-Range': etag}).status_code == 206
+    stale = client.get(url, headers={'Range': ranges, 'If-Range': '"0-0"'})
+    assert stale.status_code == 200
+    assert stale.data == DATA
+
+
+@pytest.mark.parametrize('ranges', ['bytes=0-9', 'bytes=0-9,20-29'])
+def test_if_range_date(client, download, ranges):
+    path, url = download
+    last_modified = client.get(url).headers['Last-Modified']
+    assert client.get(url, headers={'Range': ranges, 'If-Range': last_modified}).status_code == 206
+    mtime = path.stat().st_mtime
+    os.utime(path, (mtime + 60, mtime + 60))
+    stale = client.get(url, headers={'Range': ranges, 'If-Range': last_modified})
+    assert stale.status_code == 200
+    assert stale.data == DATA
+
+
+def test_file_truncated_while_sending_aborts(client, download):
+    path, url = download
+    response = client.get(url, headers={'Range': 'bytes=0-9,1000-1023'}, buffered=False)
+    assert response.status_code == 206
+    os.truncate(path, 100)
+    with pytest.raises(OSError):
+        b''.join(response.response)
+    response.close()
+
+
+def test_x_accel_redirect(app, client, download, monkeypatch):
+    _, url = download
+    monkeypatch.setattr(app, 'download_offload', 'nginx')
+    response = client.get(url, headers={'Range': 'bytes=0-9,20-29'})
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['X-Accel-Redirect'] == app.download_offload_prefix + url[len('/api/'):]
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    etag = response.headers['ETag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+
+@pytest.mark.parametrize('ranges', [None, 'bytes=0-9,20-29'])
+def test_x_sendfile(app, client, download, monkeypatch, ranges):
+    path, url = download
+    monkeypatch.setattr(app, 'download_offload', 'sendfile')
+    monkeypatch.setitem(app.app.config, 'USE_X_SENDFILE', True)
+    response = client.get(url, headers={'Range': ranges} if ranges else {})
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['X-Sendfile'] == str(path)
+    assert response.headers['Accept-Ranges'] == 'bytes'
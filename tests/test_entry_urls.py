@@ -0,0 +1,45 @@
+import pytest
+from flask import url_for
+
+NAMES = [
+    'plain.txt',
+    'with space.txt',
+    'percent%20sign%.log',
+    'hash#and?question.md',
+    'plus+amp&semi;eq=.csv',
+    "quotes'\"and`backtick",
+    'brackets[]{}<>|\\^',
+    'colon:at@dollar$!*(),',
+    'tilde~dash-under_dot.',
+    'ünïcödé-名前-😀.json',
+    ' leading and trailing ',
+    '.hidden',
+]
+SCRIPT_ROOTS = ['', '/files', '/my files/ünï', '/a+b&c']
+
+
+@pytest.mark.parametrize('script_root', SCRIPT_ROOTS)
+@pytest.mark.parametrize('name', NAMES)
+def test_entry_urls_match_url_for(app, name, script_root):
+    with app.app.test_request_context('/', environ_overrides={'SCRIPT_NAME': script_root}):
+        urls = app.EntryUrls()
+        for path in (f'/{name}', f'/dir/{name}', f'/{name}/{name}'):
+            rel = path.lstrip('/')
+            assert urls.root(path) == url_for('root', path=rel)
+            assert urls.root(path, sort_by='name_desc') == url_for('root', path=rel, sort_by='name_desc')
+            assert urls.delete_entry(path) == url_for('delete_entry', path=path)
+            assert urls.preview(path) == url_for('api_preview', path=rel)
+            assert urls.thumb(path, 1700000000.75) == url_for('api_thumb', path=rel, size=64, v=1700000000)
+
+
+def test_listing_urls_match_url_for_behind_a_prefix(app, client, folder):
+    path, name = folder
+    for child in NAMES:
+        (path / child).write_bytes(b'x')
+    response = client.get(f'/api/{name}', headers={'X-Forwarded-Prefix': '/files'})
+    contents = response.get_json()['contents']
+    assert len(contents) == len(NAMES)
+    with app.app.test_request_context('/', environ_overrides={'SCRIPT_NAME': '/files'}):
+        for entry in contents:
+            assert entry['url'] == url_for('root', path=f"{name}/{entry['name']}")
+            assert entry['delete_url'] == url_for('delete_entry', path=entry['path'])
@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture
+def legacy(app):
+    """get_file_icon_and_color as it was before the FileTypes tables, called with a basename."""
+    def icon_and_color(file_name):
+        if file_name.lower() in app.file_extension_to_category:
+            category = app.file_extension_to_category[file_name.lower()]
+        else:
+            _, ext = os.path.splitext(file_name)
+            category = app.file_extension_to_category.get(ext, 'default')
+        return app.category_to_icon_and_color.get(category, ('ti ti-file', '#212529'))
+
+    return icon_and_color
+
+
+@pytest.mark.parametrize('name', ['main.py', 'app.log', 'notes.txt', 'data.json', 'photo.jpg', 'table.csv',
+                                  'disk.iso', 'backup.zip', 'archive.tar.gz', 'config.yml', 'libfoo.so.1',
+                                  'Dockerfile', 'Makefile', '.gitignore', 'README', 'LICENSE', 'noextension',
+                                  'trailing.', '.hidden', 'weird.unknownext'])
+def test_same_icon_as_the_old_lookup(app, legacy, name):
+    assert app.get_file_icon_and_color(name) == legacy(name)
+    assert app.get_file_icon_and_color(f'/srv/files/some.dir/{name}') == legacy(name)
+
+
+@pytest.mark.parametrize('name', ['PHOTO.JPG', 'Main.PY', 'App.Log', 'ARCHIVE.TAR.GZ', 'DOCKERFILE', 'start.S'])
+def test_upper_case_names_match_their_lower_case_form(app, legacy, name):
+    # The old lookup was case-sensitive for extensions; the tables ignore case.
+    assert app.get_file_icon_and_color(name) == legacy(name.lower())
+    assert app.get_file_category(name) == app.get_file_category(name.lower())
+
+
+def test_every_built_in_key_resolves_as_before(app, legacy):
+    for key, category in app.file_extension_to_category.items():
+        name = f'file{key}' if key.startswith('.') else key
+        if key.count('.') > 1:
+            continue  # Multi-part suffixes were never matched whole before
+        assert app.get_file_icon_and_color(name) == legacy(name), key
+        assert app.get_file_category(name) == category, key
+
+
+def test_longest_suffix_wins_and_mapping_file_overrides(app, tmp_path, monkeypatch):
+    mapping = tmp_path / 'file-types.json'
+    mapping.write_text(json.dumps({
+        'categories': {'backup': ['ti ti-database-export', '#123456']},
+        'extensions': {'.tar.gz': 'backup', '.BAK': 'backup', 'Jenkinsfile': 'backup'},
+    }))
+    types = app._load_file_types(str(mapping))
+    assert types.names['jenkinsfile'] == ('backup', 'ti ti-database-export', '#123456')
+    assert types.suffixes['.bak'] == ('backup', 'ti ti-database-export', '#123456')
+    assert '.gz' in types.compound_tails
+    monkeypatch.setattr(app, 'file_types', types)
+    assert app.get_file_category('site-2024.TAR.GZ') == 'backup'
+    assert app.get_file_category('access.log.gz') == 'archive'
+    assert app.get_file_icon_and_color('old.bak') == ('ti ti-database-export', '#123456')
+    with pytest.raises(TypeError):
+        types.suffixes['.new'] = ('x', 'y', 'z')
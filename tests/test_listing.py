@@ -0,0 +1,229 @@
+import base64
+import json
+import os
+from collections import OrderedDict
+
+import pytest
+
+
+@pytest.fixture
+def scans(app, monkeypatch):
+    """Count os.scandir calls."""
+    calls = []
+    scandir = os.scandir
+
+    def counting(path='.'):
+        calls.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', counting)
+    app.listing_cache.clear()
+    yield calls
+    app.listing_cache.clear()
+
+
+@pytest.fixture
+def files(folder):
+    path, name = folder
+    for i in range(5):
+        (path / f'{i}.txt').write_bytes(b'x')
+    return name
+
+
+def test_client_render_decision_reuses_the_cached_listing(app, client, files, scans, monkeypatch):
+    monkeypatch.setattr(app, 'client_render_threshold', 3)
+    assert b'columnsUrl' in client.get(f'/{files}').data
+    assert len(scans) == 1
+    assert client.get(f'/api/{files}?format=columns&sort_by=name').get_json()['total'] == 5
+    assert b'columnsUrl' in client.get(f'/{files}').data
+    assert len(scans) == 1
+
+
+def test_server_render_decision_reuses_the_cached_listing(app, client, files, scans, monkeypatch):
+    monkeypatch.setattr(app, 'client_render_threshold', 100)
+    for _ in range(2):
+        response = client.get(f'/{files}')
+        assert b'columnsUrl' not in response.data
+        assert b'4.txt' in response.data
+    assert len(scans) == 1
+
+
+def test_folder_removed_during_request_is_404(app, client, files, monkeypatch):
+    monkeypatch.setattr(app, '_get_folder', lambda *args, **kwargs: None)
+    assert client.get(f'/{files}').status_code == 404
+
+
+def test_columnar_previews_match_server_preview_urls(client, folder):
+    path, name = folder
+    for child in ('app.log', 'notes.txt', 'data.json', 'table.csv', 'photo.jpg', 'archive.tar.gz', 'README'):
+        (path / child).write_bytes(b'x')
+    (path / 'sub').mkdir()
+    columns = client.get(f'/api/{name}?format=columns&sort_by=name').get_json()
+    contents = client.get(f'/api/{name}?sort_by=name').get_json()['contents']
+    assert [entry['name'] for entry in contents] == columns['names']
+    assert columns['previews'] == [int(entry['preview_url'] is not None) for entry in contents]
+    assert sum(columns['previews']) == 4
+
+
+def test_client_render_page_knows_the_preview_url(app, client, files):
+    assert b'const previewRootUrl = "/_api/preview/";' in client.get(f'/{files}?render=client').data
+
+
+@pytest.fixture
+def mixed(folder):
+    """A folder with a subfolder, a dotfile and files of distinct sizes and mtimes."""
+    path, name = folder
+    (path / 'sub').mkdir()
+    for i, child in enumerate(['.hidden', 'B.txt', 'a.txt', 'c.log', 'D', 'e.bin', 'f']):
+        (path / child).write_bytes(b'x' * (7 * i + 3))
+        os.utime(path / child, (1_600_000_000 + 11 * i, 1_600_000_000 + (37 * i) % 17))
+    return name
+
+
+@pytest.mark.parametrize('sort_by', ['name', 'name_desc', 'date', 'date_desc', 'size', 'size_desc'])
+def test_cursor_pages_match_the_full_listing(app, client, mixed, sort_by):
+    app.listing_cache.clear()
+    full = [entry['name'] for entry in client.get(f'/api/{mixed}?sort_by={sort_by}').get_json()['contents']]
+    names, cursor = [], None
+    while True:
+        query = {'sort_by': sort_by, 'limit': 3, **({'cursor': cursor} if cursor else {})}
+        page = client.get(f'/api/{mixed}', query_string=query).get_json()
+        assert page['total'] == len(full)
+        names += [entry['name'] for entry in page['contents']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert names == full
+    offsets = [client.get(f'/api/{mixed}', query_string={'sort_by': sort_by, 'limit': 3, 'offset': offset})
+               .get_json()['contents'] for offset in (0, 3, 6)]
+    assert [entry['name'] for page in offsets for entry in page] == full
+
+
+def _raw_cursor(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _cursor(data):
+    return _raw_cursor(json.dumps(data).encode())
+
+
+@pytest.mark.parametrize('sort_by, cursor', [
+    ('name', 'not base64!'),
+    ('name', _raw_cursor(b'not json')),
+    ('name', _cursor([1, 2, 3, 4])),
+    ('name', _cursor({'sort_by': 'name'})),
+    ('name', _cursor({'sort_by': 'date', 'key': [False, True, 1.0, 'a']})),
+    ('name', _cursor({'sort_by': 'name', 'key': [False, True, 'a']})),
+    ('name', _cursor({'sort_by': 'name', 'key': 'abcd'})),
+    ('name', _cursor({'sort_by': 'name', 'key': [False, True, 1, 'a']})),
+    ('date', _cursor({'sort_by': 'date', 'key': [True, True, 'x', 'y']})),
+    ('date', _cursor({'sort_by': 'date', 'key': [True, True, True, 'y']})),
+    ('size_desc', _cursor({'sort_by': 'size_desc', 'key': [0, 1, 10, 'y']})),
+    ('size', _cursor({'sort_by': 'size', 'key': [True, True, 10, None]})),
+])
+def test_malformed_cursor_is_400(client, mixed, sort_by, cursor):
+    response = client.get(f'/api/{mixed}', query_string={'sort_by': sort_by, 'limit': 3, 'cursor': cursor})
+    assert response.status_code == 400
+    assert response.get_json()['ok'] is False
+
+
+@pytest.fixture
+def log_file(folder):
+    path, name = folder
+    (path / 'app.log').write_bytes(b''.join(b'line %d\n' % i for i in range(1, 301)))
+    return path / 'app.log', f'/_api/preview/{name}/app.log'
+
+
+def test_preview_tail_and_head(client, log_file):
+    path, url = log_file
+    tail = client.get(url, query_string={'lines': 3}).get_json()
+    assert (tail['mode'], tail['lines'], tail['end_offset']) == ('tail', ['line 298', 'line 299', 'line 300'],
+                                                                path.stat().st_size)
+    head = client.get(url, query_string={'mode': 'head', 'lines': 2}).get_json()
+    assert (head['lines'], head['first_line'], head['end_offset']) == (['line 1', 'line 2'], 1, 14)
+
+
+def test_preview_lines_seeks_by_line_number(app, client, log_file, monkeypatch):
+    monkeypatch.setattr(app, 'line_index_block', 64)  # Many index blocks in a small file
+    monkeypatch.setattr(app, '_line_indexes', OrderedDict())
+    _, url = log_file
+    page = client.get(url, query_string={'mode': 'lines', 'start': 150, 'lines': 2}).get_json()
+    assert (page['lines'], page['first_line'], page['total_lines']) == (['line 150', 'line 151'], 150, 300)
+
+
+def test_preview_of_binary_file_is_415(client, folder):
+    path, name = folder
+    (path / 'data.bin').write_bytes(b'abc\0def')
+    response = client.get(f'/_api/preview/{name}/data.bin')
+    assert response.status_code == 415
+    assert response.get_json()['ok'] is False
+
+
+def test_preview_follow_streams_appended_lines(app, client, log_file, monkeypatch):
+    monkeypatch.setattr(app, 'follow_poll_interval', 0.01)
+    monkeypatch.setattr(app, 'follow_max_duration', 0.3)
+    path, url = log_file
+    size = path.stat().st_size
+    response = client.get(url, query_string={'mode': 'follow'}, buffered=False,
+                          environ_overrides={'wsgi.multithread': True})
+    assert response.mimetype == 'text/event-stream'
+    with path.open('ab') as f:
+        f.write(b'new 1\nnew 2\npartial')
+    body = b''.join(response.response).decode()
+    response.close()
+    assert body.startswith('retry: 10\n\n')
+    assert f'id: {size + 12}\nevent: lines\ndata: ["new 1", "new 2"]\n\n' in body
+    assert 'partial' not in body
+
+    resumed = client.get(url, query_string={'mode': 'follow'}, headers={'Last-Event-ID': str(size + 6)},
+                         environ_overrides={'wsgi.multithread': True})
+    assert 'data: ["new 2"]' in resumed.data.decode()
+
+
+def test_preview_follow_needs_a_threaded_server(client, log_file):
+    _, url = log_file
+    assert client.get(url, query_string={'mode': 'follow'}).status_code == 501
+
+
+@pytest.mark.parametrize('sort_by', ['name', 'date_desc', 'size'])
+@pytest.mark.parametrize('human', [False, True])
+def test_streamed_listings_match_the_json_listing(client, mixed, sort_by, human):
+    query = {'sort_by': sort_by, **({'human': 1} if human else {})}
+    listing = client.get(f'/api/{mixed}', query_string=query).get_json()
+
+    ndjson = client.get(f'/api/{mixed}', query_string={**query, 'format': 'ndjson'})
+    assert ndjson.mimetype == 'application/x-ndjson'
+    assert [json.loads(line) for line in ndjson.data.decode().splitlines()] == listing['contents']
+
+    stream = client.get(f'/api/{mixed}', query_string={**query, 'format': 'stream'})
+    assert stream.mimetype == 'application/json'
+    assert stream.get_json() == {'path': mixed, 'sort_by': sort_by, 'contents': listing['contents'],
+                                 'total': listing['total']}
+
+
+def test_unsorted_stream_has_every_entry(client, mixed):
+    listing = client.get(f'/api/{mixed}').get_json()['contents']
+    ndjson = client.get(f'/api/{mixed}', query_string={'format': 'ndjson', 'sort_by': 'none'})
+    streamed = [json.loads(line) for line in ndjson.data.decode().splitlines()]
+    assert sorted(streamed, key=lambda entry: entry['name']) == sorted(listing, key=lambda entry: entry['name'])
+
+
+@pytest.mark.parametrize('url', ['/{}', '/api/{}', '/api/{}?human=1', '/api/{}?format=columns'])
+def test_unchanged_listing_is_304_until_a_file_changes(app, client, mixed, url):
+    url = url.format(mixed)
+    first = client.get(url)
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and first.headers['Last-Modified']
+    again = client.get(url, headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == etag
+
+    changed = app.base + f'/{mixed}/a.txt'
+    with open(changed, 'ab') as f:
+        f.write(b'more')
+    app._fs_changed(f'/{mixed}')  # As the file system watcher does
+    modified = client.get(url, headers={'If-None-Match': etag})
+    assert modified.status_code == 200
+    assert modified.headers['ETag'] != etag
+    assert client.get(url, headers={'If-None-Match': modified.headers['ETag']}).status_code == 304
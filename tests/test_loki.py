@@ -0,0 +1,170 @@
+import gzip
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class FakeLoki:
+    """A local Loki push endpoint recording every request; answers with the queued status codes, then 204."""
+
+    def __init__(self):
+        self.pushes = []
+        self.statuses = []
+        self.delay = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if fake.delay:
+                    time.sleep(fake.delay)
+                status = fake.statuses.pop(0) if fake.statuses else 204
+                fake.pushes.append((status, dict(self.headers), body))
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/loki/api/v1/push'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def payloads(self, status=204):
+        result = []
+        for code, headers, body in self.pushes:
+            if code != status:
+                continue
+            if headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            result.append(json.loads(body))
+        return result
+
+    def lines(self):
+        return [json.loads(line)['message'] for payload in self.payloads()
+                for stream in payload['streams'] for _, line in stream['values']]
+
+
+@pytest.fixture
+def loki():
+    fake = FakeLoki()
+    yield fake
+    fake.server.shutdown()
+
+
+@pytest.fixture
+def make_handler(app, loki):
+    handlers = []
+
+    def make(**kwargs):
+        options = {'tags': {'application': 'files_server'}, 'batch_size': 5, 'flush_interval': 30,
+                   'backoff': 0.01, **kwargs}
+        handler = app.BatchingLokiHandler(loki.url, **options)
+        handler.setFormatter(app.JsonLogFormatter())
+        handlers.append(handler)
+        return handler
+
+    yield make
+    for handler in handlers:
+        handler.close()
+
+
+def emit(handler, count, start=0):
+    for i in range(start, start + count):
+        handler.handle(logging.makeLogRecord({'name': 'files_server', 'levelname': 'INFO',
+                                              'levelno': logging.INFO, 'msg': f'message {i}'}))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_pushes_full_batches_without_waiting_for_the_interval(loki, make_handler):
+    handler = make_handler()
+    emit(handler, 12)
+    wait_for(lambda: handler.stats()['sent'] == 10)
+    assert [len(p['streams'][0]['values']) for p in loki.payloads()] == [5, 5]
+
+    handler.close()
+    assert handler.stats()['sent'] == 12
+    assert loki.lines() == [f'message {i}' for i in range(12)]
+    assert loki.payloads()[0]['streams'][0]['stream'] == {
+        'application': 'files_server', 'severity': 'info', 'logger': 'files_server'}
+
+
+def test_flushes_partial_batch_after_interval(loki, make_handler):
+    handler = make_handler(flush_interval=0.1)
+    emit(handler, 2)
+    wait_for(lambda: handler.stats()['sent'] == 2)
+    assert len(loki.pushes) == 1
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_compression(loki, make_handler, compress):
+    handler = make_handler(compress=compress)
+    emit(handler, 5)
+    wait_for(lambda: handler.stats()['sent'] == 5)
+    _, headers, body = loki.pushes[0]
+    if compress:
+        assert headers['Content-Encoding'] == 'gzip'
+        body = gzip.decompress(body)
+    else:
+        assert 'Content-Encoding' not in headers
+    assert len(json.loads(body)['streams'][0]['values']) == 5
+
+
+def test_retries_rate_limits_and_server_errors_with_backoff(loki, make_handler):
+    loki.statuses = [429, 503, 500]
+    handler = make_handler(backoff=0.05)
+    start = time.monotonic()
+    emit(handler, 5)
+    wait_for(lambda: handler.stats()['sent'] == 5)
+    # Three failures: waits of 0.05, 0.1 and 0.2 seconds
+    assert time.monotonic() - start >= 0.35
+    assert [status for status, _, _ in loki.pushes] == [429, 503, 500, 204]
+    assert handler.stats()['retries'] == 3
+    assert handler.stats()['failed'] == 0
+
+
+def test_gives_up_after_max_retries(loki, make_handler):
+    loki.statuses = [503] * 3
+    handler = make_handler(max_retries=2)
+    emit(handler, 5)
+    wait_for(lambda: handler.stats()['failed'] == 5)
+    assert len(loki.pushes) == 3
+    assert handler.stats()['sent'] == 0
+
+
+def test_does_not_retry_client_errors(loki, make_handler):
+    loki.statuses = [400]
+    handler = make_handler()
+    emit(handler, 5)
+    wait_for(lambda: handler.stats()['failed'] == 5)
+    assert len(loki.pushes) == 1
+    assert handler.stats()['retries'] == 0
+
+
+def test_drops_oldest_records_when_queue_is_full(loki, make_handler):
+    handler = make_handler(batch_size=100, queue_size=3)
+    emit(handler, 5)
+    assert handler.stats()['queued'] == 3
+    assert handler.stats()['dropped'] == 2
+
+    handler.close()
+    assert loki.lines() == ['message 2', 'message 3', 'message 4']
+
+
+def test_slow_loki_does_not_block_logging(loki, make_handler):
+    loki.delay = 0.5
+    handler = make_handler(batch_size=50)
+    start = time.monotonic()
+    emit(handler, 100)
+    assert time.monotonic() - start < 0.2
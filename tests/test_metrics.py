@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('prometheus_client')
+
+# Metrics are set up when app.py is imported, so they are exercised in a fresh interpreter.
+SCRIPT = '''
+import os, sys
+sys.path.insert(0, sys.argv[1])
+import app
+os.makedirs(os.path.join(app.base, 'metrics'), exist_ok=True)
+open(os.path.join(app.base, 'metrics', 'file.txt'), 'wb').write(b'hello')
+client = app.app.test_client()
+assert client.get('/api/metrics/file.txt').data == b'hello'
+assert client.get('/metrics').status_code == 200
+response = client.get('/_api/metrics')
+assert response.status_code == 200, response.status_code
+sys.stdout.write('--- metrics ---\\n' + response.content_type + '\\n' + response.get_data(as_text=True))
+'''
+
+
+@pytest.mark.parametrize('multiprocess', [False, True])
+def test_metrics_exposition(tmp_path, multiprocess):
+    env = {**os.environ, 'ENABLE_METRICS': 'true', 'BASE': str(tmp_path / 'files'),
+           'INDEX_PATH': str(tmp_path / 'index.sqlite3'), 'CHECKSUM_DB': str(tmp_path / 'checksums.sqlite3')}
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    if multiprocess:
+        (tmp_path / 'prometheus').mkdir()
+        env['PROMETHEUS_MULTIPROC_DIR'] = str(tmp_path / 'prometheus')
+    (tmp_path / 'files').mkdir()
+    result = subprocess.run([sys.executable, '-c', SCRIPT, str(Path(__file__).resolve().parent.parent)],
+                            env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    content_type, _, body = result.stdout.split('--- metrics ---\n', 1)[1].partition('\n')
+    assert content_type.startswith('text/plain; version=')
+    assert ('file_browser_request_duration_seconds_count{endpoint="api_list",method="GET",status="200"} 1.0'
+            in body)
+    assert 'file_browser_response_bytes_total{endpoint="api_list"} 5.0' in body
+    assert 'file_browser_listing_entries_count{endpoint="root"} 1.0' in body
+    assert '# TYPE file_browser_request_duration_seconds histogram' in body
+
+
+def test_metrics_are_404_when_disabled(client):
+    assert client.get('/_api/metrics').status_code == 404
@@ -0,0 +1,55 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def index(app, tmp_path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    refreshed = []
+    event = threading.Event()
+
+    def on_refresh(rel_dir):
+        refreshed.append(rel_dir)
+        event.set()
+
+    idx = app.PathIndex(str(tmp_path / 'index.sqlite3'), str(root), 3600, on_refresh=on_refresh)
+    idx.root_path, idx.refreshed_dirs, idx.refreshed_event = root, refreshed, event
+    return idx
+
+
+def make_tree(root, dirs, files):
+    for d in range(dirs):
+        folder = root / 'extracted' / f'dir{d}'
+        folder.mkdir(parents=True)
+        for f in range(files):
+            (folder / f'file{d}-{f}.txt').write_bytes(b'x' * 10)
+
+
+def test_refresh_dir_only_queues(index):
+    index._create_schema()
+    make_tree(index.root_path, 50, 20)
+    start = time.monotonic()
+    index.refresh_dir('/')
+    assert time.monotonic() - start < 0.05
+    assert index.queued() == ['/']
+    assert index.search('file7-3', 10) == ([], False)
+
+
+def test_queued_directories_are_crawled_in_the_background(index):
+    index.start()
+    deadline = time.monotonic() + 5
+    while index.last_crawl is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    make_tree(index.root_path, 50, 20)
+    index.refresh_dir('/')
+    assert index.refreshed_event.wait(5)
+    assert index.refreshed_dirs == ['/']
+    rows, _ = index.search('file49-19.txt', 10)
+    assert [row[0] for row in rows] == ['/extracted/dir49/file49-19.txt']
+    assert index.dir_size('/extracted') == (50 * 20 * 10, 50 * 20)
+    assert index.queued() == []
@@ -0,0 +1,42 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+# Top-level folders whose names match the fixed endpoints.
+NAMES = ['archive', 'checksum', 'du', 'duplicates', 'entry', 'metrics', 'preview', 'search', 'stats', 'thumb',
+         'trash', 'upload']
+
+
+@pytest.fixture
+def top_level(app):
+    created = []
+
+    def make(name):
+        path = Path(app.base) / name
+        path.mkdir()
+        (path / 'file.txt').write_bytes(b'hello')
+        created.append(path)
+        return path
+
+    yield make
+    for path in created:
+        shutil.rmtree(path, ignore_errors=True)
+    app.listing_cache.clear()
+
+
+@pytest.mark.parametrize('name', NAMES)
+def test_api_path_is_not_shadowed_by_endpoints(client, top_level, name):
+    top_level(name)
+    response = client.get(f'/api/{name}/file.txt')
+    assert response.status_code == 200
+    assert response.data == b'hello'
+    listing = client.get(f'/api/{name}')
+    assert listing.status_code == 200
+    assert [entry['name'] for entry in listing.get_json()['contents']] == ['file.txt']
+
+
+def test_reserved_api_folder_is_hidden(app, client, top_level):
+    top_level(app.api_prefix)
+    assert app.api_prefix not in [entry['name'] for entry in client.get('/api/').get_json()['contents']]
+    assert client.get(f'/api/{app.api_prefix}/file.txt').status_code == 404
@@ -0,0 +1,78 @@
+import pytest
+
+
+@pytest.fixture
+def search(app, folder, tmp_path, monkeypatch):
+    """An indexed folder of names to search, as (folder name, query helper)."""
+    path, name = folder
+    (path / 'reports' / 'old').mkdir(parents=True)
+    for child in ('report', 'report.txt', 'annual-report.pdf', 'reports/q1-report.csv', 'reports/old/REPORT.md',
+                  'notes.txt', 'ab.txt', 'xaby.log', '100%_done.txt'):
+        (path / child).write_bytes(b'x')
+
+    idx = app.PathIndex(str(tmp_path / 'index.sqlite3'), app.base, 3600)
+    idx._create_schema()
+    idx.refresh_dir(f'/{name}')
+    for rel_dir in idx.queued():
+        idx._refresh(rel_dir)
+    monkeypatch.setattr(app, 'path_index', idx)
+    monkeypatch.setattr(app, 'enable_search', True)
+
+    def query(q, **args):
+        response = app.app.test_client().get('/_api/search', query_string={'q': q, 'path': f'/{name}', **args})
+        assert response.status_code == 200
+        return response.get_json()
+
+    return name, query
+
+
+def _paths(result, name):
+    return [entry['path'].removeprefix(f'/{name}/') for entry in result['results']]
+
+
+def test_trigram_query_ranks_exact_then_prefix_matches(app, search):
+    name, query = search
+    assert app.path_index.fts, 'SQLite was built without the FTS5 trigram tokenizer'
+    result = query('report')
+    paths = _paths(result, name)
+    assert paths[0] == 'report'
+    assert set(paths[1:4]) == {'reports', 'reports/old/REPORT.md', 'report.txt'}
+    assert set(paths[4:]) == {'annual-report.pdf', 'reports/q1-report.csv'}
+    assert result['next_offset'] is None
+    first = result['results'][0]
+    assert (first['name'], first['is_folder']) == ('report', False)
+    assert next(entry for entry in result['results'] if entry['name'] == 'reports')['is_folder'] is True
+    assert query('REPORT.M')['results'][0]['name'] == 'REPORT.md'
+
+
+def test_search_pages_with_offset_and_limit(search):
+    name, query = search
+    everything = _paths(query('report'), name)
+    pages, offset = [], 0
+    while offset is not None:
+        page = query('report', limit=4, offset=offset)
+        assert page['limit'] == 4
+        pages += _paths(page, name)
+        offset = page['next_offset']
+    assert pages == everything
+    assert query('report', limit=4, offset=4)['next_offset'] is None
+
+
+def test_short_queries_fall_back_to_substring_matching(search):
+    name, query = search
+    assert _paths(query('ab'), name) == ['ab.txt', 'xaby.log']
+    assert _paths(query('%_'), name) == ['100%_done.txt']
+    assert _paths(query('zz'), name) == []
+
+
+def test_search_is_restricted_to_a_subtree(search):
+    name, query = search
+    assert _paths(query('report', path=f'/{name}/reports'), name) == ['reports/old/REPORT.md',
+                                                                      'reports/q1-report.csv']
+
+
+def test_search_errors(app, client, search, monkeypatch):
+    assert client.get('/_api/search').status_code == 400
+    assert client.get('/_api/search?q=report&limit=0').status_code == 400
+    monkeypatch.setattr(app, 'enable_search', False)
+    assert client.get('/_api/search?q=report').status_code == 403
@@ -0,0 +1,75 @@
+import io
+import os
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture
+def thumbs(app, tmp_path, monkeypatch):
+    cache = app.ThumbnailCache(str(tmp_path / 'thumbnails'), 1024 ** 2, 1)
+    monkeypatch.setattr(app, 'thumbnail_cache', cache)
+    yield cache
+    if cache.pool is not None:
+        cache.pool.shutdown()
+
+
+def _png(path, size=(300, 200), colour='red'):
+    Image.new('RGB', size, colour).save(path, 'PNG')
+
+
+def test_thumbnail_is_rendered_once_then_served_from_the_cache(app, client, folder, thumbs):
+    path, name = folder
+    _png(path / 'photo.png')
+    url = f'/_api/thumb/{name}/photo.png?size=64'
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == app.thumbnails.output_mimetype
+    with Image.open(io.BytesIO(response.data)) as img:
+        assert img.size == (64, 43)
+    assert (thumbs.stats()['rendered'], thumbs.stats()['hits']) == (1, 0)
+
+    again = client.get(url)
+    assert again.data == response.data
+    assert (thumbs.stats()['rendered'], thumbs.stats()['hits']) == (1, 1)
+    assert client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    # A changed image gets a new cache entry
+    _png(path / 'photo.png', (100, 400), 'blue')
+    os.utime(path / 'photo.png', (1, 1))
+    with Image.open(io.BytesIO(client.get(url).data)) as img:
+        assert img.size == (16, 64)
+    assert thumbs.stats()['rendered'] == 2
+
+
+def test_thumbnail_errors(app, client, folder, thumbs, monkeypatch):
+    path, name = folder
+    _png(path / 'photo.png')
+    (path / 'notes.txt').write_bytes(b'text')
+    (path / 'broken.png').write_bytes(b'not a png')
+    assert client.get(f'/_api/thumb/{name}/photo.png?size=100').status_code == 400
+    assert client.get(f'/_api/thumb/{name}/missing.png').status_code == 404
+    assert client.get(f'/_api/thumb/{name}/notes.txt').status_code == 415
+    assert client.get(f'/_api/thumb/{name}/broken.png').get_json()['error'] == 'Unable to read image'
+    monkeypatch.setattr(app, 'thumbnail_cache', None)
+    assert client.get(f'/_api/thumb/{name}/photo.png').status_code == 404
+
+
+def test_least_recently_used_thumbnails_are_evicted(client, folder, thumbs):
+    path, name = folder
+    for i in range(3):
+        _png(path / f'{i}.png', (50 + 100 * i, 50 + 100 * i), (i * 80, 0, 0))
+        client.get(f'/_api/thumb/{name}/{i}.png?size=512')
+    files = sorted(os.path.join(dirpath, filename) for dirpath, _, filenames in os.walk(thumbs.dir)
+                   for filename in filenames if not filename.startswith('.'))
+    assert len(files) == 3
+    for age, thumb_path in enumerate(files):
+        os.utime(thumb_path, (1000 - age, 1000 - age))  # files[-1] is the least recently used
+    sizes = [os.path.getsize(thumb_path) for thumb_path in files]
+
+    thumbs.max_bytes = (sum(sizes) - sizes[-1]) / 0.9
+    thumbs.evict()
+    assert [os.path.exists(thumb_path) for thumb_path in files] == [True, True, False]
+    assert (thumbs.stats()['evicted'], thumbs.stats()['bytes']) == (1, sum(sizes[:-1]))
@@ -0,0 +1,96 @@
+import os
+
+
+def _delete(client, rel_path):
+    return client.delete('/api/entry', query_string={'path': rel_path})
+
+
+def test_delete_moves_the_entry_to_the_trash(client, folder):
+    path, name = folder
+    (path / 'a.txt').write_bytes(b'hello')
+    response = _delete(client, f'/{name}/a.txt')
+    assert response.status_code == 202
+    job = response.get_json()
+    assert (job['state'], job['path']) == ('pending', f'/{name}/a.txt')
+    assert not (path / 'a.txt').exists()
+    assert client.get(job['status_url']).get_json()['state'] == 'pending'
+
+
+def test_restore_puts_the_entry_back(client, folder):
+    path, name = folder
+    (path / 'sub').mkdir()
+    (path / 'sub' / 'a.txt').write_bytes(b'hello')
+    job = _delete(client, f'/{name}/sub').get_json()
+    response = client.post(job['restore_url'])
+    assert response.status_code == 200
+    assert response.get_json()['state'] == 'restored'
+    assert (path / 'sub' / 'a.txt').read_bytes() == b'hello'
+    assert client.post(job['restore_url']).status_code == 409
+
+
+def test_restore_into_a_missing_folder_is_409(client, folder):
+    path, name = folder
+    (path / 'sub').mkdir()
+    (path / 'sub' / 'a.txt').write_bytes(b'hello')
+    job = _delete(client, f'/{name}/sub/a.txt').get_json()
+    os.rmdir(path / 'sub')
+    response = client.post(job['restore_url'])
+    assert response.status_code == 409
+    assert f'/{name}/sub no longer exists' in response.get_json()['error']
+    assert client.get(job['status_url']).get_json()['state'] == 'pending'
+
+    (path / 'sub').mkdir()
+    assert client.post(job['restore_url']).status_code == 200
+    assert (path / 'sub' / 'a.txt').read_bytes() == b'hello'
+
+
+def test_restore_over_a_new_entry_is_409(client, folder):
+    path, name = folder
+    (path / 'a.txt').write_bytes(b'old')
+    job = _delete(client, f'/{name}/a.txt').get_json()
+    (path / 'a.txt').write_bytes(b'new')
+    assert client.post(job['restore_url']).status_code == 409
+    assert (path / 'a.txt').read_bytes() == b'new'
+
+
+def test_unknown_job_is_404(client):
+    assert client.get('/_api/trash/' + '0' * 32).status_code == 404
+    assert client.post('/_api/trash/not-a-job/restore').status_code == 404
+
+
+def test_reaper_purges_jobs_past_their_retention(app, tmp_path):
+    trash = app.Trash(str(tmp_path), 60, 0)
+    (tmp_path / 'tree' / 'sub').mkdir(parents=True)
+    for child in ('a', 'sub/b', 'sub/c'):
+        (tmp_path / 'tree' / child).write_bytes(b'x')
+    kept = trash.delete('/kept', str(tmp_path / 'tree'))
+    (tmp_path / 'file').write_bytes(b'x')
+    trash.retention = 0
+    expired = trash.delete('/expired', str(tmp_path / 'file'))
+
+    trash.reap()
+    assert trash.job(kept['job_id'])['state'] == 'pending'
+    done = trash.job(expired['job_id'])
+    assert (done['state'], done['removed']) == ('done', 1)
+    assert not os.path.lexists(os.path.join(trash.dir, expired['job_id'], 'data'))
+
+    job = trash.job(kept['job_id'])
+    job['purge_after'] = 0
+    trash._write_job(os.path.join(trash.dir, kept['job_id']), job)
+    trash.reap()
+    done = trash.job(kept['job_id'])
+    assert (done['state'], done['removed']) == ('done', 5)
+    assert not os.path.lexists(os.path.join(trash.dir, kept['job_id'], 'data'))
+
+
+def test_delete_disabled(app, client, folder, monkeypatch):
+    path, name = folder
+    (path / 'a.txt').write_bytes(b'hello')
+    monkeypatch.setattr(app, 'enable_delete', False)
+    app.listing_cache.clear()
+    assert _delete(client, f'/{name}/a.txt').status_code == 403
+    assert (path / 'a.txt').exists()
+    assert not any(entry['is_deletable'] for entry in client.get(f'/api/{name}').get_json()['contents'])
+    assert b'data-delete-url=' not in client.get(f'/{name}?render=server').data
+    assert b'const enableDelete = false;' in client.get(f'/{name}?render=client').data
+    app.listing_cache.clear()
@@ -0,0 +1,181 @@
+import errno
+import fcntl
+import io
+import os
+import time
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def uploads_enabled(app, monkeypatch):
+    monkeypatch.setattr(app, 'enable_upload', True)
+
+
+def create(client, name, size=None):
+    data = {'current_path': '/' + name, 'filename': 'big.bin'}
+    if size is not None:
+        data['size'] = str(size)
+    response = client.post('/_api/upload', data=data)
+    assert response.status_code == 201
+    return response.get_json()['upload_id']
+
+
+def patch(client, upload_id, offset, body, chunked=False):
+    headers = {'Upload-Offset': str(offset)}
+    if chunked:
+        # No Content-Length: the body is only delimited by the end of the stream.
+        headers['Transfer-Encoding'] = 'chunked'
+        return client.patch(f'/_api/upload/{upload_id}', headers=headers, input_stream=io.BytesIO(body),
+                            environ_overrides={'wsgi.input_terminated': True})
+    return client.patch(f'/_api/upload/{upload_id}', headers=headers, data=body)
+
+
+def test_resumable_upload(client, folder):
+    path, name = folder
+    upload_id = create(client, name, 6)
+    assert patch(client, upload_id, 0, b'abc').headers['Upload-Offset'] == '3'
+    assert patch(client, upload_id, 0, b'abc').status_code == 409
+    assert patch(client, upload_id, 3, b'def', chunked=True).headers['Upload-Offset'] == '6'
+    assert client.post(f'/_api/upload/{upload_id}/finalize').get_json()['filename'] == 'big.bin'
+    assert (path / 'big.bin').read_bytes() == b'abcdef'
+
+
+@pytest.mark.parametrize('chunked', [False, True])
+def test_append_past_declared_size_is_rejected(client, folder, chunked):
+    _, name = folder
+    upload_id = create(client, name, 4)
+    assert patch(client, upload_id, 0, b'ab').status_code == 200
+    response = patch(client, upload_id, 2, b'cdefgh', chunked=chunked)
+    assert response.status_code == 413
+    assert response.get_json()['offset'] == 2
+    assert client.head(f'/_api/upload/{upload_id}').headers['Upload-Offset'] == '2'
+
+
+def test_session_routes_require_uploads_enabled(app, client, folder, monkeypatch):
+    _, name = folder
+    upload_id = create(client, name)
+    monkeypatch.setattr(app, 'enable_upload', False)
+    assert client.head(f'/_api/upload/{upload_id}').status_code == 403
+    assert patch(client, upload_id, 0, b'abc').status_code == 403
+    assert client.post(f'/_api/upload/{upload_id}/finalize').status_code == 403
+    assert client.delete(f'/_api/upload/{upload_id}').status_code == 403
+
+
+def test_expiry_keeps_sessions_that_are_still_receiving_data(app, client, folder):
+    _, name = folder
+    active, idle = create(client, name), create(client, name)
+    old = time.time() - app.upload_session_ttl - 60
+    for upload_id in (active, idle):
+        for session_path in app._upload_session_paths(upload_id):
+            os.utime(session_path, (old, old))
+    assert patch(client, active, 0, b'abc').status_code == 200  # Touches only the data file
+
+    create(client, name)  # Expires idle sessions
+    assert client.head(f'/_api/upload/{active}').headers['Upload-Offset'] == '3'
+    assert client.head(f'/_api/upload/{idle}').status_code == 404
+    assert not any(os.path.exists(session_path) for session_path in app._upload_session_paths(idle))
+
+
+def test_form_upload_failure_removes_reserved_name(client, folder, monkeypatch):
+    from werkzeug.datastructures import FileStorage
+
+    path, name = folder
+
+    def disk_full(self, dst, *args, **kwargs):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(FileStorage, 'save', disk_full)
+    response = client.post('/' + name, data={'current_path': '/' + name, 'file': (io.BytesIO(b'data'), 'a.txt')})
+    assert response.status_code == 500
+    assert list(path.iterdir()) == []
+
+
+@pytest.mark.parametrize('error, status_code', [(errno.ENOENT, 404), (errno.EPERM, 500)])
+def test_finalize_failure_removes_reserved_name(app, client, folder, monkeypatch, error, status_code):
+    path, name = folder
+    upload_id = create(client, name, 3)
+    patch(client, upload_id, 0, b'abc')
+    _, part_path = app._upload_session_paths(upload_id)
+    replace = os.replace
+
+    def failing_replace(src, dst):
+        if src == part_path:
+            raise OSError(error, os.strerror(error))
+        return replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', failing_replace)
+    assert client.post(f'/_api/upload/{upload_id}/finalize').status_code == status_code
+    assert list(path.iterdir()) == []
+    assert client.head(f'/_api/upload/{upload_id}').headers['Upload-Offset'] == '3'
+
+
+def test_finalize_waits_for_a_running_append(app, client, folder):
+    path, name = folder
+    upload_id = create(client, name)
+    patch(client, upload_id, 0, b'abc')
+    _, part_path = app._upload_session_paths(upload_id)
+    with open(part_path, 'r+b') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)  # As held by _append_upload while writing
+        response = client.post(f'/_api/upload/{upload_id}/finalize')
+    assert response.status_code == 409
+    assert list(path.iterdir()) == []
+    assert client.post(f'/_api/upload/{upload_id}/finalize').status_code == 200
+    assert (path / 'big.bin').read_bytes() == b'abc'
+
+
+@pytest.mark.parametrize('upload_id', ['not-an-id', '0' * 32])
+def test_append_to_unknown_upload_is_404(client, upload_id):
+    response = patch(client, upload_id, 0, b'abc')
+    assert response.status_code == 404
+    assert response.get_json()['error'] == 'Unknown upload'
+
+
+def test_append_with_bad_offset_is_400(client, folder):
+    _, name = folder
+    upload_id = create(client, name)
+    assert patch(client, upload_id, 'x', b'abc').status_code == 400
+
+
+def batch(client, name, files):
+    data = {'current_path': '/' + name, 'files': [(io.BytesIO(body), filename) for filename, body in files]}
+    return client.post('/_api/upload/batch', data=data, content_type='multipart/form-data')
+
+
+def test_batch_upload_of_a_folder_tree(client, folder):
+    path, name = folder
+    (path / 'a.txt').write_bytes(b'old')
+    response = batch(client, name, [('a.txt', b'one'), ('docs/b.txt', b'two'), ('docs/deep/c.txt', b'three'),
+                                    ('../..', b'bad')])
+    assert response.status_code == 200
+    result = response.get_json()
+    assert [(item['path'], item['size']) for item in result['uploaded']] == [
+        (f'/{name}/a (1).txt', 3), (f'/{name}/docs/b.txt', 3), (f'/{name}/docs/deep/c.txt', 5)]
+    assert result['errors'] == [{'name': '../..', 'error': 'Invalid file name'}]
+    assert (path / 'docs' / 'deep' / 'c.txt').read_bytes() == b'three'
+    assert 'docs' in [entry['name'] for entry in client.get(f'/api/{name}').get_json()['contents']]
+
+
+@pytest.mark.parametrize('error', [OSError(28, 'No space left on device'), RuntimeError('client went away')])
+def test_batch_upload_failure_removes_reserved_name(client, folder, monkeypatch, error):
+    from werkzeug.datastructures import FileStorage
+
+    path, name = folder
+    save = FileStorage.save
+
+    def fail_on_b(self, dst, *args, **kwargs):
+        if self.filename == 'b.txt':
+            raise error
+        return save(self, dst, *args, **kwargs)
+
+    monkeypatch.setattr(FileStorage, 'save', fail_on_b)
+    response = batch(client, name, [('a.txt', b'one'), ('b.txt', b'two'), ('c.txt', b'three')])
+    if isinstance(error, OSError):
+        assert response.status_code == 200
+        result = response.get_json()
+        assert [item['name'] for item in result['uploaded']] == ['a.txt', 'c.txt']
+        assert result['errors'] == [{'name': 'b.txt', 'error': str(error)}]
+        assert sorted(child.name for child in path.iterdir()) == ['a.txt', 'c.txt']
+    else:
+        assert response.status_code == 500
+        assert sorted(child.name for child in path.iterdir()) == ['a.txt']
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def dispatched(app, monkeypatch):
+    """Record the folders the watcher refreshes instead of refreshing them."""
+    calls = []
+    monkeypatch.setattr(app, '_fs_changed', lambda rel_dir, update_indexes=True: calls.append(rel_dir))
+    return calls
+
+
+def test_start_does_not_walk_the_tree(app, tmp_path, dispatched, monkeypatch):
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    release = threading.Event()
+    walk_dirs = app.FsWatcher._walk_dirs
+
+    def slow_walk(self, rel_dir):
+        release.wait(5)
+        return walk_dirs(self, rel_dir)
+
+    monkeypatch.setattr(app.FsWatcher, '_walk_dirs', slow_walk)
+    watcher = app.FsWatcher(str(tmp_path), 'inotify', coalesce=0.01)
+    watcher.start()
+    assert watcher.stats()['watches'] == 0
+    release.set()
+    _wait_for(lambda: watcher.stats()['watches'] == 3)
+
+
+def test_falls_back_to_polling(app, tmp_path, dispatched, monkeypatch):
+    def no_inotify(self):
+        raise OSError(38, 'Function not implemented')
+
+    monkeypatch.setattr(app.FsWatcher, '_init_inotify', no_inotify)
+    (tmp_path / 'sub').mkdir()
+    watcher = app.FsWatcher(str(tmp_path), 'auto', coalesce=0.01, poll_interval=0.05)
+    watcher.start()
+    assert watcher.backend == 'poll'
+    time.sleep(0.1)  # Let the first snapshot be taken
+
+    (tmp_path / 'sub' / 'new.txt').write_bytes(b'x')
+    _wait_for(lambda: '/sub' in dispatched)
+    (tmp_path / 'sub' / 'new.txt').unlink()
+    (tmp_path / 'sub').rmdir()
+    _wait_for(lambda: dispatched.count('/') >= 1)
+    assert watcher.stats()['backend'] == 'poll'
+
+
+def test_explicit_inotify_backend_fails_loudly(app, tmp_path, monkeypatch):
+    def no_inotify(self):
+        raise OSError(38, 'Function not implemented')
+
+    monkeypatch.setattr(app.FsWatcher, '_init_inotify', no_inotify)
+    with pytest.raises(OSError):
+        app.FsWatcher(str(tmp_path), 'inotify').start()
+
+
+def test_watch_event_invalidates_the_cached_listing(app, client, folder):
+    path, name = folder
+    (path / 'sub').mkdir()
+    (path / 'sub' / 'a.txt').write_bytes(b'x')
+    app.listing_cache.clear()
+    watcher = app.FsWatcher(app.base, 'inotify', coalesce=0.01, max_delay=0.1)
+    watcher.start()
+    _wait_for(lambda: f'/{name}/sub' in watcher._wds.values())
+
+    def size():
+        return client.get(f'/api/{name}/sub').get_json()['contents'][0]['size_bytes']
+
+    assert size() == 1
+    # Rewriting a file in place leaves the folder's mtime alone, so only the watch event can refresh it
+    (path / 'sub' / 'a.txt').write_bytes(b'xyz')
+    _wait_for(lambda: watcher.stats()['dispatched'] >= 1)
+    assert size() == 3
@@ -0,0 +1,28 @@
+"""Thumbnail rendering with Pillow, run in a process pool by app.py.
+
+Kept out of app.py so that pool processes only import Pillow, not the web app.
+"""
+import os
+
+from PIL import Image, ImageOps
+
+Image.init()
+
+# Extensions of the image formats Pillow can read
+suffixes = frozenset(ext for ext, fmt in Image.registered_extensions().items() if fmt in Image.OPEN)
+
+# WebP keeps transparency and is far smaller than PNG; not every Pillow build has it
+output_format, output_mimetype = ('WEBP', 'image/webp') if 'WEBP' in Image.SAVE else ('PNG', 'image/png')
+
+
+def render(src, dest, size):
+    """Write a thumbnail of the image at `src`, fitting in size x size pixels, to `dest`; return its size in bytes."""
+    with Image.open(src) as img:
+        # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale, which is most of the work for large photos
+        img.draft('RGB', (size, size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size))
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+        img.save(dest, output_format, quality=80)
+    return os.path.getsize(dest)